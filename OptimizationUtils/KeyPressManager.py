@@ -1,20 +1,44 @@
 #!/usr/bin/env python
 """
+Window management and key presses for the visualization of the optimization.
+
+Nothing GUI related is initialized in headless mode, which is detected automatically when there is no display, or
+forced by setting the environment variable OPTIMIZATION_UTILS_HEADLESS=1.
 """
 
 # -------------------------------------------------------------------------------
 # --- IMPORTS (standard, then third party, then my own modules)
 # -------------------------------------------------------------------------------
+import os
+import sys
+import threading
 import time
 
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 
+from OptimizationUtils.lazy import lazyImport
+
+cv2 = lazyImport('cv2')
+plt = lazyImport('matplotlib.pyplot')
+
 
 # -------------------------------------------------------------------------------
 # --- FUNCTIONS
 # -------------------------------------------------------------------------------
+def isDisplayAvailable():
+    """ Checks if windows can be shown.
+
+    :return: False if headless mode is forced with the environment variable OPTIMIZATION_UTILS_HEADLESS, or if there
+    is no X11 or wayland display (on linux and other unix systems). True otherwise.
+    """
+    if os.environ.get('OPTIMIZATION_UTILS_HEADLESS', '0').lower() not in ['', '0', 'false', 'no']:
+        return False
+
+    if sys.platform.startswith('linux') or 'bsd' in sys.platform:
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True  # windows and macos always have a display
+
+
 def drawAxis3D(ax, transform, text, axis_scale=0.1, line_width=1.0):
     pt_origin = np.array([[0, 0, 0, 1]], dtype=np.float).transpose()
     x_axis = np.array([[0, 0, 0, 1], [axis_scale, 0, 0, 1]], dtype=np.float).transpose()
@@ -36,57 +60,124 @@ def drawAxis3D(ax, transform, text, axis_scale=0.1, line_width=1.0):
 # CLASS
 # -------------------------------------------------------------------------------
 class WindowManager:
+    """ Waits for key presses in matplotlib figures and opencv windows.
+
+    Waiting is event driven: the matplotlib figures are redrawn only if they changed (are stale) and then the GUI event
+    loop blocks until a key callback stops it, or until the time to wait elapses. Keys can also be given from other
+    threads with setKey.
+    """
 
-    def __init__(self, figs=None):
+    OPENCV_SLICE = 0.05  # when waiting for both opencv and matplotlib keys, alternate between them every 50 ms
+
+    def __init__(self, figs=None, headless=None):
         """
         :type fig: figure handle or list of figure handles
+        :param headless: if True, waitForKey returns immediately without touching opencv or matplotlib. If None, it is
+        headless when there is no display.
         """
         # Handle the argument fig as a figure handle or a list of figure handles
         if type(figs) is list:
-            self.figs = figs
+            self.figs = [fig for fig in figs if fig is not None]
+        elif figs is None:
+            self.figs = []
         else:
             self.figs = [figs]
 
-        if not self.figs[0] is None:
+        self.headless = not isDisplayAvailable() if headless is None else headless
+        self.pressed_key = None
+        self.key_event = threading.Event()
+
+        if len(self.figs) > 0 and not self.headless:
             for fig in self.figs:
                 fig.canvas.mpl_connect('key_press_event', self.mplKeyPressCallback)
+            plt.show(block=False)
 
     def mplKeyPressCallback(self, event):
-        self.mpl_pressed_key = event.key
+        self.setKey(event.key)
+
+    def setKey(self, key):
+        """ Signals a key press, waking up waitForKey. May be called from any thread.
+
+        :param key: a single character, e.g. 'c'
+        """
+        self.pressed_key = key
+        self.key_event.set()
+        for fig in self.figs:
+            fig.canvas.stop_event_loop()
+
+    def drawStaleFigures(self):
+        """ Redraws the figures which changed since they were last drawn. """
+        for fig in self.figs:
+            if fig.stale:
+                fig.canvas.draw_idle()
 
     def waitForKey(self, time_to_wait=None, verbose=True, message=None):
         """
         Waits for a key to be pressed
         :return: True if should abort program, false if not
         """
-        t = time.time()
+        if self.headless:
+            return False
+
         if verbose:
             if message is None:
                 message = 'keyPressManager: Press "c" to continue or "q" to abort.'
             print(message)
 
-        self.mpl_pressed_key = None
+        deadline = None if time_to_wait is None else time.time() + time_to_wait
+        self.drawStaleFigures()
         while True:
-            key = cv2.waitKey(5)
+            key = self.blockForKey(deadline)
 
-            if not self.figs is None:
-                for fig in self.figs:
-                    fig.canvas.flush_events()
-                    fig.canvas.draw()
-                    plt.waitforbuttonpress(0.005)
-
-            if key == ord('c') or self.mpl_pressed_key == 'c':
+            if key == 'c':
                 print('Pressed "c". Continuing.')
                 return False
-            elif key == ord('q') or self.mpl_pressed_key == 'q':
+            elif key == 'q':
                 print('Pressed "q". Aborting.')
                 exit(0)
-            elif key == ord('x') or self.mpl_pressed_key == 'x':
+            elif key == 'x':
                 print('Pressed "x". Returning with code x.')
                 return 'x'
 
-            if not time_to_wait is None:
-                if (time.time() - t) > time_to_wait:
-                    if verbose:
-                        print('Time to wait elapsed. Returning.')
-                    return False
+            if deadline is not None and time.time() >= deadline:
+                if verbose:
+                    print('Time to wait elapsed. Returning.')
+                return False
+
+    def blockForKey(self, deadline):
+        """ Blocks until a key is pressed or the deadline is reached.
+
+        :param deadline: time.time() at which to return, or None to wait forever
+        :return: the pressed key, or None if no key was pressed
+        """
+        self.pressed_key = None
+        self.key_event.clear()
+        # opencv windows can only exist if some module imported opencv
+        opencv = 'cv2' in sys.modules
+
+        while not self.key_event.is_set():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+
+            if opencv:
+                # when there are also matplotlib figures, alternate between opencv and the matplotlib event loop
+                wait = remaining if len(self.figs) == 0 else self._slice(remaining)
+                t = time.time()
+                key = cv2.waitKey(0 if wait is None else max(1, int(wait * 1000)))
+                if key != -1:
+                    return chr(key & 0xFF)
+                if wait is None or time.time() - t < wait / 2:
+                    opencv = False  # waitKey returned at once, so there are no opencv windows
+
+            if len(self.figs) > 0:
+                wait = self._slice(remaining) if opencv else remaining
+                # runs the GUI event loop until a key callback stops it. A timeout of 0 means forever.
+                self.figs[0].canvas.start_event_loop(0 if wait is None else max(wait, 0.001))
+            elif not opencv:
+                self.key_event.wait(remaining)  # nothing to show, only setKey can wake us up
+
+        return self.pressed_key
+
+    def _slice(self, remaining):
+        return self.OPENCV_SLICE if remaining is None else min(remaining, self.OPENCV_SLICE)
@@ -1,50 +1,79 @@
 # -------------------------------------------------------------------------------
 # --- IMPORTS (standard, then third party, then my own modules)
 # -------------------------------------------------------------------------------
+import contextlib
 import pprint
 import random
+import threading
 import time
 from collections import namedtuple, OrderedDict
 from copy import deepcopy
 
-import matplotlib
-import pandas
-import cv2
 import numpy as np
-from colorama import Fore, Style
-from pytictoc import TicToc
 from numpy import inf
-from scipy.optimize import least_squares, minimize
-from scipy.sparse import lil_matrix
+from scipy.optimize import least_squares, minimize, OptimizeResult
+# private module of scipy, the one used by least_squares, so that the Jacobians are the same. The workers argument of
+# approx_derivative and the callback of least_squares need scipy >= 1.16 (see requirements.txt)
+from scipy.optimize._numdiff import approx_derivative, group_columns
+from scipy.optimize._optimize import _wrap_callback  # the wrapper of the callbacks of least_squares and minimize
 
-# import KeyPressManager
-# from OptimizationUtils import KeyPressManager
+from OptimizationUtils import KeyPressManager
+from OptimizationUtils.bindings import Binding
+from OptimizationUtils.lazy import lazyImport
+
+# Only used to print and visualize, imported on first use to keep the import of the optimizer fast
+colorama = lazyImport('colorama')
+pandas = lazyImport('pandas')
+plt = lazyImport('matplotlib.pyplot')
 
 # ------------------------
 # DATA STRUCTURES   ##
 # ------------------------
 ParamT = namedtuple('ParamT', 'param_names idx data_key getter setter bound_max bound_min')
+StoppingRulesT = namedtuple('StoppingRulesT', 'time_budget min_relative_improvement window max_function_calls')
+BulkAccessorsT = namedtuple('BulkAccessorsT', 'setter getter structured')
+# a stage of a staged optimization, see addStage. groups is None for all the groups, stopping_rules None to use the
+# ones of the optimizer
+StageT = namedtuple('StageT', 'name groups optimization_method optimization_options stopping_rules')
+# a call of fromXToData: a group and its setter, or (if group is None) the bulk setter of a data model, with the
+# indices in x of its parameters, the slice of each group in those indices and the dtype of the structured values
+SetterCallT = namedtuple('SetterCallT', 'data_key group setter structured indices slices dtype')
+
+# derivative free methods which evaluate populations of parameter vectors in parallel, see OptimizationUtils.population
+POPULATION_METHODS = ['differential_evolution', 'cma_es']
+
+DEFAULT_OPTIMIZATION_OPTIONS = {'x_scale': 'jac', 'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8, 'diff_step': 1e-4}
+
+
+class OptimizationStopped(Exception):
+    """ Raised inside the objective function wrapper to stop the solver, e.g. when the optimization is cancelled or
+    its deadline is reached. The optimizer catches it and finishes with the best parameters evaluated so far. """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+tictoc_state = threading.local()  # the start time of tic is kept per thread
 
 
 def tic():
     # matlab like tic and toc functions
-    global startTime_for_tictoc
-
-    startTime_for_tictoc = time.time()
+    tictoc_state.start_time = time.time()
 
 
 def toc():
     # matlab like tic and toc functions
-    if 'startTime_for_tictoc' in globals():
-        print("Elapsed time is " + str(time.time() - startTime_for_tictoc) + " seconds.")
+    if hasattr(tictoc_state, 'start_time'):
+        print("Elapsed time is " + str(time.time() - tictoc_state.start_time) + " seconds.")
     else:
         print("Toc: start time not set")
 
 
 def tocs():
     # matlab like tic and toc functions
-    if 'startTime_for_tictoc' in globals():
-        return str((time.time() - startTime_for_tictoc))
+    if hasattr(tictoc_state, 'start_time'):
+        return str((time.time() - tictoc_state.start_time))
     else:
         print("Toc: start time not set")
         return None
@@ -75,7 +104,190 @@ def addArguments(ap):
 # data_models = []
 
 
+class OptimizationRun:
+    """ The state of one optimization run: status counters, timings, metrics and visualization handles. Each call
+    of startOptimization creates a new run, so nothing is carried over from previous runs. """
+
+    def __init__(self, optimization_method='least_squares', optimization_options=None):
+        self.optimization_method = optimization_method
+        self.optimization_options = optimization_options
+        # the status is also given to the objective function as data_models['status']
+        # active_residuals: indices of the residuals given to the solver, None for all. The objective function may skip
+        # the computation of the others, see OptimizationUtils.subsampling
+        self.status = {'is_iteration': False, 'num_iterations': 0, 'num_function_calls': 0,
+                       'num_function_calls_per_iteration': None, 'active_residuals': None}
+        self.start_time = None  # time.perf_counter() at the start of the solver
+        self.solver_view = None  # a SolverView, or None if the variables of the solver are the parameters
+        self.variables = None  # indices of the variables (of the solver view of the optimizer) to optimize, or None
+        self.residual_indices = None  # indices of the residuals given to the solver, or None for all
+        self.rebase_manifolds = True  # rebase the manifold groups at the end of the run
+        self.start_trace = True  # start a new trace, or False to continue the one of the previous run (e.g. stages)
+        self.bounds = None  # (bounds_min, bounds_max) arrays of the variables of the solver
+        self.sparse_matrix = None  # the sparse matrix of the variables of the solver
+        self.jacobian_sparsity = None  # (sparsity, column groups) for internalJacobianFunction
+        self.internal_jacobian = False  # the Jacobian is computed by internalJacobianFunction
+        self.last_evaluation = None  # (x, residuals) of the last objective function call, see internalJacobianFunction
+
+        # Metrics
+        self.metrics = None  # a MetricsCollector, if the optimizer has a metrics sink
+        self.metrics_iteration = 0
+        self.last_gradient_norm = None
+        self.user_callback = None  # the callback of the optimization options, called by internalIterationCallback
+
+        # Visualization
+        self.visualize = False  # always_visualize and not headless
+        self.figures = []  # figures given in setVisualizationFunction plus the internal ones
+        self.wm = None  # KeyPressManager.WindowManager
+        self.figure_residuals = None
+        self.ax = None
+        self.initial_residuals_handle = None
+        self.plot_handle = None
+        self.figure_error_evolution = None
+        self.error_ax = None
+        self.error_plot_handle = None
+        self.total_error = []
+        self.background = False  # runs in a background thread, so it must not visualize
+
+        # Progress and stopping
+        self.progress = (0, None)  # (iteration, cost) of the last solver iteration
+        self.track_progress = False  # update the progress also when the run is not stoppable, e.g. for a summary
+        self.stoppable = False  # check stop requests and track the best evaluation at each objective call
+        self.stop_message = None  # reason to stop, set by requestStop
+        self.deadline = None  # time.perf_counter() after which the optimization stops
+        self.max_function_calls = None
+        self.stall_rule = None  # (min_relative_improvement, window)
+        self.cost_history = []  # cost at each solver iteration
+        self.iteration_listener = None  # called with (iteration, cost) after each solver iteration, may requestStop
+        self.pending_iteration = False  # a batch of function calls completed an iteration
+        self.best_cost = inf
+        self.best_x = None
+        self.best_errors = None
+
+    def getElapsedTime(self):
+        return time.perf_counter() - self.start_time
+
+    def requestStop(self, message):
+        """ Asks the optimization to stop at the next objective function call. May be called from any thread. """
+        self.stop_message = message
+
+    def checkStop(self):
+        """ Raises OptimizationStopped if the optimization should stop. """
+        if self.stop_message is None and self.deadline is not None and time.perf_counter() > self.deadline:
+            self.stop_message = 'Deadline reached.'
+        if self.stop_message is None and self.max_function_calls is not None and \
+                self.status['num_function_calls'] >= self.max_function_calls:
+            self.stop_message = 'Maximum number of objective function calls reached.'
+        if self.stop_message is not None:
+            raise OptimizationStopped(self.stop_message)
+
+    def checkStall(self, cost):
+        """ Adds the cost of an iteration to the history and requests a stop if the relative cost improvement over
+        the last iterations is below the threshold of the stall rule. """
+        self.cost_history.append(cost)
+        if self.stall_rule is None:
+            return
+
+        min_relative_improvement, window = self.stall_rule
+        if len(self.cost_history) > window:
+            old_cost = self.cost_history[-window - 1]
+            improvement = (old_cost - cost) / old_cost if old_cost > 0 else 0.0
+            if improvement < min_relative_improvement:
+                self.requestStop('Stalled: relative cost improvement of ' + str(improvement) + ' in the last ' +
+                                 str(window) + ' iterations.')
+
+    def updateBest(self, x, errors):
+        errors = np.asarray(errors, dtype=float)
+        cost = 0.5 * np.dot(errors, errors)
+        if cost < self.best_cost:
+            self.best_cost, self.best_x, self.best_errors = cost, np.array(x, dtype=float), errors
+
+    def getBestResult(self, message):
+        """ Builds a scipy like result with the best evaluation so far, for optimizations that were stopped. """
+        if self.optimization_method == 'least_squares':
+            fun = self.best_errors
+        elif self.optimization_method in POPULATION_METHODS:
+            fun = self.best_cost
+        else:
+            fun = np.sum(np.abs(self.best_errors))
+        return OptimizeResult(x=self.best_x, cost=self.best_cost, fun=fun, success=False, status=-2, message=message,
+                              nfev=self.status['num_function_calls'], nit=self.progress[0])
+
+
+class SolverView:
+    """ Maps the vector of variables of the solver to the parameter vector x. The parameters of frozen groups are not
+    variables of the solver, and keep their values, and tied parameters share a variable. Variable j gives its value
+    to the parameters x[x_indices[k]] for which z_indices[k] == j. """
+
+    def __init__(self, x, x_indices, z_indices, num_variables):
+        """
+        :param x: the parameter vector, with the values of the parameters which are not variables of the solver
+        :param x_indices: indices of the parameters set by the variables
+        :param z_indices: for each of x_indices, the index of its variable
+        :param num_variables: number of variables of the solver
+        """
+        self.x_fixed = np.array(x, dtype=float)
+        self.x_indices = np.asarray(x_indices, dtype=int)
+        self.z_indices = np.asarray(z_indices, dtype=int)
+        self.num_variables = num_variables
+        # the first parameter of each variable, from which the value of the variable is read
+        self.first_indices = np.zeros(num_variables, dtype=int)
+        self.first_indices[self.z_indices[::-1]] = self.x_indices[::-1]
+
+    def restrict(self, variables):
+        """ :return: a SolverView with only some of the variables. The parameters of the others keep their values.
+
+        :param variables: indices of the variables to keep
+        """
+        numbering = np.full(self.num_variables, -1)  # new index of each variable
+        numbering[np.asarray(variables, dtype=int)] = np.arange(len(variables))
+        keep = numbering[self.z_indices] >= 0
+        return SolverView(self.x_fixed, self.x_indices[keep], numbering[self.z_indices[keep]], len(variables))
+
+    def toX(self, z):
+        """ :return: the parameter vector, as an array, given the variables of the solver """
+        x = self.x_fixed.copy()
+        x[self.x_indices] = np.asarray(z, dtype=float)[self.z_indices]
+        return x
+
+    def toXBatch(self, zs):
+        """ :return: (K, n) array of parameter vectors, given a (K, number of variables) array """
+        xs = np.tile(self.x_fixed, (len(zs), 1))
+        xs[:, self.x_indices] = np.asarray(zs, dtype=float)[:, self.z_indices]
+        return xs
+
+    def fromX(self, x):
+        """ :return: the variables of the solver, as an array, given a parameter vector """
+        return np.asarray(x, dtype=float)[self.first_indices]
+
+    def getBounds(self, bounds_min, bounds_max):
+        """ :return: (bounds_min, bounds_max) of the variables, the intersection of the bounds of their parameters """
+        z_min, z_max = np.full(self.num_variables, -inf), np.full(self.num_variables, inf)
+        np.maximum.at(z_min, self.z_indices, np.asarray(bounds_min, dtype=float)[self.x_indices])
+        np.minimum.at(z_max, self.z_indices, np.asarray(bounds_max, dtype=float)[self.x_indices])
+        return z_min, z_max
+
+    def getSparseMatrix(self, sparse_matrix):
+        """ :return: the sparse matrix of the variables: a residual depends on a variable if it depends on one of its
+        parameters """
+        from scipy.sparse import coo_matrix
+
+        selection = coo_matrix((np.ones(len(self.x_indices), dtype=int), (self.x_indices, self.z_indices)),
+                               shape=(len(self.x_fixed), self.num_variables)).tocsc()
+        sparse_matrix = (sparse_matrix.tocsr() != 0).astype(int).dot(selection)
+        sparse_matrix.data[:] = 1
+        return sparse_matrix.tolil()
+
+
 class Optimizer:
+    """ Configures and runs an optimization.
+
+    Thread safety: an Optimizer keeps no global state, and the state of a run lives in an OptimizationRun (self.run),
+    so different Optimizers, each with its own data models, can run at the same time in different threads. A single
+    Optimizer runs one optimization at a time: calling startOptimization while it is running, from another thread or
+    from inside its own objective function, raises a ValueError. Metrics sinks may be shared between Optimizers.
+    Visualization (matplotlib, opencv) must run in the main thread, so concurrent runs should be headless or not
+    visualize.
+    """
 
     def __init__(self):
         """
@@ -87,19 +299,38 @@ class Optimizer:
         self.groups = OrderedDict()
 
         self.optimization_method = 'least_squares' # the default one
+        self.optimization_options = None  # options given to the optimization function in the last optimization
         self.x = []  # a list of floats (the actual parameters)
         self.x0 = []  # the initial value of the parameters
         self.xf = []  # the final value of the parameters
 
+        self.param_indices = {}  # dict: key={param name} value = index of the param in x
+        self.view_groups = OrderedDict()  # groups whose data model field is a view of the parameter buffer: binding
+        self.parameter_buffer = None  # array with the parameters, of which the view groups are views
+        self.bulk_accessors = {}  # key={data_key} value = BulkAccessorsT, setters of all the groups of a data model
+        self.setter_calls = None  # list of SetterCallT done by fromXToData, computed when needed
+        self.frozen_groups = set()  # names of the groups which are not optimized, see freezeGroup
+        self.ties = []  # lists of names of parameters which share a variable of the solver, see tieParams
+        # groups which are increments of a rotation or pose, key={group name} value = parameterization, see manifolds
+        self.manifold_groups = OrderedDict()
+        self.manifold_references0 = OrderedDict()  # (4, 4) reference of each manifold group at x0, see capture
         self.residuals = OrderedDict()  # ordered dict: key={residual} value = [params that influence this residual]
         self.sparse_matrix = None
         self.result = None  # to contain the optimization result
         self.objective_function = None  # to contain the objective function
+        self.batched_objective = False  # the objective function evaluates batches of parameter vectors
         # self.visualization_function = None
         self.first_call_of_objective_function = True
-
-        self.data_models['status'] = {'is_iteration': False, 'num_iterations': 0, 'num_function_calls': 0,
-                                      'num_function_calls_per_iteration': None, }
+        self.record_evaluations = False  # store the (x, residuals) of every objective function call
+        self.recorded_evaluations = []  # list of (x, residuals) tuples
+        self.trace_recorder = None  # records x and residuals at each core iteration, see OptimizationUtils.trace
+        self.metrics_sink = None  # receives per iteration metrics, see OptimizationUtils.metrics
+        self.stopping_rules = None  # a StoppingRulesT
+        self.stages = []  # list of StageT, see addStage
+        self.lock = threading.Lock()  # held while an optimization runs
+
+        self.run = OptimizationRun()  # the state of the current (or last) optimization run
+        self.data_models['status'] = self.run.status
         # used to assess how many auxiliary iterations are called before each core iteration #https://github.com/miguelriemoliveira/OptimizationUtils/issues/68
 
         # Visualization stuff
@@ -107,10 +338,30 @@ class Optimizer:
         self.vis_niterations = 1  # call visualization function every nth iterations.
         self.always_visualize = False
         self.internal_visualization = True
-        self.tictoc = TicToc()
+        self.headless = None  # True, False or None to detect if there is a display
+        self.figures = []
 
         print('\nInitializing optimizer...')
 
+    def __getstate__(self):
+        """ Optimizers are pickled without the visualization, the metrics sink, the trace recorder, the lock and the
+        state of the current run. The getters, setters and objective function must be picklable, e.g. bindings and
+        functions defined at the top level of a module. """
+        state = dict(self.__dict__)
+        state['data_models'] = {key: value for key, value in self.data_models.items() if key != 'status'}
+        for name in ['lock', 'run']:
+            del state[name]
+        state.update({'vis_function_handle': None, 'always_visualize': False, 'figures': [], 'metrics_sink': None,
+                      'trace_recorder': None, 'parameter_buffer': None,  # the views are bound again when used
+                      'setter_calls': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.run = OptimizationRun(self.optimization_method, self.optimization_options)
+        self.data_models['status'] = self.run.status
+
     # ---------------------------
     # Optimizer configuration
     # ---------------------------
@@ -125,16 +376,19 @@ class Optimizer:
             self.data_models[name] = data
             # print('Added data ' + name + ' to model dict.')
 
-    def pushParamScalar(self, group_name, data_key, getter, setter, bound_max=+inf, bound_min=-inf):
+    def pushParamScalar(self, group_name, data_key, getter, setter=None, bound_max=+inf, bound_min=-inf, view=False):
         """
         Pushes a new scalar parameter to the parameter vector. The parameter group contains a single element.
         Group name is the same as parameter name.
         :param group_name: the name of the parameter
         :param data_key: the key of the model into which the parameter maps
-        :param getter: a function to retrieve the parameter value from the model
-        :param setter: a function to set the parameter value from the model
+        :param getter: a function to retrieve the parameter value from the model, or a binding (see
+        OptimizationUtils.bindings), which is also the setter if setter is None
+        :param setter: a function to set the parameter value from the model, or a binding
         :param bound_max: max value the parameter may take
         :param bound_min: min value the parameter may take
+        :param view: the field of the binding given as getter becomes a numpy array of size 1 which is a view of the
+        parameter buffer, see pushParamVector
         """
         if group_name in self.groups:  # Cannot add a parameter that already exists
             raise ValueError('Scalar param ' + group_name + ' already exists. Cannot add it.')
@@ -142,6 +396,10 @@ class Optimizer:
         if not data_key in self.data_models:
             raise ValueError('Dataset ' + data_key + ' does not exist. Cannot add group ' + group_name + '.')
 
+        if view:
+            self.checkViewBinding(group_name, getter, setter)
+        binding = getter
+        getter, setter = self.resolveAccessors(group_name, getter, setter)
         value = getter(self.data_models[data_key])
         if not type(value) is list or not (len(value) == 1):
             raise ValueError('For scalar parameters, getter must return a list of lenght 1. Returned list = ' + str(
@@ -149,12 +407,14 @@ class Optimizer:
 
         param_names = [group_name]  # a single parameter with the same name as the group
         idx = [len(self.x)]
-        self.groups[group_name] = ParamT(param_names, idx, data_key, getter, setter, [bound_max],
-                                         [bound_min])  # add to group dict
+        self.addGroup(group_name, ParamT(param_names, idx, data_key, getter, setter, [bound_max],
+                                         [bound_min]))  # add to group dict
+        if view:
+            self.view_groups[group_name] = binding
         self.x.append(value[0])  # set initial value in x using the value from the data model
         # print('Pushed scalar param ' + group_name + ' to group ' + group_name)
 
-    def pushParamV3(self, group_name, data_key, getter, setter, bound_max=(+inf, +inf, +inf),
+    def pushParamV3(self, group_name, data_key, getter, setter=None, bound_max=(+inf, +inf, +inf),
                     bound_min=(-inf, -inf, -inf), suffix=['x', 'y', 'z']):
         """
         DEPRECATED
@@ -183,19 +443,21 @@ class Optimizer:
         if not len(suffix) == 3:
             raise ValueError('sufix ' + str(suffix) + ' must be a list of size 3, e.g. ["x", "y", "z"].')
 
+        getter, setter = self.resolveAccessors(group_name, getter, setter)
+
         idxs = range(len(self.x), len(self.x) + 3)  # Compute value of indices
 
         param_names = [group_name + suffix[0], group_name + suffix[1], group_name + suffix[2]]
 
-        self.groups[group_name] = ParamT(param_names, idxs, data_key, getter, setter, bound_max,
-                                         bound_min)  # add to params dict
+        self.addGroup(group_name, ParamT(param_names, idxs, data_key, getter, setter, bound_max,
+                                         bound_min))  # add to params dict
         values = getter(self.data_models[data_key])
         for value in values:
             self.x.append(value)  # set initial value in x
         # print('Pushed translation group ' + group_name + ' with params ' + str(param_names))
 
-    def pushParamVector(self, group_name, data_key, getter, setter, bound_max=None,
-                        bound_min=None, suffix=None, number_of_params=None):
+    def pushParamVector(self, group_name, data_key, getter, setter=None, bound_max=None,
+                        bound_min=None, suffix=None, number_of_params=None, view=False):
         """
         Pushes a new parameter group of type translation to the parameter vector.
         There will be 3 parameters, *_tx, *_ty, *_tz per translation group
@@ -207,6 +469,11 @@ class Optimizer:
         :param bound_min: a tuple (min_x, min_y, min_z)
         :param suffix:
         :param number_of_params:
+        :param view: the field of the binding given as getter becomes a numpy array which is a view of the parameter
+        buffer of the optimizer, from the first copy of the parameters to the data models (see fromXToData) on. The
+        copy is then a single copy of x to the buffer, instead of a call of the setter, and the objective function
+        reads the parameters from a plain numpy array. The views are bound again, i.e. the field holds a new array,
+        when parameters are pushed after the first copy.
         """
         if group_name in self.groups:  # Cannot add a parameter that already exists
             raise ValueError('Group ' + group_name + ' already exists. Cannot add it.')
@@ -214,6 +481,10 @@ class Optimizer:
         if not data_key in self.data_models:  # Check if we have the data_key in the data dictionary
             raise ValueError('Dataset ' + data_key + ' does not exist. Cannot add group ' + group_name + '.')
 
+        if view:
+            self.checkViewBinding(group_name, getter, setter)
+        binding = getter
+        getter, setter = self.resolveAccessors(group_name, getter, setter)
         if number_of_params is None:  # infer the number of params in this group from the size ofthe return vector
             number_of_params = len(getter(self.data_models[data_key]))
             # print('Param vector ' + group_name + ': estimated number of params ' + str(
@@ -238,37 +509,342 @@ class Optimizer:
 
         param_names = [group_name + s for s in suffix]
 
-        self.groups[group_name] = ParamT(param_names, idxs, data_key, getter, setter, bound_max,
-                                         bound_min)  # add to params dict
+        self.addGroup(group_name, ParamT(param_names, idxs, data_key, getter, setter, bound_max,
+                                         bound_min))  # add to params dict
+        if view:
+            self.view_groups[group_name] = binding
         values = getter(self.data_models[data_key])
         for value in values:
             self.x.append(value)  # set initial value in x
 
+    def pushParamSO3(self, group_name, data_key, getter, setter=None, max_step=None, suffix=('x', 'y', 'z')):
+        """ Pushes a rotation, parameterized by an increment of 3 parameters in its tangent space (see
+        OptimizationUtils.manifolds). The data model keeps the full rotation matrix. After each optimization the
+        increment is applied to the reference rotation and reset to zero.
+
+        :param group_name: the name of the group of parameters
+        :param data_key: the key of the model into which the parameters map
+        :param getter: a function which returns the (3, 3) rotation matrix from the model, or a binding of the matrix,
+        which is also the setter if setter is None
+        :param setter: a function to set the (3, 3) rotation matrix in the model ((K, 3, 3) for batched objective
+        functions), or a binding
+        :param max_step: bound of each parameter of the increment, in radians, or None
+        :param suffix: the suffixes of the names of the 3 parameters
+        """
+        from OptimizationUtils.manifolds import SO3Parameterization
+        self.pushParamManifold(group_name, data_key, SO3Parameterization, getter, setter, max_step, suffix)
+
+    def pushParamSE3(self, group_name, data_key, getter, setter=None, max_step=None,
+                     suffix=('tx', 'ty', 'tz', 'rx', 'ry', 'rz')):
+        """ Pushes a pose, parameterized by an increment of 6 parameters, 3 for the translation (in the reference frame
+        of the pose) and 3 for the rotation, see pushParamSO3.
+
+        :param getter: a function which returns the (4, 4) transformation matrix from the model, or a binding of the
+        matrix
+        :param setter: a function to set the (4, 4) transformation matrix in the model ((K, 4, 4) for batched objective
+        functions), or a binding
+        :param max_step: bound of each parameter of the increment, or None
+        """
+        from OptimizationUtils.manifolds import SE3Parameterization
+        self.pushParamManifold(group_name, data_key, SE3Parameterization, getter, setter, max_step, suffix)
+
+    def pushParamManifold(self, group_name, data_key, parameterization_class, getter, setter, max_step, suffix):
+        """ Pushes a group whose parameters are the increment of a manifold parameterization. Called by
+        pushParamSO3 and pushParamSE3. """
+        if not data_key in self.data_models:  # Check if we have the data_key in the data dictionary
+            raise ValueError('Dataset ' + data_key + ' does not exist. Cannot add group ' + group_name + '.')
+
+        if isinstance(getter, Binding):  # the parameterization reads and replaces the whole matrix
+            if setter is None:
+                setter = getter
+            getter = getter.getValue
+        if isinstance(setter, Binding):
+            setter = setter.setValue
+        if setter is None:
+            raise ValueError('Group ' + group_name + ' has no setter. Give a setter function, or a binding as getter.')
+
+        parameterization = parameterization_class(getter, setter, self.data_models[data_key])
+        size = parameterization_class.size
+        bound_max = None if max_step is None else size * [max_step]
+        bound_min = None if max_step is None else size * [-max_step]
+        self.pushParamVector(group_name, data_key, parameterization.get, parameterization.set, bound_max=bound_max,
+                             bound_min=bound_min, suffix=list(suffix), number_of_params=size)
+        self.manifold_groups[group_name] = parameterization
+
+    def rebaseManifoldGroups(self):
+        """ Applies the increments of the manifold groups to their reference rotations or poses, and resets them to
+        zero. The data models do not change. Called at the end of each optimization, with the final parameters. """
+        if not self.manifold_groups:
+            return
+
+        self.x = list(self.xf)
+        for group_name, parameterization in self.manifold_groups.items():
+            group = self.groups[group_name]
+            parameterization.rebase([self.x[idx] for idx in group.idx])
+            for idx in group.idx:
+                self.x[idx] = 0.0
+
+    def resolveAccessors(self, group_name, getter, setter):
+        """ Converts bindings to getter and setter functions.
+
+        :return: (getter, setter)
+        """
+        if isinstance(getter, Binding):
+            if setter is None:
+                setter = getter
+            getter = getter.get
+        if isinstance(setter, Binding):
+            setter = setter.set
+        if setter is None:
+            raise ValueError('Group ' + group_name + ' has no setter. Give a setter function, or a binding as getter.')
+        return getter, setter
+
+    def checkViewBinding(self, group_name, binding, setter):
+        """ Checks the accessors of a group whose field is a view of the parameter buffer.
+
+        :param binding: the binding of the field, given as getter
+        :param setter: must be None, the buffer replaces the setter
+        """
+        if not isinstance(binding, Binding) or not binding.viewable:
+            raise ValueError('Group ' + group_name + ' is a view, its getter must be a binding of a field (e.g. '
+                                                    'AttributePath or DictKey), not ' + repr(binding) + '.')
+        if setter is not None:
+            raise ValueError('Group ' + group_name + ' is a view and cannot have a setter.')
+
+    def addGroup(self, group_name, group):
+        """ Adds a group to the ordered dict of groups and indexes its parameter names.
+
+        :param group_name: the name of the group
+        :param group: a ParamT
+        """
+        for i, param_name in enumerate(group.param_names):  # the residuals and the ties refer to the params by name
+            if param_name in self.param_indices or param_name in group.param_names[:i]:
+                raise ValueError('Param ' + param_name + ' already exists. Cannot add group ' + group_name +
+                                 '. Use another group name or suffix.')
+        self.groups[group_name] = group
+        for param_name, idx in zip(group.param_names, group.idx):
+            self.param_indices[param_name] = idx
+        self.setter_calls = None
+
     def pushResidual(self, name, params=None):
         """Adds a new residual to the existing list of residuals
 
         :param name: name of residual
         :type name: string
-        :param params: parameter names which affect this residual
+        :param params: parameter names which affect this residual, or None to detect them with detectSparsity
         :type params: list
         """
 
         # Check if all listed params exist in the self.params
-        existing_params = self.getParameters()
-        for param in params:
-            if param not in existing_params:
+        for param in params or []:
+            if param not in self.param_indices:
                 raise ValueError('Cannot push residual ' + name + ' because given dependency parameter ' + param +
                                  ' has not been configured. Did you push this parameter?')
 
         self.residuals[str(name)] = params
 
-    def setObjectiveFunction(self, handle):
+    def setObjectiveFunction(self, handle, batched=False):
         # type: (function) -> object
         """Provide a pointer to the objective function
 
+        A batched objective function evaluates K parameter vectors in a single call, which is much faster for
+        objectives written with numpy. Before the call, each setter receives, instead of the value of each parameter of
+        its group, a (K, 1) column with the values of the parameter in the K vectors (see fromXToDataBatch), so that
+        numpy expressions broadcast to K rows. It must return a (K, m) array of residuals, or a dict with an array of
+        K values per residual. Single evaluations are batches with K = 1. The optimizer evaluates in batches the
+        finite differences Jacobian of least_squares and the populations of the population methods.
+
         :param handle: the function handle
+        :param batched: True if the objective function evaluates batches
         """
         self.objective_function = handle
+        self.batched_objective = batched
+
+    def setBulkAccessors(self, data_key, setter, getter=None, structured=False):
+        """ Sets a setter (and optionally a getter) for all the groups of a data model, which is called once per copy of
+        the parameters to the data models instead of the setters of each group. Useful when a data model has many
+        groups, since each setter call has an overhead.
+
+        The setter is called as setter(model, values), where values has the values of each group (except view
+        groups), as a numpy array of the size of the group. values is a dict with the group names as keys, or, if
+        structured, a 0-d numpy structured array with one field per group. For batched objective functions, the value of
+        each group is a (K, size of the group) array. The getter, used by fromDataToX, returns a dict with the values
+        of each group. The getters of the groups are still used to read the initial values of the parameters.
+
+        :param data_key: the key of the data model
+        :param setter: function setter(model, values)
+        :param getter: function getter(model) which returns a dict with a list of values per group, or None to use the
+        getters of the groups
+        :param structured: give the values as a structured scalar, instead of a dict
+        """
+        if not data_key in self.data_models:
+            raise ValueError('Dataset ' + data_key + ' does not exist. Cannot set its bulk accessors.')
+        self.bulk_accessors[data_key] = BulkAccessorsT(setter, getter, structured)
+        self.setter_calls = None
+
+    def freezeGroup(self, group_name):
+        """ Freezes a group: its parameters are not variables of the solver, so they have no finite differences
+        columns in the Jacobian, but keep their values and are still set in the data models.
+
+        :param group_name: the name of the group
+        """
+        if group_name not in self.groups:
+            raise ValueError('Group ' + str(group_name) + ' does not exist. Cannot freeze it.')
+        self.frozen_groups.add(group_name)
+
+    def unfreezeGroup(self, group_name):
+        """ Optimizes again a frozen group.
+
+        :param group_name: the name of the group
+        """
+        if group_name not in self.groups:
+            raise ValueError('Group ' + str(group_name) + ' does not exist. Cannot unfreeze it.')
+        self.frozen_groups.discard(group_name)
+
+    def freezeGroupsContainingPattern(self, pattern):
+        """ Freezes the groups whose name contains pattern.
+
+        :return: the names of the groups
+        """
+        group_names = [group_name for group_name in self.groups if pattern in group_name]
+        for group_name in group_names:
+            self.freezeGroup(group_name)
+        return group_names
+
+    def unfreezeGroupsContainingPattern(self, pattern):
+        """ Unfreezes the groups whose name contains pattern.
+
+        :return: the names of the groups
+        """
+        group_names = [group_name for group_name in self.groups if pattern in group_name]
+        for group_name in group_names:
+            self.unfreezeGroup(group_name)
+        return group_names
+
+    def tieParams(self, param_names):
+        """ Ties parameters, e.g. the same quantity in different data models: they are a single variable of the
+        solver, whose value is given to all of them, so the problem has fewer variables and finite differences
+        columns. The sparse matrix and the bounds of the variable are derived from the ones of the parameters: a
+        residual depends on it if it depends on one of the parameters, and its bounds are the intersection of theirs.
+        The parameters take the value of the first one. Ties which share a parameter are merged. Frozen parameters
+        are not tied, they keep their values.
+
+        :param param_names: the names of the parameters, at least two
+        """
+        for param_name in param_names:
+            if param_name not in self.param_indices:
+                raise ValueError('Parameter ' + str(param_name) + ' does not exist. Cannot tie it.')
+        if len(set(param_names)) < 2:
+            raise ValueError('A tie needs at least two parameters, got ' + str(param_names) + '.')
+
+        self.ties.append(list(param_names))
+        first_idx = self.param_indices[param_names[0]]
+        for param_name in param_names[1:]:
+            self.x[self.param_indices[param_name]] = self.x[first_idx]
+
+    def tieGroups(self, group_names):
+        """ Ties groups of the same size parameter by parameter, e.g. the intrinsics of a camera in several
+        collections. See tieParams.
+
+        :param group_names: the names of the groups, at least two
+        """
+        for group_name in group_names:
+            if group_name not in self.groups:
+                raise ValueError('Group ' + str(group_name) + ' does not exist. Cannot tie it.')
+        sizes = set(len(self.groups[group_name].param_names) for group_name in group_names)
+        if not len(sizes) == 1:
+            raise ValueError('Groups ' + str(group_names) + ' have different sizes and cannot be tied.')
+
+        for param_names in zip(*[self.groups[group_name].param_names for group_name in group_names]):
+            self.tieParams(list(param_names))
+
+    def untieParams(self, param_names=None):
+        """ Removes the ties which contain some of the parameters, or all the ties if None. The parameters keep their
+        values and are optimized independently again. """
+        if param_names is None:
+            self.ties = []
+        else:
+            self.ties = [tie for tie in self.ties if not set(tie) & set(param_names)]
+
+    def setRecordEvaluations(self, record_evaluations):
+        """ Records the (x, residuals) of every call of the objective function during the optimization, so that the
+        optimization can be saved with saveProblem and replayed offline.
+
+        :param record_evaluations: True to record
+        """
+        self.record_evaluations = record_evaluations
+
+    def setTraceRecorder(self, trace_recorder):
+        """ Records the parameters and residuals at each core iteration, so that the optimization can be visualized
+        afterwards with replayTrace, even if always_visualize is off.
+
+        :param trace_recorder: an OptimizationUtils.trace.TraceRecorder, or None to stop recording
+        """
+        self.trace_recorder = trace_recorder
+
+    def setMetricsSink(self, metrics_sink):
+        """ Emits a record per iteration (cost, gradient norm, step norm, objective calls, timings and memory) to a
+        metrics sink. When set, the finite differences Jacobian is computed by the optimizer (see
+        internalJacobianFunction) in order to obtain the gradient norm. The results of the optimization are the same.
+
+        :param metrics_sink: an OptimizationUtils.metrics.MetricsSink, or None to stop emitting
+        """
+        self.metrics_sink = metrics_sink
+
+    def setHeadless(self, headless=True):
+        """ In headless mode nothing GUI related is initialized and the visualization is skipped, even if
+        always_visualize is set.
+
+        :param headless: True to force headless mode, False to force visualization, None to use headless mode only
+        when there is no display (the default)
+        """
+        self.headless = headless
+
+    def isHeadless(self):
+        if self.headless is None:
+            return not KeyPressManager.isDisplayAvailable()
+        return self.headless
+
+    def setStoppingRules(self, time_budget=None, min_relative_improvement=None, window=5, max_function_calls=None):
+        """ Stops the optimization before the solver converges. When a rule fires, the optimization finishes with the
+        best parameters evaluated so far, which are copied to the data models. Use None to disable a rule.
+
+        :param time_budget: maximum duration of the optimization, in seconds
+        :param min_relative_improvement: stop if the cost improved less than this fraction over the last window
+        iterations, e.g. 0.001
+        :param window: number of iterations of the stall rule
+        :param max_function_calls: maximum number of objective function calls
+        """
+        if window < 1:
+            raise ValueError('The window of the stall rule must have at least one iteration.')
+        self.stopping_rules = StoppingRulesT(time_budget, min_relative_improvement, window, max_function_calls)
+
+    def addStage(self, name, groups=None, optimization_method='least_squares',
+                 optimization_options=DEFAULT_OPTIMIZATION_OPTIONS, time_budget=None, min_relative_improvement=None,
+                 window=5, max_function_calls=None):
+        """ Adds a stage to the staged optimization, see startStagedOptimization. The stage optimizes only the
+        parameters of its groups, with the others fixed, and only the residuals which depend on them.
+
+        :param name: name of the stage, used in the printouts and the summary of the result
+        :param groups: list of names of the parameter groups to optimize, or None for all the groups
+        :param time_budget, min_relative_improvement, window, max_function_calls: stopping rules of the stage (see
+        setStoppingRules). If all are None, the stage uses the stopping rules of the optimizer.
+        """
+        if groups is not None:
+            for group_name in groups:
+                if group_name not in self.groups:
+                    raise ValueError('Stage ' + name + ' has group ' + group_name + ', which does not exist.')
+            groups = list(groups)
+        if window < 1:
+            raise ValueError('The window of the stall rule must have at least one iteration.')
+
+        stopping_rules = None
+        if time_budget is not None or min_relative_improvement is not None or max_function_calls is not None:
+            stopping_rules = StoppingRulesT(time_budget, min_relative_improvement, window, max_function_calls)
+        self.stages.append(StageT(name, groups, optimization_method, optimization_options, stopping_rules))
+
+    def clearStages(self):
+        self.stages = []
 
     def setInternalVisualization(self, internal_visualization):
         self.internal_visualization = internal_visualization
@@ -303,8 +879,14 @@ class Optimizer:
         """ A wrapper around the custom given objective function which maps the x vector to the model before calling the
         objective function and after the call
 
-        :param x: the parameters vector
+        :param x: the variables of the solver, which are the parameters vector unless some groups are frozen
         """
+        run = self.run
+        if run.stoppable:
+            run.checkStop()
+        if run.solver_view is not None:
+            x = run.solver_view.toX(x)
+
         self.data_models['status']['num_function_calls'] += 1
 
         self.data_models['status']['is_iteration'] = False
@@ -314,50 +896,162 @@ class Optimizer:
                 # print(Fore.RED + 'THIS IS A CORE iteration!' + Style.RESET_ALL)
                 self.data_models['status']['is_iteration'] = True
                 self.data_models['status']['num_iterations'] += 1
+            elif run.pending_iteration:  # completed, and counted, by the last batch
+                self.data_models['status']['is_iteration'] = True
+            run.pending_iteration = False
 
+        t0 = time.perf_counter()
         self.x = x  # setup x parameters.
-        self.fromXToData()  # Copy from parameters to data models.
-        # Call objective func. with updated data models.
-        errors = self.errorDictToList(self.objective_function(self.data_models))
+        if self.batched_objective:
+            self.fromXToDataBatch(np.array([x], dtype=float))
+            t1 = time.perf_counter()
+            errors = list(self.batchErrorsToArray(self.objective_function(self.data_models), 1)[0])
+        else:
+            self.fromXToData()  # Copy from parameters to data models.
+            t1 = time.perf_counter()
+            # Call objective func. with updated data models.
+            errors = self.errorDictToList(self.objective_function(self.data_models))
+        t2 = time.perf_counter()
+        # the residuals given to the solver
+        solver_errors = errors if run.residual_indices is None else np.asarray(errors)[run.residual_indices]
+
+        if run.stoppable:
+            run.updateBest(x, solver_errors)
+
+        if run.metrics is not None:
+            run.metrics.addTime('setters', t1 - t0)
+            run.metrics.addTime('objective', t2 - t1)
+        if run.internal_jacobian:  # the Jacobian at x reuses these residuals
+            run.last_evaluation = (np.array(x, dtype=float), solver_errors)
+
+        if self.record_evaluations:
+            self.recorded_evaluations.append((np.array(x, dtype=float), np.array(errors, dtype=float)))
+
+        if self.trace_recorder is not None and self.data_models['status']['is_iteration']:
+            self.trace_recorder.record(self.data_models['status']['num_iterations'], x, errors)
 
         # self.printParameters()
         # self.printResiduals(errors)
 
         # Visualization: skip if counter does not exceed blackout interval
-        if self.always_visualize and self.data_models['status']['num_iterations'] % self.vis_niterations == 0:
+        if run.visualize and self.data_models['status']['num_iterations'] % self.vis_niterations == 0:
             self.vis_function_handle(self.data_models)  # call visualization function
 
-            if self.internal_visualization and hasattr(self, 'plot_handle'):
-                # redraw residuals plot
-                self.plot_handle.set_data(range(0, len(errors)), errors)
-                self.ax.relim()  # recompute new limits
-                self.ax.autoscale_view()  # re-enable auto scale
-                self.wm.waitForKey(time_to_wait=0.01, verbose=True)  # wait a bit
-
-                # redraw error evolution plot
-                self.total_error.append(np.sum(np.abs(errors)))
-                x = range(0, len(self.total_error))
-                # print("total errors=" + str(self.total_error))
-                self.error_plot_handle, = self.error_ax.plot(x, self.total_error,
-                                                             color='blue',
-                                                             linestyle='solid', linewidth=2, markersize=6)
+            if self.internal_visualization and run.plot_handle is not None:
+                self.updateInternalVisualization(errors)
+                run.wm.waitForKey(time_to_wait=0.01, verbose=True)  # wait a bit
 
-                # reset x limits if needed
-                _, xmax = self.error_ax.get_xlim()
-                if x[-1] > xmax:
-                    self.error_ax.set_xlim(0, x[-1] + 100)
-
-                self.error_ax.set_ylim(0, np.max(self.total_error))
+            if run.metrics is not None:
+                run.metrics.addTime('visualization', time.perf_counter() - t2)
 
             # Printing information
             # self.printParameters(flg_simple=True)
             # self.printResiduals(errors)
 
         if self.optimization_method == 'least_squares':
-            return errors
+            return solver_errors
         elif self.optimization_method == 'bfgs': # bfgs needs a scalar as output
-            return sum(abs(error) for error in errors)
+            return sum(abs(error) for error in solver_errors)
+
+    def internalBatchObjectiveFunction(self, xs):
+        """ The counterpart of internalObjectiveFunction for batches of parameter vectors, used with batched
+        objective functions. Batches count the core iterations they complete, but do not visualize or record them in
+        the trace: the next single call does.
+
+        :param xs: (K, n) array of variables of the solver
+        :return: (K, m) array of residuals
+        """
+        run = self.run
+        if run.stoppable:
+            run.checkStop()
+        if run.solver_view is not None:
+            xs = run.solver_view.toXBatch(xs)
+
+        status = self.data_models['status']
+        calls_per_iteration = status['num_function_calls_per_iteration']
+        if calls_per_iteration is not None:
+            num_iterations = (status['num_function_calls'] + len(xs)) // calls_per_iteration - \
+                             status['num_function_calls'] // calls_per_iteration
+            if num_iterations > 0:
+                status['num_iterations'] += num_iterations
+                run.pending_iteration = True
+        status['num_function_calls'] += len(xs)
+        status['is_iteration'] = False
+
+        t0 = time.perf_counter()
+        residuals = self.evaluateBatch(xs)
+        if run.metrics is not None:
+            run.metrics.addTime('objective', time.perf_counter() - t0)
+
+        for x, errors in zip(xs, residuals):
+            if self.record_evaluations:
+                self.recorded_evaluations.append((np.array(x, dtype=float), errors))
+        if run.residual_indices is not None:
+            residuals = residuals[:, run.residual_indices]
+        if run.stoppable:
+            for x, errors in zip(xs, residuals):
+                run.updateBest(x, errors)
+        return residuals
+
+    def internalBatchMap(self, function, xs):
+        """ A map like callable for the workers argument of scipy's approx_derivative, which evaluates all the
+        perturbed parameter vectors in a single batch. The function given by scipy is not used. """
+        return list(self.internalBatchObjectiveFunction(np.array(list(xs), dtype=float)))
+
+    def internalJacobianFunction(self, x):
+        """ Computes the finite differences Jacobian of the residuals in the same way least_squares does internally
+        (same method, relative step, bounds and sparsity), reusing the residuals of the last call when it was made at x.
+
+        :param x: the parameters vector
+        :return: the Jacobian, sparse if the sparse matrix was computed
+        """
+        def residualsFunction(x):
+            return np.asarray(self.internalObjectiveFunction(x), dtype=float)
 
+        run = self.run
+        x_params = x if run.solver_view is None else run.solver_view.toX(x)
+        if run.last_evaluation is not None and np.array_equal(run.last_evaluation[0], x_params):
+            f0 = np.asarray(run.last_evaluation[1], dtype=float)
+        else:
+            f0 = residualsFunction(x)
+
+        method = run.optimization_options.get('jac', '2-point')
+        workers = self.internalBatchMap if self.batched_objective and not method == 'cs' else None
+        jacobian = approx_derivative(residualsFunction, x, method=method,
+                                     rel_step=run.optimization_options.get('diff_step'), f0=f0,
+                                     bounds=run.bounds, sparsity=run.jacobian_sparsity, workers=workers)
+        run.last_gradient_norm = np.linalg.norm(jacobian.T.dot(f0))  # gradient of the cost 0.5 * sum(f ** 2)
+        return jacobian
+
+    def internalIterationCallback(self, intermediate_result):
+        """ Called by the solver at the end of each iteration to update the progress and emit the iteration
+        metrics. """
+        run = self.run
+        if 'nit' in intermediate_result:
+            iteration = intermediate_result.nit
+        else:  # minimize does not report the iteration number
+            iteration = run.metrics_iteration + 1
+        run.metrics_iteration = iteration
+
+        if run.optimization_method == 'least_squares':
+            cost, gradient_norm = intermediate_result.cost, run.last_gradient_norm
+        else:
+            cost, gradient_norm = intermediate_result.fun, None
+        run.progress = (iteration, float(cost))
+        run.checkStall(float(cost))
+        if run.iteration_listener is not None:
+            run.iteration_listener(iteration, float(cost))
+
+        if run.metrics is not None:
+            x = intermediate_result.x if run.solver_view is None else run.solver_view.toX(intermediate_result.x)
+            run.metrics.iteration(iteration, x, cost, run.status['num_function_calls'],
+                                  gradient_norm=gradient_norm)
+
+        if run.user_callback is not None:  # with the parameters vector, like the results
+            if run.solver_view is not None:
+                intermediate_result = OptimizeResult(intermediate_result,
+                                                     x=run.solver_view.toX(intermediate_result.x))
+            return run.user_callback(intermediate_result)
 
     def errorDictToList(self, errors):
 
@@ -370,16 +1064,16 @@ class Optimizer:
             for error_dict_key in error_dict.keys():  # Check if some of the retuned residuals are not configured.
                 # if error_dict_key not in self.residuals.keys():
                 if not error_dict_key in self.residuals:
-                    raise ValueError('Objective function returned dictionary with residual ' + Fore.RED +
-                                     error_dict_key + Fore.RESET +
+                    raise ValueError('Objective function returned dictionary with residual ' + colorama.Fore.RED +
+                                     error_dict_key + colorama.Fore.RESET +
                                      ' which does not exist. Use printResiduals to check the configured residuals')
 
             for residual in self.residuals:  # residuals is an ordered dict to recover a correctly ordered list
                 # if residual not in error_dict.keys():
                 if not residual in error_dict:
                     raise ValueError(
-                        'Objective function returned dictionary which does not contain the residual ' + Fore.RED +
-                        residual + Fore.RESET + '. This residual is mandatory.')
+                        'Objective function returned dictionary which does not contain the residual ' +
+                        colorama.Fore.RED + residual + colorama.Fore.RESET + '. This residual is mandatory.')
 
                 error_list.append(error_dict[residual])
 
@@ -388,18 +1082,106 @@ class Optimizer:
 
         return error_list
 
-    def startOptimization(self, optimization_method='least_squares', optimization_options={'x_scale': 'jac', 'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8,
-                                                      'diff_step': 1e-4}):
+    def acquireExclusiveRun(self):
+        """ Takes the lock held while an optimization runs, or raises a ValueError if another optimization holds it.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ValueError('This optimizer is already running an optimization. Use one Optimizer, with its own data '
+                             'models, per concurrent optimization.')
+
+    @contextlib.contextmanager
+    def exclusiveRun(self):
+        """ Holds the optimizer lock while the block runs, see acquireExclusiveRun. """
+        self.acquireExclusiveRun()
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def startOptimization(self, optimization_method='least_squares', optimization_options=DEFAULT_OPTIMIZATION_OPTIONS):
         """ Initializes the optimization procedure.
 
         :param optimization_options: dict with options for the least squares scipy function.
         Check https://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.least_squares.html
+        A 'callback' is called after each iteration, with the parameters vector, also when some groups are frozen.
+        """
+        with self.exclusiveRun():
+            self.internalStartOptimization(optimization_method, optimization_options)
+
+    def startOptimizationAsync(self, optimization_method='least_squares',
+                               optimization_options=DEFAULT_OPTIMIZATION_OPTIONS, deadline=None):
+        """ Starts the optimization in a background thread and returns immediately. The background optimization never
+        visualizes nor waits for key presses.
+
+        The returned OptimizationFuture gives the progress, the result (future.result(), or await future in asyncio
+        code) and allows cooperative cancellation (future.cancel()), which stops the solver at the next objective
+        function call.
+
+        :param deadline: maximum duration of the optimization in seconds, or None. When it is reached the solver stops
+        at the next objective function call and the result has the best parameters evaluated so far.
+        :return: an OptimizationUtils.futures.OptimizationFuture
         """
+        from OptimizationUtils.futures import OptimizationFuture
+
+        self.acquireExclusiveRun()  # released by the background thread
+
+        run = OptimizationRun(optimization_method, optimization_options)
+        run.background = True
+        if deadline is not None:
+            run.deadline = time.perf_counter() + deadline
+
+        future = OptimizationFuture(self, run)
+
+        def work():
+            result, exception = None, None
+            try:
+                self.internalStartOptimization(optimization_method, optimization_options, run=run)
+                result = self.result
+            except BaseException as e:
+                exception = e
+            finally:
+                self.lock.release()  # before the result is set, so that waiters may start a new optimization
+            future.setOutcome(result, exception)
+
+        future.thread = threading.Thread(target=work, name='Optimizer', daemon=True)
+        future.thread.start()
+        return future
+
+    def internalStartOptimization(self, optimization_method, optimization_options, run=None):
+        """ The body of startOptimization, called with the optimizer lock held.
+
+        :param run: the OptimizationRun to use, or None to create one
+        """
+        if run is None:
+            run = OptimizationRun(optimization_method, optimization_options)
+        if optimization_options.get('callback') is not None:  # chained to the internal callback
+            run.user_callback = _wrap_callback(optimization_options['callback'],
+                                               'l-bfgs-b' if optimization_method == 'bfgs' else None)
+        optimization_options = {key: value for key, value in optimization_options.items() if key != 'callback'} \
+            if 'callback' in optimization_options else optimization_options
+        if self.stopping_rules is not None:
+            if self.stopping_rules.time_budget is not None:
+                deadline = time.perf_counter() + self.stopping_rules.time_budget
+                run.deadline = deadline if run.deadline is None else min(run.deadline, deadline)
+            if self.stopping_rules.min_relative_improvement is not None:
+                run.stall_rule = (self.stopping_rules.min_relative_improvement, self.stopping_rules.window)
+            run.max_function_calls = self.stopping_rules.max_function_calls
+        self.run = run
+        self.data_models['status'] = run.status
+        run.status['active_residuals'] = run.residual_indices
+        run.figures = list(self.figures)
+
         self.optimization_method = optimization_method
+        self.optimization_options = optimization_options
         self.x0 = deepcopy(self.x)  # store current x as initial parameter values
-        self.fromXToData()  # copy from x to data models
-        # Call objective func. to get initial residuals.
-        errors = self.errorDictToList(self.objective_function(self.data_models))
+        self.manifold_references0 = OrderedDict((group_name, parameterization.getReference())
+                                                for group_name, parameterization in self.manifold_groups.items())
+        if self.batched_objective:
+            errors = list(self.evaluateBatch(np.array([self.x], dtype=float))[0])
+        else:
+            self.fromXToData()  # copy from x to data models
+            # Call objective func. to get initial residuals.
+            errors = self.errorDictToList(self.objective_function(self.data_models))
         self.errors0 = deepcopy(errors)  # store initial residuals for future reference
 
         if not len(self.residuals.keys()) == len(self.errors0):  # check if residuals are properly configured
@@ -407,57 +1189,261 @@ class Optimizer:
                 'Number of residuals returned by the objective function (' + str(len(self.errors0)) +
                 ') is not consistent with the number of residuals configured (' + str(len(self.residuals.keys())) + ')')
 
-        # Setup boundaries for parameters
-        bounds_min = []
-        bounds_max = []
-        for name in self.groups:
-            _, _, _, _, _, bound_max, bound_min = self.groups[name]
-            bounds_max.extend(bound_max)
-            bounds_min.extend(bound_min)
+        # The variables of the solver, their boundaries and sparse matrix
+        run.solver_view = self.getSolverView(run.variables)
+        bounds_min, bounds_max = self.getBounds()
+        run.sparse_matrix = self.sparse_matrix
+        if run.solver_view is not None:
+            bounds_min, bounds_max = run.solver_view.getBounds(bounds_min, bounds_max)
+            if self.sparse_matrix is not None:
+                run.sparse_matrix = run.solver_view.getSparseMatrix(self.sparse_matrix)
+        solver_errors = errors  # the residuals given to the solver
+        if run.residual_indices is not None:
+            solver_errors = np.asarray(errors)[run.residual_indices]
+            if run.sparse_matrix is not None:
+                run.sparse_matrix = run.sparse_matrix.tocsr()[run.residual_indices].tolil()
+        run.bounds = (bounds_min, bounds_max)
+        x0 = self.getSolverX()
 
         self.getNumberOfFunctionCallsPerIteration(optimization_options)
+        self.recorded_evaluations = []  # after the calls of getNumberOfFunctionCallsPerIteration
+
+        if self.trace_recorder is not None:  # the initial parameters are iteration 0 of the trace (or of this run)
+            if run.start_trace or not self.trace_recorder.isStarted():
+                self.trace_recorder.start(self.getParameters(), self.residuals.keys())
+            else:
+                self.trace_recorder.resume()
+            self.trace_recorder.record(0, self.x, errors)
 
-        if self.always_visualize:
+        run.visualize = self.always_visualize and not self.isHeadless() and not run.background
+        if run.visualize:
 
             if self.internal_visualization:
                 self.drawResidualsFigure()  # First draw of residuals figure
                 self.drawErrorEvolutionFigure()  # First draw of error evolution figure
-                self.wm = KeyPressManager.WindowManager(self.figures)
+                run.wm = KeyPressManager.WindowManager(run.figures, headless=self.isHeadless())
                 self.vis_function_handle(self.data_models)  # call visualization function
-                self.plot_handle.set_data(range(0, len(errors)), errors)  # redraw residuals plot
-                self.ax.relim()  # recompute new limits
-                self.ax.autoscale_view()  # re-enable auto scale
-                self.wm.waitForKey(time_to_wait=0.01, verbose=False)  # wait a bit
+                run.plot_handle.set_data(range(0, len(errors)), errors)  # redraw residuals plot
+                run.ax.relim()  # recompute new limits
+                run.ax.autoscale_view()  # re-enable auto scale
+                run.wm.waitForKey(time_to_wait=0.01, verbose=False)  # wait a bit
 
                 # Printing information
                 # self.printParameters(flg_simple=True)
                 # self.printResiduals(errors)
                 # print('\nAverage error = ' + str(np.average(errors)) + '\n')
-                self.wm.waitForKey(time_to_wait=None, verbose=True,
-                                   message="Ready to start optimization: press 'c' to continue.")  # wait a bit
+                run.wm.waitForKey(time_to_wait=None, verbose=True,
+                                  message="Ready to start optimization: press 'c' to continue.")  # wait a bit
 
-        # Call optimization function (finally!)
-        print("Starting " + optimization_method + " optimization ...")
-        self.tictoc.tic()
-
-        if self.optimization_method == 'least_squares':
-            self.result = least_squares(self.internalObjectiveFunction, self.x, verbose=2, jac_sparsity=self.sparse_matrix, bounds=(bounds_min, bounds_max), method='trf', args=(), **optimization_options)
-        elif self.optimization_method == 'bfgs':
-            self.result = minimize(self.internalObjectiveFunction, self.x, args=(), method='L-BFGS-B', 
-                               jac=None, hess=None, hessp=None, bounds=None, constraints=(),
-                               tol=None, callback=None, **optimization_options)
-            # TODO include bonds bounds=(bounds_min, bounds_max)
+        if self.optimization_method == 'least_squares' or self.optimization_method in POPULATION_METHODS:
+            cost = 0.5 * np.sum(np.square(solver_errors))
         else:
-            raise ValueError('Unknown optimization method ' + optimization_method)
+            cost = np.sum(np.abs(solver_errors))
+        run.progress = (0, float(cost))
+
+        # Stop requests and the deadline are checked at each objective function call
+        run.stoppable = run.background or run.deadline is not None or run.max_function_calls is not None or \
+                        run.stall_rule is not None or run.iteration_listener is not None
+
+        callback = None
+        extra_options = {}
+        if run.stoppable or run.track_progress or run.user_callback is not None:
+            callback = self.internalIterationCallback  # progress is needed by the future and the stopping rules
+        if self.metrics_sink is not None:
+            from OptimizationUtils.metrics import MetricsCollector
+            run.metrics = MetricsCollector(self.metrics_sink)
+            callback = self.internalIterationCallback
+        if self.optimization_method == 'least_squares' and (run.metrics is not None or self.batched_objective):
+            # the Jacobian is computed by the optimizer to obtain the gradient norm, or to evaluate it in batches
+            if run.sparse_matrix is not None:
+                run.jacobian_sparsity = (run.sparse_matrix.tocsc(), group_columns(run.sparse_matrix))
+            optimization_options = {key: value for key, value in optimization_options.items() if key != 'jac'}
+            extra_options['jac'] = self.internalJacobianFunction
+            run.internal_jacobian = True
+        if run.metrics is not None:
+            run.metrics.iteration(0, self.x, cost, 0)
+        if callback is not None and self.optimization_method == 'least_squares':
+            extra_options['callback'] = callback
+
+        if run.stoppable:
+            run.updateBest(self.x, solver_errors)
 
+        # Call optimization function (finally!)
+        print("Starting " + optimization_method + " optimization ...")
+        run.start_time = time.perf_counter()
+
+        try:
+            if self.optimization_method == 'least_squares':
+                self.result = least_squares(self.internalObjectiveFunction, x0, verbose=2, jac_sparsity=run.sparse_matrix, bounds=(bounds_min, bounds_max), method='trf', args=(), **optimization_options, **extra_options)
+            elif self.optimization_method == 'bfgs':
+                self.result = minimize(self.internalObjectiveFunction, x0, args=(), method='L-BFGS-B',
+                                   jac=None, hess=None, hessp=None, bounds=None, constraints=(),
+                                   tol=None, callback=callback, **optimization_options)
+                # TODO include bonds bounds=(bounds_min, bounds_max)
+            elif self.optimization_method in POPULATION_METHODS:
+                from OptimizationUtils import population
+                self.result = population.minimize(self, optimization_options)
+            else:
+                raise ValueError('Unknown optimization method ' + optimization_method)
+            if run.solver_view is not None:  # the results have the parameter vector, like the ones of stopped runs
+                self.result.x = run.solver_view.toX(self.result.x)
+        except OptimizationStopped as stop:
+            print('Optimization stopped: ' + stop.message)
+            self.result = run.getBestResult(stop.message)
+        run.stoppable = False
+
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+
+        if run.metrics is not None:
+            run.metrics.finished(run.metrics_iteration, self.result.cost if 'cost' in self.result else self.result.fun,
+                                 run.status['num_function_calls'], self.result['message'])
+            run.metrics = None
 
         self.xf = deepcopy(list(self.result.x))  # Store final x values
         self.fromXToData(self.xf)
 
         self.finalOptimizationReport()  # print an informative report
+        if run.rebase_manifolds:
+            self.rebaseManifoldGroups()
+
+    def startMultiStartOptimization(self, num_starts=8, optimization_method='least_squares',
+                                    optimization_options=DEFAULT_OPTIMIZATION_OPTIONS, noise=0.1,
+                                    distribution='uniform', rotation_groups=None, rotation_noise=np.pi / 8, seed=None,
+                                    num_workers=None, lag_factor=10.0, min_iterations=3, verbose=False):
+        """ Global search around the current parameters: runs local optimizations from num_starts perturbed
+        starting points (see generateStarts), in parallel worker processes, and keeps the best one. Starts whose cost
+        is lag_factor times worse than the best cost of the other starts are stopped early.
+
+        The best parameters are copied to the data models. The result is the one of the best start, with two more
+        fields: 'start', the index of the best start, and 'starts', a summary (initial and final cost, number of
+        function calls, iterations, time and message) of every start.
+
+        :param num_starts: number of local optimizations. The first one starts at the current parameters.
+        :param num_workers: number of worker processes, None for one per cpu
+        :param lag_factor: stop starts whose cost is above lag_factor times the best cost, None to never stop them
+        :param min_iterations: number of iterations of each start before it can be stopped for lagging
+        :param verbose: show the printouts of the optimizations of each start
+        :return: the result
+        """
+        from OptimizationUtils import multistart
+
+        with self.exclusiveRun():
+            starts = self.generateStarts(num_starts, noise=noise, distribution=distribution,
+                                         rotation_groups=rotation_groups, rotation_noise=rotation_noise, seed=seed)
+            multistart.startMultiStart(self, starts, optimization_method, optimization_options,
+                                       num_workers=num_workers, lag_factor=lag_factor, min_iterations=min_iterations,
+                                       verbose=verbose)
+        return self.result
+
+    def getConnectedComponents(self):
+        """ Splits the problem into independent subproblems: sets of variables of the solver which share residuals
+        with each other but not with the variables of other sets. Frozen groups do not connect the residuals which
+        depend on them. Variables which do not affect any residual are left out, and keep their values.
+
+        :return: list of (variables, residuals) index arrays, one per component. The variables are indices of the
+        solver variables (see getSolverView) and the residuals are indices in the list of residuals.
+        """
+        from OptimizationUtils import components
+
+        if self.sparse_matrix is None:
+            raise ValueError('Cannot find the connected components without a sparse matrix. Use computeSparseMatrix '
+                             'or detectSparsity first.')
+        solver_view = self.getSolverView()
+        sparse_matrix = self.sparse_matrix if solver_view is None else solver_view.getSparseMatrix(self.sparse_matrix)
+        return components.findComponents(sparse_matrix)
+
+    def startOptimizationByComponents(self, optimization_method='least_squares',
+                                      optimization_options=DEFAULT_OPTIMIZATION_OPTIONS, num_workers=1,
+                                      verbose=False):
+        """ Solves each connected component of the problem (see getConnectedComponents) as a separate optimization,
+        with its own convergence criteria, optionally in parallel worker processes, and stitches the solutions.
+
+        The result has the summed cost and number of function calls of the components, and one more field,
+        'components', with a summary (size, cost, function calls, iterations, time and message) of each component.
+        If there is a single component, this is the same as startOptimization.
+
+        :param num_workers: number of worker processes, None for one per cpu
+        :param verbose: show the printouts of the optimization of each component
+        :return: the result
+        """
+        from OptimizationUtils import components
+
+        found = self.getConnectedComponents()
+        if len(found) <= 1:
+            self.startOptimization(optimization_method, optimization_options)
+            return self.result
+
+        with self.exclusiveRun():
+            components.startByComponents(self, found, optimization_method, optimization_options,
+                                         num_workers=num_workers, verbose=verbose)
+        return self.result
+
+    def startStagedOptimization(self):
+        """ Block coordinate optimization: runs the stages added with addStage one after the other, each starting
+        from the solution of the previous one, e.g. the intrinsics with the poses fixed, then the poses with the
+        intrinsics fixed, then everything for a few iterations.
+
+        The result is the one of the last stage, with one more field, 'stages', a summary (size, cost, function calls,
+        iterations, time and message) of each stage. The cost of each stage is the one of its residuals.
+
+        :return: the result
+        """
+        from OptimizationUtils import stages
+
+        if not self.stages:
+            raise ValueError('There are no stages. Use addStage first.')
+        with self.exclusiveRun():
+            summaries = stages.runStages(self, self.stages)
+        self.result.stages = summaries
+        return self.result
+
+    def startCoarseToFineOptimization(self, fractions=(0.05, 0.25, 1.0), optimization_method='least_squares',
+                                      optimization_options=DEFAULT_OPTIMIZATION_OPTIONS, coarse_options=None,
+                                      sampling='stratified', blocks=None, seed=0):
+        """ Multi resolution optimization: solves growing subsets of the residuals, each level starting from the
+        solution of the previous one, until the full problem converges. Each level has a fraction of each block of
+        residuals (see OptimizationUtils.subsampling), and the levels but the last are solved to a loose tolerance.
+
+        The result is the one of the last level, with one more field, 'levels', a summary (number of residuals, cost,
+        function calls, iterations, time and message) of each level.
+
+        :param fractions: increasing fractions of each block of residuals, the last one must be 1
+        :param coarse_options: solver options of all the levels but the last, which override optimization_options.
+        None for a tolerance of 1e-3.
+        :param sampling: 'stratified' to spread the residuals of each subset evenly over the block, or 'random'
+        :param blocks: list of lists of names of residuals, or None for the residuals which depend on the same
+        parameters
+        :param seed: seed of the random sampling
+        :return: the result
+        """
+        from OptimizationUtils import subsampling
+
+        if not fractions or not fractions[-1] == 1 or any(not 0 < fraction <= 1 for fraction in fractions) or \
+                any(a >= b for a, b in zip(fractions[:-1], fractions[1:])):
+            raise ValueError('The fractions ' + str(fractions) + ' must increase in ]0, 1] up to 1.')
+        if coarse_options is None:
+            coarse_options = {'ftol': 1e-3, 'xtol': 1e-3, 'gtol': 1e-3}
+        if blocks is None:
+            blocks = subsampling.getResidualBlocks(self)
+        else:
+            residual_indices = {name: idx for idx, name in enumerate(self.residuals)}
+            for name in [name for block in blocks for name in block]:
+                if name not in residual_indices:
+                    raise ValueError('Residual ' + name + ' of the blocks does not exist.')
+            blocks = [np.array([residual_indices[name] for name in block], dtype=int) for block in blocks]
+        levels = subsampling.sampleLevels(blocks, fractions, sampling=sampling, seed=seed)
+
+        with self.exclusiveRun():
+            summaries = subsampling.runLevels(self, levels, optimization_method, optimization_options, coarse_options)
+        self.result.levels = summaries
+        return self.result
 
     def getNumberOfFunctionCallsPerIteration(self, optimization_options):
 
+        if self.optimization_method in POPULATION_METHODS:  # the iterations are counted by the population methods
+            return
+
         # Count number of function calls for each optimizer iteration
         optimization_options_tmp = deepcopy(optimization_options)  # copy options to avoid interference
         optimization_options_tmp['max_nfev'] = 1  # set maximum iterations to 1
@@ -467,11 +1453,12 @@ class Optimizer:
 
         if self.optimization_method == 'least_squares':
             optimization_options_tmp['max_nfev'] = 1  # set maximum iterations to 1
-            _ = least_squares(self.internalObjectiveFunction, self.x, verbose=0, jac_sparsity=self.sparse_matrix,
+            _ = least_squares(self.internalObjectiveFunction, self.getSolverX(), verbose=0,
+                              jac_sparsity=self.run.sparse_matrix,
                           method='trf', args=(), **optimization_options_tmp)
         elif self.optimization_method == 'bfgs':
             optimization_options_tmp['maxiter'] = 1  # set maximum iterations to 1
-            _ = minimize(self.internalObjectiveFunction, self.x, args=(), method='L-BFGS-B', 
+            _ = minimize(self.internalObjectiveFunction, self.getSolverX(), args=(), method='L-BFGS-B', 
                                jac=None, hess=None, hessp=None, bounds=None, constraints=(),
                                tol=None, callback=None)
 
@@ -492,18 +1479,76 @@ class Optimizer:
     def finalOptimizationReport(self):
         """Just print some info and show the images"""
         print('\n-----------------------------\n' +
-              'Optimization finished in ' + str(round(self.tictoc.tocvalue(), 5)) + ' secs: ' + self.result['message'])
+              'Optimization finished in ' + str(round(self.run.getElapsedTime(), 5)) + ' secs: ' +
+              self.result['message'])
 
-        if self.always_visualize and self.internal_visualization:
+        if self.run.visualize and self.internal_visualization:
             print('Press x to finalize ...')
             while True:
                 self.vis_function_handle(self.data_models)
-                if self.wm.waitForKey(time_to_wait=0.1, verbose=False) == 'x':
+                if self.run.wm.waitForKey(time_to_wait=0.1, verbose=False) == 'x':
                     break
 
     # ---------------------------
     # Utilities
     # ---------------------------
+    def saveProblem(self, path, evaluations=True):
+        """ Saves the parameter layout, bounds, residuals, sparsity, x0, optimizer options and the recorded
+        evaluations to a npz file. Use OptimizationUtils.capture.loadProblem to replay it.
+
+        :param path: the file to write
+        :param evaluations: include the evaluations recorded with setRecordEvaluations
+        """
+        from OptimizationUtils import capture
+        capture.saveProblem(self, path, evaluations=evaluations)
+
+    def replayTrace(self, path, time_to_wait=0.1):
+        """ Replays a trace recorded with setTraceRecorder. For each recorded iteration, the parameters are copied to
+        the data models and the visualization function, the residuals and the error evolution figures are updated, as
+        they would have been during the optimization. Press 'x' to stop the replay.
+
+        The optimizer must be configured with the same parameters and residuals used in the recording.
+
+        :param path: the directory of the trace
+        :param time_to_wait: time shown per iteration, in seconds. If None, waits for 'c' at each iteration.
+        """
+        from OptimizationUtils.trace import TraceReader
+
+        if self.isHeadless():
+            raise ValueError('Cannot replay trace ' + str(path) + ' in headless mode. Load it with '
+                             'OptimizationUtils.trace.TraceReader instead.')
+
+        reader = TraceReader(path)
+        if not reader.param_names == self.getParameters() or not reader.residual_names == list(self.residuals.keys()):
+            raise ValueError('Trace ' + str(path) + ' was recorded with other parameters or residuals than the ones '
+                                                    'configured in this optimizer.')
+
+        self.run = run = OptimizationRun(self.optimization_method, self.optimization_options)
+        self.data_models['status'] = run.status
+        run.visualize = True
+        run.figures = list(self.figures)
+
+        for iteration, x, errors in reader:
+            self.x = list(x.astype(float))
+            self.fromXToData()
+            run.status['num_iterations'] = iteration
+
+            if run.wm is None:  # first draw of the figures
+                self.errors0 = list(errors)
+                if self.internal_visualization:
+                    self.drawResidualsFigure()
+                    self.drawErrorEvolutionFigure()
+                run.wm = KeyPressManager.WindowManager(run.figures, headless=False)
+            elif self.internal_visualization:
+                self.updateInternalVisualization(errors)
+
+            if self.vis_function_handle is not None:
+                self.vis_function_handle(self.data_models)
+
+            print('Iteration ' + str(iteration) + ': total error ' + str(np.sum(np.abs(errors))))
+            if run.wm.waitForKey(time_to_wait=time_to_wait, verbose=False) == 'x':
+                break
+
     def addNoiseToX(self, noise=0.1, x=None):
         """ Adds uniform noise to the values in the parameter vector x
 
@@ -514,7 +1559,135 @@ class Optimizer:
         if x is None:
             x = self.x
 
-        return x * np.array([random.uniform(1 - noise, 1 + noise) for _ in xrange(len(x))], dtype=np.float)
+        return x * np.array([random.uniform(1 - noise, 1 + noise) for _ in range(len(x))], dtype=float)
+
+    def generateStarts(self, num_starts, noise=0.1, distribution='uniform', rotation_groups=None,
+                       rotation_noise=np.pi / 8, seed=None):
+        """ Generates starting points around the current parameters, e.g. for startMultiStartOptimization. Each
+        parameter is perturbed relative to its magnitude (or by an absolute amount if it is zero) and the starts are
+        clipped to the bounds. The parameters of frozen groups are not perturbed, and tied parameters are perturbed
+        together.
+
+        :param num_starts: number of starting points. The first one is the current parameter vector.
+        :param noise: magnitude of the perturbation. With 0.1 a parameter of value 2 is perturbed by up to 0.2
+        (uniform) or with a standard deviation of 0.2 (gaussian).
+        :param distribution: 'uniform' or 'gaussian'
+        :param rotation_groups: names of groups of 3 parameters which are rotation vectors (angle axis). Instead of
+        perturbing each parameter, they are composed with a rotation of random axis.
+        :param rotation_noise: maximum angle (uniform) or standard deviation of the angle (gaussian) of the rotations,
+        in radians
+        :param seed: seed of the random generator
+        :return: a (num_starts, n) array
+        """
+        rng = np.random.default_rng(seed)
+        x0 = np.array(self.x, dtype=float)
+        scale = np.where(x0 != 0, np.abs(x0), 1.0)
+        if distribution == 'uniform':
+            perturbations = rng.uniform(-noise, noise, (num_starts, len(x0)))
+            angles = rng.uniform(0, rotation_noise, num_starts)
+        elif distribution == 'gaussian':
+            perturbations = rng.normal(0, noise, (num_starts, len(x0)))
+            angles = rng.normal(0, rotation_noise, num_starts)
+        else:
+            raise ValueError('Unknown distribution ' + str(distribution) + '. Use uniform or gaussian.')
+        starts = x0 + perturbations * scale
+
+        for group_name in rotation_groups or []:
+            if group_name not in self.groups or not len(self.groups[group_name].idx) == 3:
+                raise ValueError('Rotation group ' + str(group_name) + ' must be a group of 3 parameters.')
+            from scipy.spatial.transform import Rotation
+            idx = list(self.groups[group_name].idx)
+            axes = rng.normal(size=(num_starts, 3))
+            axes /= np.linalg.norm(axes, axis=1)[:, np.newaxis]
+            rotations = Rotation.from_rotvec(axes * angles[:, np.newaxis]) * Rotation.from_rotvec(x0[idx])
+            starts[:, idx] = rotations.as_rotvec()
+
+        starts[0] = x0
+        solver_view = self.getSolverView()
+        if solver_view is not None:  # frozen parameters keep their values and tied ones share theirs
+            starts = solver_view.toXBatch(starts[:, solver_view.first_indices])
+        bounds_min, bounds_max = self.getBounds()
+        return np.clip(starts, bounds_min, bounds_max)
+
+    def shareDataModels(self, min_size=1024 * 1024):
+        """ Moves the large numpy arrays of the data models (the data models themselves, the values of dicts, the items
+        of lists and the attributes of objects) to shared memory, so that worker processes use them without copies.
+        Use it for static data, such as images or point clouds, after adding the data models and before starting the
+        optimization. The workers see the arrays as read-only. See OptimizationUtils.sharedmemory.
+
+        :param min_size: minimum size of the arrays to move, in bytes
+        :return: the number of bytes moved to shared memory
+        """
+        from OptimizationUtils.sharedmemory import shareArrays
+
+        num_bytes = 0
+        for key in list(self.data_models.keys()):
+            if key == 'status':
+                continue
+            self.data_models[key], shared_bytes = shareArrays(self.data_models[key], min_size)
+            num_bytes += shared_bytes
+        print('Moved ' + str(round(num_bytes / 1024.0 / 1024.0, 1)) + ' MB of the data models to shared memory.')
+        return num_bytes
+
+    def getBounds(self):
+        """ :return: (bounds_min, bounds_max) arrays with the bounds of all parameters """
+        bounds_min = []
+        bounds_max = []
+        for name in self.groups:
+            _, _, _, _, _, bound_max, bound_min = self.groups[name]
+            bounds_max.extend(bound_max)
+            bounds_min.extend(bound_min)
+        return np.array(bounds_min, dtype=float), np.array(bounds_max, dtype=float)
+
+    def getSolverView(self, variables=None):
+        """ :return: the SolverView of the current parameters, or None if the variables of the solver are the
+        parameters, i.e. no group is frozen and no parameters are tied
+
+        :param variables: indices of the variables to keep (see SolverView.restrict), or None for all
+        """
+        if variables is not None:
+            solver_view = self.getSolverView()
+            if solver_view is None:
+                solver_view = SolverView(self.x, range(len(self.x)), range(len(self.x)), len(self.x))
+            return solver_view.restrict(variables)
+
+        if not self.frozen_groups and not self.ties:
+            return None
+
+        # The parameters of each tie have the same root (union find), which identifies their variable
+        roots = {}
+
+        def findRoot(idx):
+            while not roots.get(idx, idx) == idx:
+                idx = roots[idx]
+            return idx
+
+        for tie in self.ties:
+            tie_root = findRoot(self.param_indices[tie[0]])
+            for param_name in tie[1:]:
+                root = findRoot(self.param_indices[param_name])
+                if not root == tie_root:
+                    roots[root] = tie_root
+
+        x_indices, z_indices, variables = [], [], {}  # variables: key={root} value = index of the variable
+        for group_name, group in self.groups.items():
+            if group_name in self.frozen_groups:
+                continue
+            for idx in group.idx:
+                root = findRoot(idx)
+                if root not in variables:
+                    variables[root] = len(variables)
+                x_indices.append(idx)
+                z_indices.append(variables[root])
+        if not x_indices:
+            raise ValueError('All the parameter groups are frozen, there is nothing to optimize.')
+        return SolverView(self.x, x_indices, z_indices, len(variables))
+
+    def getSolverX(self):
+        """ :return: the variables of the solver of the current run, given the current parameters """
+        if self.run.solver_view is None:
+            return self.x
+        return self.run.solver_view.fromX(self.x)
 
     def getParameters(self):
         """ Gets all the existing parameters
@@ -542,11 +1715,78 @@ class Optimizer:
         if x is None:
             x = self.x
 
+        bulk_values = {}  # data_key: the values returned by the bulk getter
         for group_name, group in self.groups.items():
-            values = group.getter(self.data_models[group.data_key])
+            accessors = self.bulk_accessors.get(group.data_key)
+            if accessors is None or accessors.getter is None or group_name in self.view_groups:
+                values = group.getter(self.data_models[group.data_key])
+            else:
+                if group.data_key not in bulk_values:
+                    bulk_values[group.data_key] = accessors.getter(self.data_models[group.data_key])
+                values = bulk_values[group.data_key][group_name]
+
             for i, idx in enumerate(group.idx):
                 x[idx] = values[i]
 
+    def evaluateBatch(self, xs):
+        """ Computes the residuals of a batch of parameter vectors, with a single call of the objective function if it
+        is batched, or one call per vector otherwise. The data models are left with the values of the batch.
+
+        :param xs: (K, n) array of parameter vectors
+        :return: (K, m) array of residuals
+        """
+        xs = np.asarray(xs, dtype=float)
+        if self.batched_objective:
+            self.fromXToDataBatch(xs)
+            return self.batchErrorsToArray(self.objective_function(self.data_models), len(xs))
+
+        residuals = []
+        for x in xs:
+            self.fromXToData(list(x))
+            residuals.append(self.errorDictToList(self.objective_function(self.data_models)))
+        return np.array(residuals, dtype=float)
+
+    def batchErrorsToArray(self, errors, batch_size):
+        """ Converts the output of a batched objective function to a (K, m) array.
+
+        :param errors: (K, m) array like, or dict with K values (or a single value) per residual
+        :param batch_size: K
+        """
+        if type(errors) is dict:
+            errors = np.column_stack([np.broadcast_to(np.ravel(np.asarray(value, dtype=float)), (batch_size,))
+                                      for value in self.errorDictToList(errors)])
+        else:
+            errors = np.asarray(errors, dtype=float)
+
+        if not errors.shape == (batch_size, len(self.residuals)):
+            raise ValueError('Batched objective function returned residuals of shape ' + str(errors.shape) +
+                             ', expected (' + str(batch_size) + ', ' + str(len(self.residuals)) + ').')
+        return errors
+
+    def fromXToDataBatch(self, xs):
+        """ Copies a batch of parameter vectors to the data models, for batched objective functions. Each setter
+        receives, for each parameter of its group, a (K, 1) view of the column of xs with the values of the parameter.
+        The fields of view groups become (K, size of the group) views of xs.
+
+        :param xs: (K, n) array of parameter vectors
+        """
+        if self.view_groups:
+            self.parameter_buffer = None  # the fields are views of xs, bind them to the buffer again when used
+            for group_name, binding in self.view_groups.items():
+                group = self.groups[group_name]
+                binding.bindView(self.data_models[group.data_key], xs[:, group.idx[0]:group.idx[-1] + 1])
+
+        for call in self.getSetterCalls():
+            if call.group is None:
+                call.setter(self.data_models[call.data_key], self.bulkValues(call, xs[:, call.indices]))
+                continue
+
+            values = []
+            for idx in call.group.idx:
+                values.append(xs[:, idx:idx + 1])
+
+            call.setter(self.data_models[call.data_key], values)
+
     def fromXToData(self, x=None):
         """ Copies values of all parameters from vector x to the data
 
@@ -555,26 +1795,177 @@ class Optimizer:
         if x is None:
             x = self.x
 
-        for group_name, group in self.groups.items():
+        if self.view_groups:
+            if self.parameter_buffer is None or not len(self.parameter_buffer) == len(x):
+                self.bindParameterViews(len(x))
+            self.parameter_buffer[:] = x  # a single copy sets all the view groups
+
+        x_array = None  # x as an array, for the bulk setters
+        for call in self.getSetterCalls():
+            if call.group is None:
+                if x_array is None:
+                    x_array = np.asarray(x, dtype=float)
+                call.setter(self.data_models[call.data_key], self.bulkValues(call, x_array[call.indices]))
+                continue
+
             values = []
-            for idx in group.idx:
+            for idx in call.group.idx:
                 values.append(x[idx])
 
-            group.setter(self.data_models[group.data_key], values)
+            call.setter(self.data_models[call.data_key], values)
+
+    def getSetterCalls(self):
+        """ :return: the list of SetterCallT of fromXToData: one per group, or one per data model with bulk accessors,
+        in the order of the groups. View groups are not set by setters. """
+        if self.setter_calls is not None:
+            return self.setter_calls
+
+        calls = []
+        bulk_groups = OrderedDict()  # data_key: (position in calls, [group names])
+        for group_name, group in self.groups.items():
+            if group_name in self.view_groups:
+                continue
+            if group.data_key in self.bulk_accessors:
+                if group.data_key not in bulk_groups:
+                    bulk_groups[group.data_key] = (len(calls), [])
+                    calls.append(None)  # replaced when all the groups of the data model are known
+                bulk_groups[group.data_key][1].append(group_name)
+            else:
+                calls.append(SetterCallT(group.data_key, group, group.setter, False, None, None, None))
+
+        for data_key, (position, group_names) in bulk_groups.items():
+            indices, slices, fields = [], {}, []
+            for group_name in group_names:
+                group_idx = list(self.groups[group_name].idx)
+                slices[group_name] = slice(len(indices), len(indices) + len(group_idx))
+                fields.append((group_name, float, (len(group_idx),)))
+                indices.extend(group_idx)
+            accessors = self.bulk_accessors[data_key]
+            calls[position] = SetterCallT(data_key, None, accessors.setter, accessors.structured,
+                                          np.array(indices, dtype=int), slices, np.dtype(fields))
+
+        self.setter_calls = calls
+        return calls
+
+    def bulkValues(self, call, values):
+        """ Converts the values of the parameters of a data model to the argument of its bulk setter.
+
+        :param call: the SetterCallT of the data model
+        :param values: array with the values of its parameters, (size,) or (K, size) for batches
+        :return: a dict with the values of each group, or a 0-d structured array ((K,) for batches)
+        """
+        if call.structured:  # the parameters of each group are consecutive in values, as the fields of dtype
+            return np.ascontiguousarray(values).view(call.dtype)[..., 0]
+        return {group_name: values[..., group_slice] for group_name, group_slice in call.slices.items()}
+
+    def bindParameterViews(self, num_params):
+        """ Creates the parameter buffer and replaces the fields of the view groups by views of it.
+
+        :param num_params: size of the buffer
+        """
+        self.parameter_buffer = np.zeros(num_params, dtype=float)
+        for group_name, binding in self.view_groups.items():
+            group = self.groups[group_name]
+            binding.bindView(self.data_models[group.data_key], self.parameter_buffer[group.idx[0]:group.idx[-1] + 1])
+
+    def detectSparsity(self, step=1e-3, num_probes=2, batch_size=32, cache_dir=None, seed=0):
+        """ Detects which parameters affect each residual by perturbing each parameter group (see
+        OptimizationUtils.sparsity), and sets the params of the residuals and the sparse matrix accordingly. If no
+        residuals were pushed, pushes one per residual returned by the objective function, named after its index (or
+        its key, for dicts).
+
+        :param step: size of the perturbations, relative to the magnitude of each parameter
+        :param num_probes: number of perturbations of each group
+        :param batch_size: number of perturbations evaluated in each batch
+        :param cache_dir: directory where the detected sparsity is cached, keyed by the names of the parameters and
+        residuals, or None
+        :param seed: seed of the random perturbations
+        :return: the sparse matrix
+        """
+        if not self.residuals:
+            self.pushResidualsFromObjectiveFunction()
+
+        detected = self.probeSparsity(step, num_probes, batch_size, cache_dir, seed)
+        param_names = self.getParameters()
+        for row, name in enumerate(self.residuals):  # the params of each residual, as pushResidual would have them
+            self.residuals[name] = [param_names[col] for col in detected.indices[detected.indptr[row]:
+                                                                                 detected.indptr[row + 1]]]
+        self.sparse_matrix = detected.tolil()
+        print('Detected ' + str(detected.nnz) + ' nonzeros in a sparse matrix of ' + str(detected.shape) + '.')
+        return self.sparse_matrix
+
+    def verifySparsity(self, step=1e-3, num_probes=2, batch_size=32, cache_dir=None, seed=0):
+        """ Compares the params given to pushResidual with the sparsity detected by perturbation, see detectSparsity.
+        The residuals and the sparse matrix are not changed.
+
+        :return: (missing, extra), lists of (residual name, parameter name). Missing dependencies are detected but not
+        declared, so the Jacobian misses them. Extra ones are declared but not detected, which costs function calls.
+        """
+        from OptimizationUtils.sparsity import compareSparsity
+
+        if self.sparse_matrix is None:
+            self.computeSparseMatrix()
+        detected = self.probeSparsity(step, num_probes, batch_size, cache_dir, seed)
+        missing, extra = compareSparsity(self.sparse_matrix, detected, list(self.residuals), self.getParameters())
+        print('Declared sparsity has ' + str(len(missing)) + ' missing and ' + str(len(extra)) +
+              ' extra dependencies, compared to the detected one.')
+        for residual, param in missing[0:10]:
+            print('--- residual ' + residual + ' depends on ' + param + ', which is not declared')
+        return missing, extra
+
+    def probeSparsity(self, step, num_probes, batch_size, cache_dir, seed):
+        """ :return: the detected sparsity as a csr matrix, from the cache if it has it """
+        from OptimizationUtils import sparsity
+
+        key = None
+        if cache_dir is not None:
+            key = sparsity.structureKey(self)
+            cached = sparsity.loadCachedSparsity(cache_dir, key)
+            if cached is not None:
+                print('Loaded the sparsity from the cache in ' + cache_dir)
+                return cached
+
+        detected = sparsity.probeSparsity(self, step, num_probes, batch_size, seed)
+        if key is not None:
+            sparsity.saveCachedSparsity(cache_dir, key, detected)
+        return detected
+
+    def pushResidualsFromObjectiveFunction(self):
+        """ Pushes, without params, one residual per residual returned by the objective function at the current
+        parameters, named after its index or its key. """
+        if self.batched_objective:
+            self.fromXToDataBatch(np.array([self.x], dtype=float))
+        else:
+            self.fromXToData()
+        errors = self.objective_function(self.data_models)
+        if type(errors) is dict:
+            names = list(errors.keys())
+        else:
+            names = [str(i) for i in range(np.shape(errors)[-1])]
+        for name in names:
+            self.pushResidual(name)
 
     def computeSparseMatrix(self):
         """ Computes the sparse matrix given the parameters and the residuals. Should be called only after setting both.
 
         """
-        params = self.getParameters()
-        self.sparse_matrix = lil_matrix((len(self.residuals), len(params)), dtype=int)
-
-        for i, key in enumerate(self.residuals):
-            for group_name, group in self.groups.items():
-                for j, param in enumerate(group.param_names):
-                    if param in self.residuals[key]:
-                        idx = group.idx[j]
-                        self.sparse_matrix[i, idx] = 1
+        from scipy.sparse import coo_matrix
+
+        rows, cols = [], []
+        idxs_cache = {}  # residuals are often pushed with the same list of params, resolve each list only once
+        for i, (name, params) in enumerate(self.residuals.items()):
+            if params is None:
+                raise ValueError('Residual ' + name + ' was pushed without params. Call detectSparsity to compute the '
+                                                      'sparse matrix.')
+            idxs = idxs_cache.get(id(params))
+            if idxs is None:
+                idxs = idxs_cache[id(params)] = sorted(set(self.param_indices[param] for param in params))
+            rows.extend([i] * len(idxs))
+            cols.extend(idxs)
+
+        sparse_matrix = coo_matrix((np.ones(len(rows), dtype=int), (rows, cols)),
+                                   shape=(len(self.residuals), len(self.x)))
+        self.sparse_matrix = sparse_matrix.tolil()
 
     # ---------------------------
     # Print and display
@@ -691,43 +2082,68 @@ class Optimizer:
     # Drawing and figures
     # ---------------------------
     def drawResidualsFigure(self):
+        run = self.run
 
         # Prepare residuals figure
-        self.figure_residuals = matplotlib.pyplot.figure()
-        self.figures.append(self.figure_residuals)
-        self.ax = self.figure_residuals.add_subplot(1, 1, 1)
+        run.figure_residuals = plt.figure()
+        run.figures.append(run.figure_residuals)
+        run.ax = run.figure_residuals.add_subplot(1, 1, 1)
         x = range(0, len(self.errors0))
-        self.initial_residuals_handle, = self.ax.plot(x, self.errors0, color='green', marker='o',
-                                                      linestyle='solid', linewidth=2, markersize=6)
-        self.ax.plot(x, [0] * len(self.errors0), color='black', linestyle='dashed', linewidth=2, markersize=6)
-        self.ax.set_xticks(x, minor=False)
-        self.ax.set_xticks([], minor=False)
+        run.initial_residuals_handle, = run.ax.plot(x, self.errors0, color='green', marker='o',
+                                                    linestyle='solid', linewidth=2, markersize=6)
+        run.ax.plot(x, [0] * len(self.errors0), color='black', linestyle='dashed', linewidth=2, markersize=6)
+        run.ax.set_xticks(x, minor=False)
+        run.ax.set_xticks([], minor=False)
         # self.ax.set_xticklabels(list(self.residuals.keys()))
 
-        matplotlib.pyplot.title('Optimization Residuals')
-        matplotlib.pyplot.xlabel('Residuals')
-        matplotlib.pyplot.ylabel('Value')
-        for tick in self.ax.get_xticklabels():
+        plt.title('Optimization Residuals')
+        plt.xlabel('Residuals')
+        plt.ylabel('Value')
+        for tick in run.ax.get_xticklabels():
             tick.set_rotation(90)
 
         # self.wm.waitForKey(time_to_wait=0.01, verbose=True)
 
-        self.plot_handle, = self.ax.plot(range(0, len(self.errors0)), self.errors0, color='blue', marker='s',
-                                         linestyle='solid', linewidth=2, markersize=6)
-        matplotlib.pyplot.legend((self.initial_residuals_handle, self.plot_handle), ('Initial', 'Current'))
-        self.ax.relim()
-        self.ax.autoscale_view()
+        run.plot_handle, = run.ax.plot(range(0, len(self.errors0)), self.errors0, color='blue', marker='s',
+                                       linestyle='solid', linewidth=2, markersize=6)
+        plt.legend((run.initial_residuals_handle, run.plot_handle), ('Initial', 'Current'))
+        run.ax.relim()
+        run.ax.autoscale_view()
         # self.wm.waitForKey(time_to_wait=0.01, verbose=True)
 
-        self.figure_residuals.canvas.draw()
-        matplotlib.pyplot.waitforbuttonpress(0.01)
+        run.figure_residuals.canvas.draw()
+        plt.waitforbuttonpress(0.01)
+
+    def updateInternalVisualization(self, errors):
+        """ Redraws the residuals and error evolution figures with new residuals. """
+        run = self.run
+
+        # redraw residuals plot
+        run.plot_handle.set_data(range(0, len(errors)), errors)
+        run.ax.relim()  # recompute new limits
+        run.ax.autoscale_view()  # re-enable auto scale
+
+        # redraw error evolution plot
+        run.total_error.append(np.sum(np.abs(errors)))
+        x = range(0, len(run.total_error))
+        run.error_plot_handle, = run.error_ax.plot(x, run.total_error,
+                                                   color='blue',
+                                                   linestyle='solid', linewidth=2, markersize=6)
+
+        # reset x limits if needed
+        _, xmax = run.error_ax.get_xlim()
+        if x[-1] > xmax:
+            run.error_ax.set_xlim(0, x[-1] + 100)
+
+        run.error_ax.set_ylim(0, np.max(run.total_error))
 
     def drawErrorEvolutionFigure(self):
+        run = self.run
 
         # Prepare residuals figure
-        self.figure_error_evolution = matplotlib.pyplot.figure()
-        self.figures.append(self.figure_error_evolution)
-        self.error_ax = self.figure_error_evolution.add_subplot(1, 1, 1)
+        run.figure_error_evolution = plt.figure()
+        run.figures.append(run.figure_error_evolution)
+        run.error_ax = run.figure_error_evolution.add_subplot(1, 1, 1)
 
         # x = range(0, len(self.errors0))
         # self.error_handle, = self.ax.plot(0, np.sum(self.errors0), color='green', marker='o',
@@ -737,17 +2153,17 @@ class Optimizer:
         # self.ax.set_xticks([], minor=True)
         # self.ax.set_xticklabels(list(self.residuals.keys()))
 
-        matplotlib.pyplot.title('Total Error vs iterations')
-        matplotlib.pyplot.xlabel('Iteration')
-        matplotlib.pyplot.ylabel('Total error')
+        plt.title('Total Error vs iterations')
+        plt.xlabel('Iteration')
+        plt.ylabel('Total error')
 
         # self.wm.waitForKey(time_to_wait=0.01, verbose=True)
 
-        self.total_error = [np.sum(self.errors0)]
-        self.error_plot_handle, = self.error_ax.plot(range(0, len(self.total_error)), self.total_error, color='blue',
-                                                     linestyle='solid', linewidth=2, markersize=1)
-        self.error_ax.relim()
-        self.error_ax.autoscale_view()
+        run.total_error = [np.sum(self.errors0)]
+        run.error_plot_handle, = run.error_ax.plot(range(0, len(run.total_error)), run.total_error, color='blue',
+                                                   linestyle='solid', linewidth=2, markersize=1)
+        run.error_ax.relim()
+        run.error_ax.autoscale_view()
 
-        self.figure_error_evolution.canvas.draw()
-        matplotlib.pyplot.waitforbuttonpress(0.01)
+        run.figure_error_evolution.canvas.draw()
+        plt.waitforbuttonpress(0.01)
@@ -0,0 +1,7 @@
+"""
+Headless benchmark suite for the OptimizationUtils optimizer core.
+
+Run it with:
+
+    python -m OptimizationUtils.bench --help
+"""
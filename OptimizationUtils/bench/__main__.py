@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Command line interface of the benchmark suite, e.g.:
+
+    python -m OptimizationUtils.bench -w cosine_fitting pc2pc -s 1 4 -o results.json
+    python -m OptimizationUtils.bench -b baseline.json -t 0.2
+    python -m OptimizationUtils.bench --captures slow_calibration.npz
+    python -m OptimizationUtils.bench -w synthetic_calibration --concurrency 8
+    python -m OptimizationUtils.bench -w cosine_fitting --multistart 16 --workers 4
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import argparse
+import json
+import os
+import sys
+
+from OptimizationUtils.bench import runner
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+
+def main(argv=None):
+    # -----------------------------------------------------
+    # INITIALIZATION
+    # -----------------------------------------------------
+    ap = argparse.ArgumentParser(prog='python -m OptimizationUtils.bench',
+                                 description='Benchmarks the OptimizationUtils optimizer on synthetic workloads.')
+    ap.add_argument('-w', '--workloads', nargs='+', choices=list(WORKLOADS.keys()), default=None,
+                    help='Workloads to run. Default is all workloads, or none if captures are given.')
+    ap.add_argument('-c', '--captures', nargs='+', default=[],
+                    help='Problem captures (see OptimizationUtils.capture) to replay.')
+    ap.add_argument('--concurrency', type=int, default=0,
+                    help='Also run a concurrency stress test with this number of threads per workload.')
+    ap.add_argument('--multistart', type=int, default=0,
+                    help='Also run a multi-start optimization with this number of starts per workload.')
+    ap.add_argument('--workers', type=int, default=None,
+                    help='Number of worker processes of the multi-start optimizations. Default is one per cpu.')
+    ap.add_argument('--skip_imports', action='store_true', default=False,
+                    help='Do not measure the import time of the OptimizationUtils modules.')
+    ap.add_argument('--save_captures', type=str, default=None,
+                    help='Save a capture of each workload to this directory.')
+    ap.add_argument('-s', '--scales', nargs='+', type=int, default=[1], help='Problem size multipliers.')
+    ap.add_argument('-r', '--repeat', type=int, default=3, help='Number of timed runs per workload.')
+    ap.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data.')
+    ap.add_argument('-o', '--output', type=str, default=None, help='Write the results to this json file.')
+    ap.add_argument('-b', '--baseline', type=str, default=None, help='Compare the results against this json file.')
+    ap.add_argument('-t', '--tolerance', type=float, default=0.2,
+                    help='Relative increase of a metric accepted before it is reported as a regression.')
+    ap.add_argument('--save_baseline', type=str, default=None, help='Store the results as a new baseline.')
+    ap.add_argument('-v', '--verbose', action='store_true', default=False, help='Show the optimizer printouts.')
+    args = vars(ap.parse_args(argv))
+    if args['workloads'] is None:
+        args['workloads'] = [] if args['captures'] else list(WORKLOADS.keys())
+
+    # -----------------------------------------------------
+    # EXECUTION
+    # -----------------------------------------------------
+    results = []
+    if not args['skip_imports'] and args['workloads']:
+        for module in runner.IMPORT_MODULES:
+            print('Importing ' + module + ' ...')
+            results.append(runner.runImport(module, repeat=args['repeat']))
+
+    for scale in args['scales']:
+        for name in args['workloads']:
+            print('Running ' + name + ' with scale ' + str(scale) + ' ...')
+            capture_path = None
+            if args['save_captures'] is not None:
+                capture_path = os.path.join(args['save_captures'], name + '_' + str(scale) + '.npz')
+            results.append(runner.runWorkload(name, scale=scale, seed=args['seed'], repeat=args['repeat'],
+                                              verbose=args['verbose'], capture_path=capture_path))
+            if args['concurrency'] > 0:
+                print('Running ' + name + ' with scale ' + str(scale) + ' in ' + str(args['concurrency']) +
+                      ' concurrent threads ...')
+                results.append(runner.runConcurrency(name, num_threads=args['concurrency'], scale=scale,
+                                                     seed=args['seed'], verbose=args['verbose']))
+            if args['multistart'] > 0:
+                print('Running ' + name + ' with scale ' + str(scale) + ' from ' + str(args['multistart']) +
+                      ' starts ...')
+                results.append(runner.runMultiStart(name, num_starts=args['multistart'], num_workers=args['workers'],
+                                                    scale=scale, seed=args['seed'], verbose=args['verbose']))
+
+    for path in args['captures']:
+        print('Replaying ' + path + ' ...')
+        results.append(runner.runCapture(path, repeat=args['repeat'], verbose=args['verbose']))
+
+    print('\n' + runner.formatResults(results))
+
+    if args['output'] is not None:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args['save_baseline'] is not None:
+        runner.saveBaseline(results, args['save_baseline'])
+        print('\nSaved baseline to ' + args['save_baseline'])
+
+    # -----------------------------------------------------
+    # TERMINATION
+    # -----------------------------------------------------
+    exit_code = 0
+    if args['baseline'] is not None:
+        comparisons = runner.compareToBaseline(results, runner.loadBaseline(args['baseline']),
+                                               tolerance=args['tolerance'])
+        print('\nComparison against ' + args['baseline'] + ':\n' + runner.formatComparisons(comparisons))
+        if any(comparison[-1] for comparison in comparisons):
+            print('\nPerformance regressions detected.')
+            exit_code = 1
+
+    inconsistent = [result['workload'] for result in results if result.get('consistent') is False]
+    if inconsistent:
+        print('\nConcurrent runs gave results different from sequential runs: ' + ', '.join(inconsistent))
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
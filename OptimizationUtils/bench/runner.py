@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+Runs the benchmark workloads and compares the measurements against a stored baseline.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import contextlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from OptimizationUtils import capture
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+# Metrics for which larger is worse and that are checked against the baseline
+COMPARED_METRICS = ['wall_time', 'time_per_call', 'peak_memory']
+
+# Modules whose import time is measured
+IMPORT_MODULES = ['OptimizationUtils.OptimizationUtils', 'OptimizationUtils.utilities']
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+class ObjectiveProbe:
+    """ Wraps an objective function to count the calls and accumulate the time spent inside it. """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def __call__(self, data_models):
+        self.calls += 1
+        t = time.perf_counter()
+        try:
+            return self.handle(data_models)
+        finally:
+            self.elapsed += time.perf_counter() - t
+
+
+@contextlib.contextmanager
+def quiet(verbose=False):
+    """ Silences the optimizer printouts unless verbose is set. """
+    if verbose:
+        yield
+    else:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+
+def runOnce(name, scale=1, seed=0, verbose=False, measure_memory=False, capture_path=None):
+    """ Builds and solves a workload once.
+
+    :param name: the name of the workload, a key of WORKLOADS
+    :param scale: problem size multiplier
+    :param seed: seed used to generate the synthetic data
+    :param verbose: do not silence the optimizer printouts
+    :param measure_memory: trace python allocations to obtain the peak memory (slows down the run)
+    :param capture_path: save the problem and its evaluations to this file, to be replayed with runCapture
+    :return: a dict with the measurements
+    """
+    with quiet(verbose):
+        workload = WORKLOADS[name](scale=scale, seed=seed)
+        opt = workload.optimizer
+        probe = ObjectiveProbe(opt.objective_function)
+        opt.setObjectiveFunction(probe, batched=opt.batched_objective)
+        opt.setRecordEvaluations(capture_path is not None)
+
+        if measure_memory:
+            tracemalloc.start()
+        t = time.perf_counter()
+        opt.startOptimization(optimization_options=workload.optimization_options)
+        wall_time = time.perf_counter() - t
+        peak_memory = None
+        if measure_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if capture_path is not None:
+            opt.saveProblem(capture_path)
+
+    return {'num_params': len(opt.x0), 'num_residuals': len(opt.residuals), 'wall_time': wall_time,
+            'objective_calls': probe.calls, 'objective_time': probe.elapsed,
+            'final_cost': float(opt.result.cost) if 'cost' in opt.result else float(opt.result.fun),
+            'peak_memory': peak_memory}
+
+
+def runWorkload(name, scale=1, seed=0, repeat=3, verbose=False, capture_path=None):
+    """ Runs a workload several times and summarizes the measurements.
+
+    The reported times are the medians over the repetitions. The peak memory comes from an additional run with
+    memory tracing enabled, so that tracing does not distort the times.
+
+    :param capture_path: save a capture of the problem to this file (from an additional run)
+    :return: a dict with the summarized measurements
+    """
+    runs = [runOnce(name, scale=scale, seed=seed, verbose=verbose) for _ in range(0, repeat)]
+    if capture_path is not None:
+        runOnce(name, scale=scale, seed=seed, verbose=verbose, capture_path=capture_path)
+    memory_run = runOnce(name, scale=scale, seed=seed, verbose=verbose, measure_memory=True)
+
+    wall_time = float(np.median([run['wall_time'] for run in runs]))
+    objective_time = float(np.median([run['objective_time'] for run in runs]))
+    objective_calls = runs[0]['objective_calls']
+    return {'workload': name, 'scale': scale, 'seed': seed, 'repeat': repeat,
+            'num_params': runs[0]['num_params'], 'num_residuals': runs[0]['num_residuals'],
+            'wall_time': wall_time,
+            'objective_calls': objective_calls,
+            'time_per_call': wall_time / max(objective_calls, 1),
+            'overhead_fraction': max(0.0, 1.0 - objective_time / wall_time) if wall_time > 0 else 0.0,
+            'peak_memory': memory_run['peak_memory'],
+            'final_cost': runs[0]['final_cost']}
+
+
+def runCapture(path, repeat=3, verbose=False):
+    """ Replays a problem capture (see OptimizationUtils.capture) several times. The time spent looking up the
+    recorded residuals plays the role of the objective time, so the overhead is the time spent in the solver.
+
+    :param path: the npz capture file
+    :return: a dict with the summarized measurements, in the same format as runWorkload
+    """
+    problem = capture.loadProblem(path)
+    walls, objective_times = [], []
+    for _ in range(0, repeat):
+        probe = ObjectiveProbe(problem.getRecordedResidualsFunction())
+        t = time.perf_counter()
+        result = problem.solve(probe, verbose=2 if verbose else 0)
+        walls.append(time.perf_counter() - t)
+        objective_times.append(probe.elapsed)
+        calls = probe.calls
+
+    tracemalloc.start()
+    problem.replay()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wall_time = float(np.median(walls))
+    return {'workload': 'capture:' + os.path.basename(path), 'scale': 1, 'seed': None, 'repeat': repeat,
+            'num_params': len(problem.x0), 'num_residuals': len(problem.residual_names),
+            'wall_time': wall_time,
+            'objective_calls': calls,
+            'time_per_call': wall_time / max(calls, 1),
+            'overhead_fraction': max(0.0, 1.0 - float(np.median(objective_times)) / wall_time),
+            'peak_memory': peak_memory,
+            'final_cost': float(result.cost) if 'cost' in result else float(result.fun)}
+
+
+def runConcurrency(name, num_threads=4, scale=1, seed=0, verbose=False):
+    """ Concurrency stress test: solves num_threads copies of a workload at the same time, each with its own
+    headless Optimizer in its own thread, and checks that every run gives exactly the same result as a sequential
+    run. Also checks that an optimizer refuses to start while it is already running.
+
+    :return: a dict in the same format as runWorkload, with an additional 'consistent' field
+    """
+    def solve(workload):
+        workload.optimizer.setHeadless(True)
+        workload.optimizer.startOptimization(optimization_options=workload.optimization_options)
+        return workload.optimizer
+
+    with quiet(verbose):
+        reference = solve(WORKLOADS[name](scale=scale, seed=seed))
+        workloads = [WORKLOADS[name](scale=scale, seed=seed) for _ in range(0, num_threads)]
+
+        t = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            optimizers = list(executor.map(solve, workloads))
+        wall_time = time.perf_counter() - t
+
+        refused = False
+        with optimizers[0].exclusiveRun():  # pretend that it is running
+            try:
+                optimizers[0].startOptimization(optimization_options=workloads[0].optimization_options)
+            except ValueError:
+                refused = True
+
+    consistent = refused and all(
+        np.array_equal(opt.xf, reference.xf) and opt.run.status == reference.run.status for opt in optimizers)
+    objective_calls = sum(opt.run.status['num_function_calls'] for opt in optimizers)
+    return {'workload': name + '*' + str(num_threads), 'scale': scale, 'seed': seed, 'repeat': 1,
+            'num_params': len(reference.x0), 'num_residuals': len(reference.residuals),
+            'wall_time': wall_time,
+            'objective_calls': objective_calls,
+            'time_per_call': wall_time / max(objective_calls, 1),
+            'overhead_fraction': None, 'peak_memory': None,
+            'final_cost': float(reference.result.cost) if 'cost' in reference.result else float(reference.result.fun),
+            'consistent': consistent}
+
+
+def runMultiStart(name, num_starts=8, num_workers=None, scale=1, seed=0, verbose=False):
+    """ Solves a workload with startMultiStartOptimization, with starts perturbed by 20%.
+
+    :return: a dict in the same format as runWorkload
+    """
+    workload = WORKLOADS[name](scale=scale, seed=seed)
+    optimizer = workload.optimizer
+    optimizer.setHeadless(True)
+    with quiet(verbose):
+        t = time.perf_counter()
+        result = optimizer.startMultiStartOptimization(num_starts=num_starts,
+                                                       optimization_options=workload.optimization_options,
+                                                       noise=0.2, seed=seed, num_workers=num_workers)
+        wall_time = time.perf_counter() - t
+
+    objective_calls = optimizer.run.status['num_function_calls']
+    return {'workload': name + '^' + str(num_starts), 'scale': scale, 'seed': seed, 'repeat': 1,
+            'num_params': len(optimizer.x0), 'num_residuals': len(optimizer.residuals),
+            'wall_time': wall_time,
+            'objective_calls': objective_calls,
+            'time_per_call': wall_time / max(objective_calls, 1),
+            'overhead_fraction': None, 'peak_memory': None,
+            'final_cost': float(result.cost) if 'cost' in result else float(result.fun)}
+
+
+def runImport(module, repeat=3):
+    """ Measures the time to import a module, each time in a fresh python interpreter.
+
+    :param module: the full name of the module
+    :return: a dict in the same format as runWorkload, where the wall time is the median import time
+    """
+    code = 'import time; t = time.perf_counter(); import ' + module + '; print(time.perf_counter() - t)'
+    env = dict(os.environ)  # make sure the child imports this copy of OptimizationUtils
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = package_root + os.pathsep + env.get('PYTHONPATH', '')
+
+    import_times = []
+    for _ in range(0, repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        import_times.append(float(output.decode().strip().splitlines()[-1]))
+
+    return {'workload': 'import:' + module.split('.')[-1], 'scale': 1, 'seed': None, 'repeat': repeat,
+            'num_params': None, 'num_residuals': None,
+            'wall_time': float(np.median(import_times)),
+            'objective_calls': None, 'time_per_call': None, 'overhead_fraction': None, 'peak_memory': None,
+            'final_cost': None}
+
+
+def resultKey(result):
+    return result['workload'] + '@' + str(result['scale'])
+
+
+def saveBaseline(results, path):
+    with open(path, 'w') as f:
+        json.dump({'results': {resultKey(result): result for result in results}}, f, indent=2, sort_keys=True)
+
+
+def loadBaseline(path):
+    with open(path, 'r') as f:
+        return json.load(f)['results']
+
+
+def compareToBaseline(results, baseline, tolerance=0.2):
+    """ Compares results against a baseline.
+
+    :param results: list of dicts as returned by runWorkload
+    :param baseline: dict of baseline results, as returned by loadBaseline
+    :param tolerance: relative increase accepted before a metric is reported as a regression
+    :return: a list of (key, metric, baseline value, current value, relative change, is_regression) tuples
+    """
+    comparisons = []
+    for result in results:
+        key = resultKey(result)
+        if key not in baseline:
+            continue
+
+        for metric in COMPARED_METRICS + ['objective_calls']:
+            old, new = baseline[key].get(metric), result.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / float(old)
+            # a change in the number of calls means that the solver path changed. Report it, but it is not a
+            # regression of the framework.
+            is_regression = metric in COMPARED_METRICS and change > tolerance
+            comparisons.append((key, metric, old, new, change, is_regression))
+    return comparisons
+
+
+def _format(value, fmt='{}', factor=1):
+    return '-' if value is None else fmt.format(value * factor)
+
+
+def formatResults(results):
+    header = '{:<28} {:>6} {:>7} {:>9} {:>10} {:>7} {:>12} {:>9} {:>11}'.format(
+        'workload', 'scale', 'params', 'residuals', 'wall [s]', 'calls', 'call [ms]', 'overhead', 'peak [MB]')
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append('{:<28} {:>6} {:>7} {:>9} {:>10.4f} {:>7} {:>12} {:>9} {:>11}'.format(
+            r['workload'], r['scale'], _format(r['num_params']), _format(r['num_residuals']), r['wall_time'],
+            _format(r['objective_calls']), _format(r['time_per_call'], '{:.4f}', 1e3),
+            _format(r['overhead_fraction'], '{:.1f}%', 100), _format(r['peak_memory'], '{:.2f}', 1e-6)))
+    return '\n'.join(lines)
+
+
+def formatComparisons(comparisons):
+    lines = []
+    for key, metric, old, new, change, is_regression in comparisons:
+        lines.append('{:<28} {:<16} {:>14.6g} -> {:<14.6g} {:>+8.1f}% {}'.format(
+            key, metric, old, new, change * 100, 'REGRESSION' if is_regression else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+"""
+Parameterized, headless versions of the example problems found under test/. Each workload builds a fully configured
+Optimizer (data models, parameters, residuals and sparse matrix) without any visualization, so that it can be timed.
+The problem size grows linearly with the scale argument.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import math
+from collections import namedtuple, OrderedDict
+from functools import partial
+from itertools import combinations
+
+import numpy as np
+
+import OptimizationUtils.OptimizationUtils as OptimizationUtils
+from OptimizationUtils import transformations
+from OptimizationUtils.bindings import AttributePath, ListIndex
+from OptimizationUtils.synthetic import SyntheticProblem
+
+# ------------------------
+# DATA STRUCTURES   ##
+# ------------------------
+WorkloadT = namedtuple('WorkloadT', 'optimizer optimization_options')
+
+
+# -------------------------------------------------------------------------------
+# --- COSINE FITTING (test/cosine_fitting/cosine_fitting.py)
+# -------------------------------------------------------------------------------
+class Polynomial:
+    def __init__(self, degree):
+        self.params = [[0.0] for _ in range(degree + 1)]
+
+
+def getterPolynomial(polynomial, i):
+    return [polynomial.params[i][0]]
+
+
+def setterPolynomial(polynomial, values, i):
+    polynomial.params[i] = values
+
+
+def cosineFitting(scale=1, seed=0, batched=False):
+    """ Fits a 4th degree polynomial to a cosine sampled at 100 * scale points.
+
+    :param batched: use a batched objective function
+    """
+    xs = np.linspace(-np.pi / 2, np.pi / 2, 100 * scale)
+    ys = np.cos(xs)
+    polynomial = Polynomial(degree=4)
+
+    opt = OptimizationUtils.Optimizer()
+    opt.addDataModel('polynomial', polynomial)
+    for idx in range(0, 5):
+        opt.pushParamScalar(group_name='p' + str(idx), data_key='polynomial', getter=partial(getterPolynomial, i=idx),
+                            setter=partial(setterPolynomial, i=idx))
+
+    def objectiveFunction(data_models):
+        params = data_models['polynomial'].params
+        y = params[0][0] + params[1][0] * xs + params[2][0] * xs ** 2 + params[3][0] * xs ** 3 + \
+            params[4][0] * xs ** 4
+        errors = np.abs(y - ys)  # (K, N) if batched
+        return errors if batched else list(errors)
+
+    opt.setObjectiveFunction(objectiveFunction, batched=batched)
+
+    params = opt.getParameters()
+    for idx in range(0, len(xs)):
+        opt.pushResidual(name='x' + str(idx), params=params)
+    opt.computeSparseMatrix()
+
+    return WorkloadT(opt, {'x_scale': 'jac', 'ftol': 1e-6, 'xtol': 1e-6, 'gtol': 1e-6, 'diff_step': 1e-4})
+
+
+# -------------------------------------------------------------------------------
+# --- GAUSSIAN MIXTURE MODEL (test/gaussian_mixture_models/gmm.py)
+# -------------------------------------------------------------------------------
+class Gmm:
+    def __init__(self, pis, means, stds):
+        self.pis = list(pis)
+        self.means = list(means)
+        self.stds = list(stds)
+
+
+def getterGaussian(gmm, i):
+    return [gmm.pis[i], gmm.means[i], gmm.stds[i]]
+
+
+def setterGaussian(gmm, values, i):
+    gmm.pis[i] = values[0]
+    gmm.means[i] = values[1]
+    gmm.stds[i] = values[2]
+
+
+def gaussianMixture(pis, means, stds, xs):
+    ys = np.zeros_like(xs)
+    for pi, mean, std in zip(pis, means, stds):  # the parameters may be (K, 1) columns of a batch
+        ys = ys + pi * np.exp(-0.5 * ((xs - mean) / std) ** 2) / (std * math.sqrt(2 * math.pi))
+    return ys
+
+
+def gmm(scale=1, seed=0, batched=False):
+    """ Fits a mixture of three gaussians sampled at 100 * scale points.
+
+    :param batched: use a batched objective function
+    """
+    rng = np.random.RandomState(seed)
+    gt_pis, gt_means, gt_stds = [0.3, 0.5, 0.2], [-1.0, 0.0, 1.2], [0.3, 0.5, 0.2]
+    xs = np.linspace(-2, 2, 100 * scale)
+    gt = gaussianMixture(gt_pis, gt_means, gt_stds, xs)
+
+    model = Gmm(pis=[1.0 / 3] * 3, means=np.array(gt_means) + rng.uniform(-0.3, 0.3, 3),
+                stds=np.array(gt_stds) + rng.uniform(0, 0.3, 3))
+
+    opt = OptimizationUtils.Optimizer()
+    opt.addDataModel('gmm', model)
+    for idx in range(0, 3):
+        opt.pushParamVector(group_name='g' + str(idx) + '_', data_key='gmm', getter=partial(getterGaussian, i=idx),
+                            setter=partial(setterGaussian, i=idx), bound_min=[0, -np.inf, 1e-6],
+                            suffix=['pis', 'means', 'stds'])
+
+    def objectiveFunction(data_models):
+        model = data_models['gmm']
+        errors = gt - gaussianMixture(model.pis, model.means, model.stds, xs)  # (K, N) if batched
+        return errors if batched else list(errors)
+
+    opt.setObjectiveFunction(objectiveFunction, batched=batched)
+
+    params = opt.getParameters()
+    for idx in range(0, len(xs)):
+        opt.pushResidual(name='x' + str(idx), params=params)
+    opt.computeSparseMatrix()
+
+    return WorkloadT(opt, {'x_scale': 'jac', 'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8, 'diff_step': None})
+
+
+# -------------------------------------------------------------------------------
+# --- BALL DETECTION (test/ball_detection/ball_detection.py)
+# -------------------------------------------------------------------------------
+class Ball:
+    def __init__(self, radius, x, y):
+        self.radius = [radius]
+        self.x = [x]
+        self.y = [y]
+
+
+class Canny:
+    def __init__(self, x, y):
+        self.x = [x]
+        self.y = [y]
+
+
+def getterField(data, field):
+    return [getattr(data, field)[0]]
+
+
+def setterField(data, values, field):
+    setattr(data, field, values)
+
+
+def ballDetection(scale=1, seed=0, num_angles=100):
+    """ Fits circles to the canny edges of an image with 4 * scale synthetic balls. """
+    import cv2  # only needed for this workload
+
+    rng = np.random.RandomState(seed)
+    num_balls = 4 * scale
+    cols = int(math.ceil(math.sqrt(num_balls)))
+    rows = int(math.ceil(num_balls / float(cols)))
+    cell = 200
+    image = np.zeros((rows * cell, cols * cell, 3), dtype=np.uint8)
+
+    balls = []
+    for idx in range(0, num_balls):
+        cx, cy = (idx % cols) * cell + cell / 2, (idx // cols) * cell + cell / 2
+        radius = rng.uniform(40, 70)
+        cv2.circle(image, (int(cx), int(cy)), int(radius), (255, 255, 255), -1)
+        balls.append(Ball(radius=radius + rng.uniform(-10, 10), x=cx + rng.uniform(-15, 15),
+                          y=cy + rng.uniform(-15, 15)))
+    canny = Canny(x=100, y=200)
+    angles = np.linspace(0, np.pi * 2, num_angles)
+
+    opt = OptimizationUtils.Optimizer()
+    ball_keys = ['ball' + str(idx) for idx in range(0, num_balls)]
+    for ball_key, ball in zip(ball_keys, balls):
+        opt.addDataModel(ball_key, ball)
+        for field, bound_min in zip(['radius', 'x', 'y'], [20, 0, 0]):
+            opt.pushParamScalar(group_name=ball_key + '_' + field, data_key=ball_key,
+                                getter=partial(getterField, field=field), setter=partial(setterField, field=field),
+                                bound_min=bound_min)
+    opt.addDataModel('canny', canny)
+    opt.pushParamScalar(group_name='canny_x', data_key='canny', getter=partial(getterField, field='x'),
+                        setter=partial(setterField, field='x'))
+    opt.pushParamScalar(group_name='canny_y', data_key='canny', getter=partial(getterField, field='y'),
+                        setter=partial(setterField, field='y'))
+
+    def objectiveFunction(data_models):
+        canny = data_models['canny']
+        edges = cv2.Canny(image, canny.x[0], canny.y[0])
+        nonzero = np.argwhere(edges == 255)
+
+        errors = []
+        for ball_key in ball_keys:
+            ball = data_models[ball_key]
+            xs = ball.x[0] + ball.radius[0] * np.cos(angles)
+            ys = ball.y[0] + ball.radius[0] * np.sin(angles)
+            distances = np.sqrt((nonzero[:, 0][None, :] - ys[:, None]) ** 2 +
+                                (nonzero[:, 1][None, :] - xs[:, None]) ** 2)
+            errors.extend(np.min(distances, axis=1))
+        return errors
+
+    opt.setObjectiveFunction(objectiveFunction)
+
+    for ball_key in ball_keys:
+        params = opt.getParamsContainingPattern(ball_key + '_')
+        for idx in range(0, num_angles):
+            opt.pushResidual(name=ball_key + '_r' + str(idx), params=params)
+    opt.computeSparseMatrix()
+
+    return WorkloadT(opt, {'x_scale': 'jac', 'ftol': 1e-4, 'xtol': 1e-4, 'gtol': 1e-4, 'diff_step': 1e-4})
+
+
+# -------------------------------------------------------------------------------
+# --- 2D LIDAR ALIGNMENT (test/workshop2021/Lidar2D_Calibration/calibration.py)
+# -------------------------------------------------------------------------------
+class LaserModel:
+    def __init__(self, tx, ty, ang):
+        self.tx = [tx]
+        self.ty = [ty]
+        self.ang = [ang]
+
+    def getCoords(self, xs, ys):
+        c, s = math.cos(self.ang[0]), math.sin(self.ang[0])
+        return c * xs - s * ys + self.tx[0], s * xs + c * ys + self.ty[0]
+
+
+def scanRoom(num_points, rng, width=6.0, height=4.0):
+    """ Samples points on the walls of a rectangular room, centered at the origin. """
+    perimeter = 2 * (width + height)
+    ts = np.sort(rng.uniform(0, perimeter, num_points))
+    xs, ys = np.zeros(num_points), np.zeros(num_points)
+    for idx, t in enumerate(ts):
+        if t < width:
+            xs[idx], ys[idx] = t - width / 2, -height / 2
+        elif t < width + height:
+            xs[idx], ys[idx] = width / 2, t - width - height / 2
+        elif t < 2 * width + height:
+            xs[idx], ys[idx] = width / 2 - (t - width - height), height / 2
+        else:
+            xs[idx], ys[idx] = -width / 2, height / 2 - (t - 2 * width - height)
+    return xs, ys
+
+
+def lidar2D(scale=1, seed=0, noise=0.01):
+    """ Aligns the scans of two 2D LIDARs with 100 * scale points each. """
+    rng = np.random.RandomState(seed)
+    num_points = 100 * scale
+    left_xs, left_ys = scanRoom(num_points, rng)
+
+    # right laser sees other points of the same room, expressed in its own reference frame
+    gt_tx, gt_ty, gt_ang = 0.4, -0.3, math.pi / 8
+    world_xs, world_ys = scanRoom(num_points, rng)
+    c, s = math.cos(gt_ang), math.sin(gt_ang)
+    right_xs = c * (world_xs - gt_tx) + s * (world_ys - gt_ty) + rng.normal(0, noise, num_points)
+    right_ys = -s * (world_xs - gt_tx) + c * (world_ys - gt_ty) + rng.normal(0, noise, num_points)
+
+    laser_model = LaserModel(0, 0, math.pi / 10)
+
+    opt = OptimizationUtils.Optimizer()
+    opt.addDataModel('laser_model', laser_model)
+    for field in ['tx', 'ty', 'ang']:
+        opt.pushParamScalar(group_name='laser_' + field, data_key='laser_model',
+                            getter=partial(getterField, field=field), setter=partial(setterField, field=field))
+
+    def objectiveFunction(data_models):
+        right_xs_model, right_ys_model = data_models['laser_model'].getCoords(right_xs, right_ys)
+        errors = np.abs(left_xs[:, None] - right_xs_model[None, :]) + np.abs(left_ys[:, None] - right_ys_model[None, :])
+        return list(np.min(errors, axis=1))
+
+    opt.setObjectiveFunction(objectiveFunction)
+
+    for idx in range(0, num_points):
+        opt.pushResidual(name='laser_r' + str(idx), params=['laser_tx', 'laser_ty', 'laser_ang'])
+    opt.computeSparseMatrix()
+
+    return WorkloadT(opt, {'x_scale': 'jac', 'ftol': 1e-6, 'xtol': 1e-6, 'gtol': 1e-6, 'diff_step': None})
+
+
+# -------------------------------------------------------------------------------
+# --- POINT CLOUD TO POINT CLOUD (test/point_cloud_to_point_cloud/pc2pc_calibration.py)
+# -------------------------------------------------------------------------------
+class Model:
+    def __init__(self, name, points):
+        self.t = [0, 0, 0]
+        self.r = [0, 0, 0]
+        self.points = points  # homogeneous points, 4xN
+        self.name = str(name)
+
+
+def getterTranslation(models, i):
+    return models[i].t
+
+
+def getterRotation(models, i):
+    return models[i].r
+
+
+def setterTranslation(models, values, i):
+    models[i].t[0] = values[0]
+    models[i].t[1] = values[1]
+    models[i].t[2] = values[2]
+
+
+def setterRotation(models, values, i):
+    models[i].r[0] = values[0]
+    models[i].r[1] = values[1]
+    models[i].r[2] = values[2]
+
+
+def setterModels(models, values):
+    """ Bulk setter of the translations and rotations of all the models. """
+    for model in models:
+        model.t = values['model' + model.name + '_t']
+        model.r = values['model' + model.name + '_r']
+
+
+def pc2pc(scale=1, seed=0, num_models=4, noise=0.01, max_rot_error=0.3, max_trans_error=0.3, views=False,
+          bulk=False, manifold=False):
+    """ Registers num_models noisy copies of a synthetic point cloud with 250 * scale points.
+
+    :param views: the translations and rotations of the models are views of the parameter buffer
+    :param bulk: set the translations and rotations of all the models with a single bulk setter
+    :param manifold: the pose of each model is a 4x4 transformation, optimized as an SE3 group
+    """
+    rng = np.random.RandomState(seed)
+    num_points = 250 * scale
+
+    # points on the surface of an ellipsoid play the role of the cow
+    directions = rng.normal(0, 1, (3, num_points))
+    directions /= np.linalg.norm(directions, axis=0)
+    cloud = directions * np.array([[1.0], [0.6], [0.4]])
+
+    models = []
+    for i in range(0, num_models):
+        if i == 0:
+            transform = np.identity(4)
+        else:
+            transform = transformations.compose_matrix(angles=rng.uniform(-1, 1, 3) * max_rot_error,
+                                                       translate=rng.uniform(-1, 1, 3) * max_trans_error)
+        points = np.vstack((cloud + rng.normal(0, noise, cloud.shape), np.ones((1, num_points))))
+        models.append(Model(i, np.dot(transform, points)))
+
+    opt = OptimizationUtils.Optimizer()
+    opt.addDataModel('models', models)
+    for i, model in enumerate(models):
+        if manifold:
+            model.T = transformations.compose_matrix(angles=model.r, translate=model.t)
+            opt.pushParamSE3(group_name='model' + str(i) + '_', data_key='models',
+                             getter=AttributePath('T', parent=ListIndex(i)))
+        elif views:
+            opt.pushParamVector(group_name='model' + str(i) + '_t', data_key='models',
+                                getter=AttributePath('t', parent=ListIndex(i)), suffix=['x', 'y', 'z'], view=True)
+            opt.pushParamVector(group_name='model' + str(i) + '_r', data_key='models',
+                                getter=AttributePath('r', parent=ListIndex(i)), suffix=['x', 'y', 'z'], view=True)
+        else:
+            opt.pushParamVector(group_name='model' + str(i) + '_t', data_key='models',
+                                getter=partial(getterTranslation, i=i), setter=partial(setterTranslation, i=i),
+                                suffix=['x', 'y', 'z'])
+            opt.pushParamVector(group_name='model' + str(i) + '_r', data_key='models',
+                                getter=partial(getterRotation, i=i), setter=partial(setterRotation, i=i),
+                                suffix=['x', 'y', 'z'])
+    opt.freezeGroupsContainingPattern('model0_')  # model_0 is the reference model, no POS change
+    if bulk:
+        opt.setBulkAccessors('models', setterModels)
+
+    def objectiveFunction(data_models):
+        models = data_models['models']
+        if manifold:
+            transformed = [np.dot(model.T, model.points) for model in models]
+        else:
+            transformed = [np.dot(transformations.compose_matrix(angles=model.r, translate=model.t), model.points)
+                           for model in models]
+
+        errors = []
+        for idx_a, idx_b in combinations(range(0, len(models)), 2):
+            errors.extend(np.sum((transformed[idx_a][0:3, :] - transformed[idx_b][0:3, :]) ** 2, axis=0))
+        return errors
+
+    opt.setObjectiveFunction(objectiveFunction)
+
+    for model_a, model_b in combinations(models, 2):
+        params = opt.getParamsContainingPattern('model' + model_a.name + '_')
+        params.extend(opt.getParamsContainingPattern('model' + model_b.name + '_'))
+        for n in range(0, num_points):
+            opt.pushResidual(name='r_' + model_a.name + '_' + model_b.name + '_' + str(n), params=params)
+    opt.computeSparseMatrix()
+
+    return WorkloadT(opt, {'x_scale': 'jac', 'ftol': 1e-6, 'xtol': 1e-6, 'gtol': 1e-6, 'diff_step': 1e-4})
+
+
+# -------------------------------------------------------------------------------
+# --- MULTI-SENSOR CALIBRATION (OptimizationUtils/synthetic.py)
+# -------------------------------------------------------------------------------
+def syntheticCalibration(scale=1, seed=0):
+    """ Calibrates two cameras and one LIDAR observing a chessboard in 10 * scale collections. """
+    problem = SyntheticProblem(num_cameras=2, num_lidars=1, num_collections=10 * scale, seed=seed)
+    return WorkloadT(problem.buildOptimizer(),
+                     {'x_scale': 'jac', 'ftol': 1e-4, 'xtol': 1e-4, 'gtol': 1e-4, 'diff_step': None})
+
+
+# -------------------------------------------------------------------------------
+# --- REGISTRY
+# -------------------------------------------------------------------------------
+WORKLOADS = OrderedDict([('cosine_fitting', cosineFitting),
+                         ('cosine_fitting_batched', partial(cosineFitting, batched=True)),
+                         ('gmm', gmm),
+                         ('gmm_batched', partial(gmm, batched=True)),
+                         ('ball_detection', ballDetection),
+                         ('lidar2d', lidar2D),
+                         ('pc2pc', pc2pc),
+                         ('pc2pc_views', partial(pc2pc, views=True)),
+                         ('pc2pc_bulk', partial(pc2pc, bulk=True)),
+                         ('pc2pc_se3', partial(pc2pc, manifold=True)),
+                         ('synthetic_calibration', syntheticCalibration)])
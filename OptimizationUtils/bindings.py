@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Declarative, picklable parameter bindings, to use instead of getter and setter functions in the pushParam* methods:
+
+    opt.pushParamScalar('focal', 'camera', AttributePath('intrinsics.fx'))
+    opt.pushParamVector('t', 'cameras', ArraySlice(slice(0, 3), parent=DictKey('left')))
+    opt.pushParamVector('p2', 'polynomial', ListIndex(2, parent=AttributePath('params')))
+
+A binding points to the values of a parameter group inside a data model. The parent binding, if given, is resolved
+first, so bindings can be chained. The values are:
+
+    - a scalar, for groups of a single parameter
+    - a list or tuple, which is replaced by a new list with the values of the parameters
+    - a numpy array (or a slice of one), which is written in place. Array bindings do not support batched objective
+      functions.
+
+Groups pushed with view=True (see Optimizer.pushParamVector) replace the bound value by a numpy array which is a view
+of the parameter buffer of the optimizer, so that copying the parameters to the data models is a single copy to that
+buffer. View bindings must bind a field (an attribute, key or list item), not an ArraySlice.
+
+Unlike lambdas and closures, bindings can be pickled, so optimizers which use them (and an importable objective
+function) can be sent to worker processes or saved with pickle.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class Binding:
+    """ Base class of the bindings. Subclasses implement getFrom and setIn, which access the bound value in the
+    container given by the parent binding. """
+    viewable = True  # the bound value can be replaced by a view of the parameter buffer, see bindView
+
+    def __init__(self, parent=None):
+        """
+        :param parent: binding which gives the container of this binding, or None for the data model itself
+        """
+        self.parent = parent
+        self.kind = None  # 'scalar', 'sequence' or 'array', found by the first get
+
+    def getContainer(self, model):
+        return model if self.parent is None else self.parent.getValue(model)
+
+    def getValue(self, model):
+        return self.getFrom(self.getContainer(model))
+
+    def setValue(self, model, value):
+        self.setIn(self.getContainer(model), value)
+
+    def get(self, model):
+        """ The getter: returns the list of values of the parameters. """
+        value = self.getValue(model)
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            self.kind = 'array'
+            return [float(v) for v in np.ravel(value)]
+        elif isinstance(value, (list, tuple)):
+            self.kind = 'sequence'
+            return list(value)
+        else:
+            self.kind = 'scalar'
+            return [value]
+
+    def set(self, model, values):
+        """ The setter: writes the list of values of the parameters. """
+        container = self.getContainer(model)
+        if self.kind is None:
+            self.get(model)
+
+        if self.kind == 'scalar':
+            self.setIn(container, values[0])
+        elif self.kind == 'sequence':
+            self.setIn(container, list(values))
+        else:
+            target = self.getFrom(container)
+            target[...] = np.reshape(values, target.shape)
+
+    def bindView(self, model, view):
+        """ Replaces the bound value by view, a numpy array which the optimizer writes in place. """
+        self.setValue(model, view)
+        self.kind = 'array'
+
+    def getFrom(self, container):
+        raise NotImplementedError
+
+    def setIn(self, container, value):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + self.describe() + ')'
+
+    def describe(self):
+        return ''
+
+
+class AttributePath(Binding):
+    """ Binds to an attribute, or to a dotted path of attributes, e.g. 'pose.translation'. """
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.names = path.split('.')
+
+    def getFrom(self, container):
+        for name in self.names:
+            container = getattr(container, name)
+        return container
+
+    def setIn(self, container, value):
+        for name in self.names[:-1]:
+            container = getattr(container, name)
+        setattr(container, self.names[-1], value)
+
+    def describe(self):
+        return repr(self.path)
+
+
+class DictKey(Binding):
+    """ Binds to the value of a key of a dict. """
+
+    def __init__(self, key, parent=None):
+        super().__init__(parent)
+        self.key = key
+
+    def getFrom(self, container):
+        return container[self.key]
+
+    def setIn(self, container, value):
+        container[self.key] = value
+
+    def describe(self):
+        return repr(self.key)
+
+
+class ListIndex(DictKey):
+    """ Binds to an item of a list. """
+
+    def __init__(self, index, parent=None):
+        super().__init__(index, parent)
+
+
+class ArraySlice(DictKey):
+    """ Binds to a slice of a numpy array (any numpy index, e.g. slice(0, 3) or (slice(0, 3), 3)), which is written
+    in place. """
+    viewable = False  # writes into an existing array, which cannot become a view of the parameter buffer
+
+    def __init__(self, index, parent=None):
+        super().__init__(index, parent)
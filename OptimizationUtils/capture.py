@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Capture of optimization problems to a compact binary file (numpy npz), and offline replay of the captured problems.
+
+A capture holds the parameter layout, bounds, residuals and sparsity, the frozen groups, the tied parameters, the
+variables of the solver (see Optimizer.getSolverView), the references of the rotation and pose groups (see
+OptimizationUtils.manifolds), the initial parameters x0, the optimizer options and, optionally, the sequence of (x, residuals) evaluations recorded during the optimization:
+
+    opt.setRecordEvaluations(True)
+    opt.startOptimization()
+    opt.saveProblem('slow_calibration.npz')
+
+Later, without any of the data models:
+
+    capture = loadProblem('slow_calibration.npz')
+    result = capture.replay()  # replays the solver path against the recorded residuals
+    result = capture.rerun(my_objective)  # or solves again with an objective of x
+
+Captures can be benchmarked with python -m OptimizationUtils.bench --captures slow_calibration.npz
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import json
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+CAPTURE_VERSION = 2  # 2 adds the frozen groups, the ties, the solver view and the manifold groups
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    return value
+
+
+def _jsonableOptions(options):
+    """ :return: the options which can be written as JSON. The others (e.g. a callable loss) are not saved, with a
+    warning, and replays use their default values. """
+    jsonable = {}
+    for key, value in options.items():
+        value = _jsonable(value)
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            warnings.warn('The optimization option ' + key + ' = ' + repr(value) + ' can not be written as JSON and '
+                          'is not saved in the capture.')
+            continue
+        jsonable[key] = value
+    return jsonable
+
+
+def saveProblem(opt, path, evaluations=True):
+    """ Serializes the problem configured in an optimizer to a npz file.
+
+    :param opt: an OptimizationUtils.Optimizer
+    :param path: the file to write
+    :param evaluations: include the (x, residuals) evaluations recorded by the optimizer, if any
+    """
+    group_names, group_sizes, group_data_keys, param_names, bounds_min, bounds_max = [], [], [], [], [], []
+    for group_name, group in opt.groups.items():
+        group_names.append(group_name)
+        group_sizes.append(len(group.param_names))
+        group_data_keys.append(str(group.data_key))
+        param_names.extend(group.param_names)
+        bounds_min.extend(group.bound_min)
+        bounds_max.extend(group.bound_max)
+
+    x0 = opt.x0 if len(opt.x0) > 0 else opt.x
+    arrays = {'version': np.array(CAPTURE_VERSION),
+              'x0': np.array(x0, dtype=float),
+              'x': np.array(opt.x, dtype=float),
+              'bounds_min': np.array(bounds_min, dtype=float),
+              'bounds_max': np.array(bounds_max, dtype=float),
+              'group_names': np.array(group_names, dtype=str),
+              'group_sizes': np.array(group_sizes, dtype=int),
+              'group_data_keys': np.array(group_data_keys, dtype=str),
+              'param_names': np.array(param_names, dtype=str),
+              'residual_names': np.array(list(opt.residuals.keys()), dtype=str),
+              'options': np.array(json.dumps({
+                  'optimization_method': opt.optimization_method,
+                  'optimization_options': _jsonableOptions(opt.optimization_options or {})}))}
+
+    if opt.sparse_matrix is not None:
+        sparse_matrix = opt.sparse_matrix.tocoo()
+        arrays['sparsity_rows'] = sparse_matrix.row.astype(np.int64)
+        arrays['sparsity_cols'] = sparse_matrix.col.astype(np.int64)
+        arrays['sparsity_shape'] = np.array(sparse_matrix.shape, dtype=np.int64)
+
+    arrays['frozen_groups'] = np.array(sorted(opt.frozen_groups), dtype=str)
+    arrays['ties'] = np.array(json.dumps(opt.ties))  # the solver view gives the variable of the tied parameters
+    solver_view = opt.getSolverView()
+    if solver_view is not None:
+        arrays['solver_x_indices'] = solver_view.x_indices.astype(np.int64)
+        arrays['solver_z_indices'] = solver_view.z_indices.astype(np.int64)
+        arrays['solver_num_variables'] = np.array(solver_view.num_variables, dtype=np.int64)
+
+    if opt.manifold_groups:  # the increments of x0 are relative to the references at the start of the optimization
+        references = [opt.manifold_references0[group_name] if group_name in opt.manifold_references0 else
+                      parameterization.getReference() for group_name, parameterization in opt.manifold_groups.items()]
+        arrays['manifold_group_names'] = np.array(list(opt.manifold_groups.keys()), dtype=str)
+        arrays['manifold_sizes'] = np.array([parameterization.size for parameterization in
+                                             opt.manifold_groups.values()], dtype=int)
+        arrays['manifold_references'] = np.array(references, dtype=float)
+
+    if evaluations and len(opt.recorded_evaluations) > 0:
+        arrays['evaluations_x'] = np.array([x for x, _ in opt.recorded_evaluations], dtype=float)
+        arrays['evaluations_residuals'] = np.array([errors for _, errors in opt.recorded_evaluations], dtype=float)
+
+    np.savez_compressed(path, **arrays)
+
+
+def loadProblem(path):
+    """ Loads a problem saved with saveProblem.
+
+    :param path: the npz file
+    :return: a ProblemCapture
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+
+    if int(arrays['version']) > CAPTURE_VERSION:
+        raise ValueError('Capture ' + str(path) + ' has version ' + str(int(arrays['version'])) +
+                         ', this version of OptimizationUtils reads up to version ' + str(CAPTURE_VERSION))
+    return ProblemCapture(arrays)
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class ProblemCapture:
+    """ An optimization problem loaded from a capture file. """
+
+    def __init__(self, arrays):
+        self.x0 = arrays['x0']
+        self.x = arrays['x']
+        self.bounds_min = arrays['bounds_min']
+        self.bounds_max = arrays['bounds_max']
+        self.param_names = [str(name) for name in arrays['param_names']]
+        self.residual_names = [str(name) for name in arrays['residual_names']]
+        self.groups = []  # list of (group name, data key, param names)
+        start = 0
+        for group_name, size, data_key in zip(arrays['group_names'], arrays['group_sizes'],
+                                              arrays['group_data_keys']):
+            self.groups.append((str(group_name), str(data_key), self.param_names[start:start + size]))
+            start += size
+
+        options = json.loads(str(arrays['options']))
+        self.optimization_method = options['optimization_method']
+        self.optimization_options = options['optimization_options']
+
+        self.sparse_matrix = None
+        if 'sparsity_rows' in arrays:
+            from scipy.sparse import coo_matrix
+            rows, cols = arrays['sparsity_rows'], arrays['sparsity_cols']
+            self.sparse_matrix = coo_matrix((np.ones(len(rows), dtype=int), (rows, cols)),
+                                            shape=tuple(arrays['sparsity_shape'])).tocsr()
+
+        # the variables of the solver, None if they are the parameters. Captures of version 1 have no frozen groups.
+        self.frozen_groups = [str(name) for name in arrays.get('frozen_groups', [])]
+        self.ties = json.loads(str(arrays['ties'])) if 'ties' in arrays else []  # lists of names of tied parameters
+        self.solver_view = None
+        if 'solver_x_indices' in arrays:
+            from OptimizationUtils.OptimizationUtils import SolverView
+            self.solver_view = SolverView(self.x0, arrays['solver_x_indices'], arrays['solver_z_indices'],
+                                          int(arrays['solver_num_variables']))
+
+        # key={group name} value = parameterization of the rotation or pose group, with its reference at x0
+        self.manifold_groups = OrderedDict()
+        if 'manifold_group_names' in arrays:
+            from OptimizationUtils.manifolds import SE3Parameterization, SO3Parameterization
+            for group_name, size, reference in zip(arrays['manifold_group_names'], arrays['manifold_sizes'],
+                                                   arrays['manifold_references']):
+                parameterization_class = SO3Parameterization if int(size) == SO3Parameterization.size else \
+                    SE3Parameterization
+                self.manifold_groups[str(group_name)] = parameterization_class.fromReference(reference)
+
+        self.evaluations_x = arrays.get('evaluations_x')
+        self.evaluations_residuals = arrays.get('evaluations_residuals')
+
+    def getManifoldValues(self, x):
+        """ Applies the increments of the rotation and pose groups in a parameter vector to their references, e.g. in
+        an objective of x given to rerun.
+
+        :param x: the parameter vector
+        :return: dict, key={group name} value = (3, 3) rotation matrix or (4, 4) transformation
+        """
+        param_indices = {name: idx for idx, name in enumerate(self.param_names)}
+        values = {}
+        for group_name, _, param_names in self.groups:
+            if group_name in self.manifold_groups:
+                increment = np.array([x[param_indices[name]] for name in param_names], dtype=float)
+                values[group_name] = self.manifold_groups[group_name].retract(increment)
+        return values
+
+    def getNumberOfEvaluations(self):
+        return 0 if self.evaluations_x is None else len(self.evaluations_x)
+
+    def solve(self, fun, optimization_options=None, verbose=0):
+        """ Runs the captured solver configuration with a given residuals function.
+
+        :param fun: function that receives the parameters vector x and returns the residuals vector
+        :param optimization_options: overrides the captured optimizer options
+        :param verbose: verbosity of the solver
+        :return: the scipy OptimizeResult
+        """
+        from scipy.optimize import least_squares, minimize
+
+        options = dict(self.optimization_options)
+        if optimization_options is not None:
+            options.update(optimization_options)
+
+        # the solver optimizes the variables of the solver view, as the optimizer did
+        x0, bounds_min, bounds_max, sparse_matrix = self.x0, self.bounds_min, self.bounds_max, self.sparse_matrix
+        if self.solver_view is not None:
+            x0 = self.solver_view.fromX(self.x0)
+            bounds_min, bounds_max = self.solver_view.getBounds(self.bounds_min, self.bounds_max)
+            if self.sparse_matrix is not None:
+                sparse_matrix = self.solver_view.getSparseMatrix(self.sparse_matrix)
+            residuals_function = fun
+
+            def fun(z):
+                return residuals_function(self.solver_view.toX(z))
+
+        if self.optimization_method == 'least_squares':
+            result = least_squares(fun, x0, verbose=verbose, jac_sparsity=sparse_matrix,
+                                   bounds=(bounds_min, bounds_max), method='trf', **options)
+        elif self.optimization_method == 'bfgs':
+            result = minimize(lambda x: np.sum(np.abs(fun(x))), x0, method='L-BFGS-B', **options)
+        else:
+            raise ValueError('Unknown optimization method ' + self.optimization_method)
+        if self.solver_view is not None:  # the result has the parameter vector, as the ones of the optimizer
+            result.x = self.solver_view.toX(result.x)
+        return result
+
+    def getRecordedResidualsFunction(self):
+        """ Builds a residuals function of x which answers with the recorded residuals.
+
+        :return: function that receives x and returns the residuals recorded for that x
+        """
+        if self.getNumberOfEvaluations() == 0:
+            raise ValueError('Capture has no recorded evaluations to replay. Use setRecordEvaluations(True) '
+                             'before the optimization.')
+
+        lookup = {x.tobytes(): residuals for x, residuals in zip(self.evaluations_x, self.evaluations_residuals)}
+
+        def recordedResiduals(x):
+            residuals = lookup.get(np.asarray(x, dtype=float).tobytes())
+            if residuals is None:
+                raise ValueError('Replay diverged from the captured solver path: x was never evaluated in the '
+                                 'recording.')
+            return residuals
+
+        return recordedResiduals
+
+    def replay(self, optimization_options=None, verbose=0):
+        """ Replays the solver path against the recorded residuals, without the original objective function.
+
+        The solver is deterministic, so given the same residuals it asks for the same sequence of x. An x which was
+        not recorded means the solver diverged from the captured path (e.g. other options or scipy version).
+
+        :return: the scipy OptimizeResult
+        """
+        return self.solve(self.getRecordedResidualsFunction(), optimization_options=optimization_options,
+                          verbose=verbose)
+
+    def rerun(self, objective, optimization_options=None, verbose=0):
+        """ Solves the captured problem again with a user objective.
+
+        :param objective: function that receives the parameters vector x and returns the residuals vector
+        :return: the scipy OptimizeResult
+        """
+        return self.solve(objective, optimization_options=optimization_options, verbose=verbose)
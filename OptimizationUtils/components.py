@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Decomposition of a problem into independent subproblems: the connected components of its sparse matrix, i.e. sets of
+variables which share residuals with each other but not with the variables of other sets. Each component is solved
+separately, with its own convergence criteria, optionally in parallel worker processes (see
+OptimizationUtils.parallel), and the solutions are stitched back into x and the data models. Used by
+Optimizer.startOptimizationByComponents:
+
+    opt.freezeGroup('canny_x')  # frozen groups do not connect the residuals which depend on them
+    opt.freezeGroup('canny_y')
+    result = opt.startOptimizationByComponents(num_workers=4)
+    for component in result.components:
+        print(component['component'], component['num_variables'], component['cost'], component['message'])
+
+The objective function computes all the residuals at each call, so solving by components does not save objective
+function calls, but each solver works on a smaller Jacobian and stops when its own component has converged.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import contextlib
+import os
+import time
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+from scipy.sparse.csgraph import connected_components
+
+from OptimizationUtils import parallel
+from OptimizationUtils.OptimizationUtils import OptimizationRun
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def findComponents(sparse_matrix):
+    """ Finds the connected components of a sparse matrix, in which two variables are connected if a residual depends
+    on both.
+
+    :param sparse_matrix: (m, n) sparse matrix of the residuals and the variables of the solver
+    :return: list of (variables, residuals) index arrays, one per component. Residuals which do not depend on any
+    variable, and variables which do not affect any residual, are not in any component.
+    """
+    sparse_matrix = (sparse_matrix.tocsr() != 0).astype(int)
+    adjacency = sparse_matrix.T.dot(sparse_matrix)
+    num_components, labels = connected_components(adjacency, directed=False)
+
+    # the component of each residual is the one of any of its variables
+    first_variables = np.full(sparse_matrix.shape[0], -1)
+    nonempty = np.diff(sparse_matrix.indptr) > 0
+    first_variables[nonempty] = sparse_matrix.indices[sparse_matrix.indptr[:-1][nonempty]]
+    residual_labels = np.where(nonempty, labels[np.maximum(first_variables, 0)], -1)
+
+    components = [(np.flatnonzero(labels == label), np.flatnonzero(residual_labels == label))
+                  for label in range(num_components)]
+    return [(variables, residuals) for variables, residuals in components if len(residuals) > 0]
+
+
+def solveComponent(context, item):
+    """ Solves the subproblem of one component. Called in a worker process, see parallel.runInWorkers.
+
+    :param context: dict with the optimizer, its parameters at the start, and the optimization method and options
+    :param item: (index, variables, residuals) of the component
+    :return: a dict with the summary of the component, plus the final values of its parameters
+    """
+    index, variables, residuals = item
+    optimizer = context['optimizer']
+    method, options = context['optimization_method'], context['optimization_options']
+
+    run = OptimizationRun(method, options)
+    run.variables = variables
+    run.residual_indices = residuals
+    run.rebase_manifolds = False  # the increments of the components are stitched and rebased together
+    run.track_progress = True  # for the number of iterations of the summary
+
+    t = time.perf_counter()
+    optimizer.x = list(context['x0'])  # every component starts from the same parameters
+    with contextlib.ExitStack() as stack:
+        if not context['verbose']:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        optimizer.internalStartOptimization(method, options, run=run)
+    result = optimizer.result
+    x_indices = run.solver_view.x_indices
+    cost = float(result.cost) if method == 'least_squares' else float(result.fun)
+
+    return {'component': index, 'num_variables': len(variables), 'num_residuals': len(residuals), 'cost': cost,
+            'success': bool(result.success), 'status': int(result.status), 'message': str(result.message),
+            'nfev': int(result.nfev), 'nit': int(run.progress[0]), 'elapsed': time.perf_counter() - t,
+            'x_indices': x_indices, 'x': np.asarray(result.x, dtype=float)[x_indices]}
+
+
+def startByComponents(optimizer, components, optimization_method, optimization_options, num_workers=1,
+                      verbose=False):
+    """ Solves each component and stitches the solutions. Called by Optimizer.startOptimizationByComponents, with the
+    optimizer lock held. The workers are headless and do not record traces, evaluations or metrics.
+
+    :param optimizer: the Optimizer
+    :param components: list of (variables, residuals), see findComponents
+    """
+    x0 = list(optimizer.x)
+    run = OptimizationRun(optimization_method, optimization_options)
+    run.start_time = time.perf_counter()
+
+    # Settings of the optimizer which the workers must not use, restored at the end
+    settings = {'headless': True, 'trace_recorder': None, 'metrics_sink': None, 'record_evaluations': False}
+    backup = {name: getattr(optimizer, name) for name in settings}
+    for name, value in settings.items():
+        setattr(optimizer, name, value)
+
+    print('Starting ' + optimization_method + ' optimization of ' + str(len(components)) + ' components in ' +
+          str(parallel.getNumberOfWorkers(num_workers, len(components))) + ' workers ...')
+    items = [(index, variables, residuals) for index, (variables, residuals) in enumerate(components)]
+    try:
+        summaries = []
+        for summary in parallel.runInWorkers(solveComponent, items, num_workers=num_workers, optimizer=optimizer,
+                                             x0=x0, optimization_method=optimization_method,
+                                             optimization_options=optimization_options, verbose=verbose):
+            if verbose:
+                print('Component ' + str(summary['component']) + ' finished with cost ' + str(summary['cost']) +
+                      ': ' + summary['message'])
+            summaries.append(summary)
+    finally:
+        for name, value in backup.items():
+            setattr(optimizer, name, value)
+    summaries.sort(key=lambda summary: summary['component'])
+
+    # Stitch the parameters of each component
+    xf = np.array(x0, dtype=float)
+    for summary in summaries:
+        xf[summary['x_indices']] = summary['x']
+
+    run.status['num_function_calls'] = sum(summary['nfev'] for summary in summaries)
+    run.status['num_iterations'] = max(summary['nit'] for summary in summaries)
+    cost = sum(summary['cost'] for summary in summaries)
+    run.progress = (run.status['num_iterations'], cost)
+    optimizer.run = run
+    optimizer.data_models['status'] = run.status
+
+    num_failed = sum(not summary['success'] for summary in summaries)
+    optimizer.result = OptimizeResult(
+        x=xf, success=num_failed == 0, status=min(summary['status'] for summary in summaries),
+        nfev=run.status['num_function_calls'], nit=run.status['num_iterations'],
+        message='Solved ' + str(len(summaries)) + ' components, ' + str(num_failed) + ' did not converge.',
+        components=[{key: value for key, value in summary.items() if key not in ['x_indices', 'x']}
+                    for summary in summaries])
+    if optimization_method == 'least_squares':
+        optimizer.result.cost = cost
+    else:
+        optimizer.result.fun = cost
+
+    optimizer.optimization_method = optimization_method
+    optimizer.optimization_options = optimization_options
+    optimizer.x0 = x0
+    optimizer.xf = list(xf)
+    optimizer.x = list(xf)
+    optimizer.fromXToData(optimizer.xf)
+    optimizer.finalOptimizationReport()
+    optimizer.rebaseManifoldGroups()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Handle of an optimization running in the background, returned by Optimizer.startOptimizationAsync:
+
+    future = opt.startOptimizationAsync(deadline=60)
+    while not future.done():
+        iteration, cost = future.progress()
+        ...
+    result = future.result()
+
+In asyncio code the future can be awaited (result = await future), and cancelling the awaiting task cancels the
+optimization.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+from concurrent.futures import Future, InvalidStateError
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class OptimizationFuture(Future):
+    """ A concurrent.futures.Future for an optimization, with progress and cooperative cancellation.
+
+    Cancelling stops the solver at the next objective function call. The future is cancelled at once, but the
+    optimizer only releases the data models when the objective function call in progress returns, use join to wait for
+    it. After a cancellation the data models hold the best parameters evaluated before the cancellation.
+    """
+
+    def __init__(self, optimizer, run):
+        """
+        :param optimizer: the Optimizer
+        :param run: the OptimizationRun of the background optimization
+        """
+        super().__init__()
+        self.optimizer = optimizer
+        self.run = run
+        self.thread = None
+
+    def progress(self):
+        """ :return: (iteration, cost) of the last solver iteration. The cost is None before the optimization starts
+        the solver. """
+        return self.run.progress
+
+    def getNumberOfFunctionCalls(self):
+        return self.run.status['num_function_calls']
+
+    def cancel(self):
+        """ Asks the optimization to stop.
+
+        :return: False if the optimization already finished, True otherwise
+        """
+        if self.done() and not self.cancelled():
+            return False
+        self.run.requestStop('Cancelled.')
+        # The future is never set to running, so that it can be cancelled while the optimization runs
+        return super().cancel()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.done()
+
+    def join(self, timeout=None):
+        """ Waits for the background thread to finish, i.e. for the optimizer to release the data models. """
+        self.thread.join(timeout)
+
+    def setOutcome(self, result, exception):
+        """ Called by the background thread when the optimization finishes. """
+        try:
+            if exception is not None:
+                self.set_exception(exception)
+            else:
+                self.set_result(result)
+        except InvalidStateError:  # cancelled while finishing
+            pass
+
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self).__await__()
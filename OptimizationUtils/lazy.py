@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Lazy import of heavy modules, so that importing OptimizationUtils stays fast. The module is imported on the first
+access to one of its attributes:
+
+    plt = lazyImport('matplotlib.pyplot')
+    ...
+    plt.figure()  # matplotlib.pyplot is imported here
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import importlib
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def lazyImport(name):
+    """ Returns a stand-in for the module which imports it on first use.
+
+    :param name: the full name of the module, e.g. 'matplotlib.pyplot'
+    """
+    return LazyModule(name)
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class LazyModule:
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):  # only called for attributes not found in the stand-in itself
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return '<lazy module ' + self._name + (' (imported)>' if self._module is not None else '>')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Parameterizations of rotations and poses on their manifolds, for the groups pushed with Optimizer.pushParamSO3 and
+Optimizer.pushParamSE3:
+
+    opt.pushParamSO3('camera_r', 'camera', AttributePath('R'))  # R is a 3x3 rotation matrix
+    opt.pushParamSE3('lidar_pose', 'lidar', AttributePath('T'))  # T is a 4x4 transformation matrix
+
+The data model keeps the full rotation (or pose), and the parameters of the group are a local increment in the
+tangent space at a reference rotation: R = R_ref * exp(delta). The increment starts at zero, where the
+parameterization is well conditioned, unlike euler angles or a global rotation vector near their singularities. After
+each optimization the reference is moved to the solution and the increment is reset to zero (rebase), so that the
+next optimization starts again at the center of the parameterization.
+
+Poses use the retraction of SO(3) x R^3: the rotation as above and the translation t = t_ref + R_ref * rho, so that the
+translation increment is expressed in the reference frame of the pose.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def valuesToArray(values):
+    """ Converts the values given to a setter to an array of increments.
+
+    :param values: list of floats, or of (K, 1) columns for batched objective functions
+    :return: (size,) array, or (K, size) array for batches
+    """
+    if np.ndim(values[0]) == 0:
+        return np.array(values, dtype=float)
+    return np.hstack([np.reshape(value, (-1, 1)) for value in values]).astype(float)
+
+
+def expSO3(delta):
+    """ :return: the (3, 3) rotation matrices, or (K, 3, 3), of the rotation vectors delta, (3,) or (K, 3) """
+    return Rotation.from_rotvec(delta).as_matrix()
+
+
+def logSO3(rotation):
+    """ :return: the rotation vector of a (3, 3) rotation matrix """
+    return Rotation.from_matrix(rotation).as_rotvec()
+
+
+def orthonormalize(rotation):
+    """ :return: the rotation matrix closest to rotation, to remove the rounding errors accumulated by rebasing """
+    return Rotation.from_matrix(rotation).as_matrix()
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class SO3Parameterization:
+    """ A rotation parameterized by an increment in the tangent space at a reference rotation. Its get and set are the
+    getter and setter of the group, and receive or give the increment. """
+    size = 3
+
+    def __init__(self, getter, setter, model):
+        """
+        :param getter: function which returns the (3, 3) rotation matrix of the model
+        :param setter: function which sets the (3, 3) rotation matrix of the model, or (K, 3, 3) for batches
+        :param model: the data model, from which the reference rotation is read
+        """
+        self.getter = getter
+        self.setter = setter
+        self.reference = np.array(getter(model), dtype=float)
+
+    @classmethod
+    def fromReference(cls, reference):
+        """ :return: a parameterization with this reference, (4, 4), and no data model, e.g. to retract the
+        increments of a capture (see OptimizationUtils.capture) """
+        parameterization = cls.__new__(cls)
+        parameterization.getter = parameterization.setter = None
+        parameterization.setReference(reference)
+        return parameterization
+
+    def getReference(self):
+        """ :return: the reference as a (4, 4) transformation, with zero translation for rotations """
+        reference = np.eye(4)
+        reference[0:3, 0:3] = self.reference
+        return reference
+
+    def setReference(self, reference):
+        self.reference = np.array(reference, dtype=float)[0:3, 0:3]
+
+    def get(self, model):
+        """ :return: the increment from the reference to the rotation of the model """
+        rotation = np.asarray(self.getter(model), dtype=float)
+        return list(logSO3(self.reference.T.dot(rotation)))
+
+    def set(self, model, values):
+        self.setter(model, self.retract(valuesToArray(values)))
+
+    def retract(self, delta):
+        """ :return: the rotation R_ref * exp(delta), (3, 3) or (K, 3, 3) for a (K, 3) batch """
+        return np.matmul(self.reference, expSO3(delta))
+
+    def rebase(self, values):
+        """ Moves the reference to the rotation given by the increment, which becomes zero. """
+        self.reference = orthonormalize(self.retract(valuesToArray(values)))
+
+
+class SE3Parameterization(SO3Parameterization):
+    """ A pose parameterized by an increment (rho, delta) at a reference pose, with the retraction of SO(3) x R^3:
+    R = R_ref * exp(delta) and t = t_ref + R_ref * rho. The getter and setter of the model use 4x4 transformation
+    matrices. """
+    size = 6
+
+    def __init__(self, getter, setter, model):
+        transform = np.array(getter(model), dtype=float)
+        self.getter = getter
+        self.setter = setter
+        self.reference = transform[0:3, 0:3]
+        self.reference_translation = transform[0:3, 3]
+
+    def getReference(self):
+        reference = SO3Parameterization.getReference(self)
+        reference[0:3, 3] = self.reference_translation
+        return reference
+
+    def setReference(self, reference):
+        reference = np.array(reference, dtype=float)
+        self.reference = reference[0:3, 0:3]
+        self.reference_translation = reference[0:3, 3]
+
+    def get(self, model):
+        transform = np.asarray(self.getter(model), dtype=float)
+        rho = self.reference.T.dot(transform[0:3, 3] - self.reference_translation)
+        delta = logSO3(self.reference.T.dot(transform[0:3, 0:3]))
+        return list(rho) + list(delta)
+
+    def retract(self, increment):
+        """ :return: the (4, 4) transformation, or (K, 4, 4) for a (K, 6) batch """
+        rho, delta = increment[..., 0:3], increment[..., 3:6]
+        transform = np.zeros(increment.shape[:-1] + (4, 4))
+        transform[..., 0:3, 0:3] = np.matmul(self.reference, expSO3(delta))
+        transform[..., 0:3, 3] = self.reference_translation + rho.dot(self.reference.T)
+        transform[..., 3, 3] = 1.0
+        return transform
+
+    def rebase(self, values):
+        transform = self.retract(valuesToArray(values))
+        self.reference = orthonormalize(transform[0:3, 0:3])
+        self.reference_translation = transform[0:3, 3]
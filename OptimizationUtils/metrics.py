@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Structured metrics of the optimization, written as JSON lines for monitoring.
+
+Each optimizer iteration produces one record, e.g.:
+
+    {"event": "iteration", "iteration": 3, "time": 1700000000.1, "elapsed": 2.31, "cost": 0.52,
+     "gradient_norm": 1.3, "step_norm": 0.01, "objective_calls": 41,
+     "timing": {"wall": 0.62, "objective": 0.55, "setters": 0.02, "visualization": 0.0, "solver": 0.05},
+     "max_rss": 104857600}
+
+Records are buffered and written by a background thread, so the optimization does not wait for the disk:
+
+    sink = MetricsSink('/tmp/calibration_metrics.jsonl')
+    opt.setMetricsSink(sink)
+    opt.startOptimization()
+    sink.close()
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import json
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def getMaxRSS():
+    """ Returns the peak resident set size of the process in bytes, or None if it is not available. """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # macos reports bytes, linux kilobytes
+        return max_rss
+    return max_rss * 1024
+
+
+def _jsonDefault(value):
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    if hasattr(value, 'tolist'):  # numpy arrays
+        return value.tolist()
+    return str(value)
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class MetricsSink:
+    """ Buffers metrics records and writes them as JSON lines from a background thread. """
+
+    def __init__(self, target, buffer_size=20, flush_interval=1.0):
+        """
+        :param target: path of the file to append to, or a callable which receives each JSON line (without the
+        newline). The callable is called from the writer thread.
+        :param buffer_size: number of records buffered before they are handed to the writer thread
+        :param flush_interval: maximum time, in seconds, a record stays in the buffer, also when no other records are
+        emitted
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        if callable(target):
+            self.file = None
+            self.write_function = target
+        else:
+            self.file = open(target, 'a')
+            self.write_function = None
+
+        self.buffer = []
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._writerLoop, name='MetricsSinkWriter', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        """ Adds a record (a json serializable dict) to the stream. """
+        with self.lock:
+            if self.closed:
+                raise ValueError('Cannot emit to a closed MetricsSink.')
+            self.buffer.append(record)
+            if len(self.buffer) >= self.buffer_size or time.time() - self.last_flush >= self.flush_interval:
+                self._handOver()
+
+    def flush(self, wait=True):
+        """ Hands the buffered records to the writer thread.
+
+        :param wait: block until the records are written
+        """
+        with self.lock:
+            self._handOver()
+        if wait:
+            self.queue.join()
+
+    def close(self):
+        """ Writes the pending records and stops the writer thread. """
+        with self.lock:
+            if self.closed:
+                return
+            self._handOver()
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _handOver(self):
+        if len(self.buffer) > 0:
+            self.queue.put(self.buffer)
+            self.buffer = []
+        self.last_flush = time.time()
+
+    def _writerLoop(self):
+        while True:
+            try:
+                records = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # no records were emitted for a while (e.g. the job stalled): write the buffered ones, through the
+                # queue so that they stay in order
+                with self.lock:
+                    if not self.closed:
+                        self._handOver()
+                continue
+            try:
+                if records is None:
+                    return
+                lines = [json.dumps(record, default=_jsonDefault) for record in records]
+                if self.file is not None:
+                    self.file.write('\n'.join(lines) + '\n')
+                    self.file.flush()  # so that the file can be tailed
+                else:
+                    for line in lines:
+                        self.write_function(line)
+            finally:
+                self.queue.task_done()
+
+
+class MetricsCollector:
+    """ Accumulates the timings of the optimizer between iterations and builds the iteration records. Used
+    internally by the Optimizer. """
+
+    PHASES = ['objective', 'setters', 'visualization']
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.start_time = time.time()
+        self.iteration_start = time.perf_counter()
+        self.timing = dict.fromkeys(self.PHASES, 0.0)
+        self.last_x = None
+
+    def addTime(self, phase, elapsed):
+        self.timing[phase] += elapsed
+
+    def iteration(self, iteration, x, cost, objective_calls, gradient_norm=None):
+        """ Emits the record of an iteration and resets the timings. """
+        now = time.perf_counter()
+        timing = dict(self.timing)
+        timing['wall'] = now - self.iteration_start
+        timing['solver'] = max(0.0, timing['wall'] - sum(self.timing.values()))
+
+        x = np.array(x, dtype=float)
+        step_norm = None
+        if self.last_x is not None:
+            step_norm = np.linalg.norm(x - self.last_x)
+        self.last_x = x
+
+        self.sink.emit({'event': 'iteration', 'iteration': iteration, 'time': time.time(),
+                        'elapsed': time.time() - self.start_time, 'cost': float(cost),
+                        'gradient_norm': None if gradient_norm is None else float(gradient_norm),
+                        'step_norm': None if step_norm is None else float(step_norm),
+                        'objective_calls': objective_calls,
+                        'timing': timing, 'max_rss': getMaxRSS()})
+
+        self.iteration_start = now
+        self.timing = dict.fromkeys(self.PHASES, 0.0)
+
+    def finished(self, iteration, cost, objective_calls, message):
+        self.sink.emit({'event': 'finished', 'iteration': iteration, 'time': time.time(),
+                        'elapsed': time.time() - self.start_time, 'cost': float(cost),
+                        'objective_calls': objective_calls, 'message': message, 'max_rss': getMaxRSS()})
+        self.sink.flush()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Multi-start global search: local optimizations from several perturbed starting points, run in parallel worker
+processes (see OptimizationUtils.parallel), of which the best is kept. Used by Optimizer.startMultiStartOptimization:
+
+    result = opt.startMultiStartOptimization(num_starts=16, noise=0.2, rotation_groups=['lidar2_r'])
+    print(result.start, result.cost)
+    for start in result.starts:
+        print(start['start'], start['initial_cost'], start['cost'], start['message'])
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import contextlib
+import os
+import time
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+from OptimizationUtils import parallel
+from OptimizationUtils.OptimizationUtils import OptimizationRun
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def computeCost(optimization_method, errors):
+    """ :return: the cost of the residuals as defined by the optimization method """
+    errors = np.asarray(errors, dtype=float)
+    if optimization_method == 'least_squares':
+        return float(0.5 * np.dot(errors, errors))
+    return float(np.sum(np.abs(errors)))
+
+
+def runStart(context, item):
+    """ Runs the local optimization of one start. Called in a worker process, see parallel.runInWorkers.
+
+    :param context: dict with the optimizer, the optimization method and options, the shared array with the current
+    cost of each start and the lagging rule
+    :param item: (index, x) of the start
+    :return: a dict with the summary of the start, plus its final x and residuals, and its initial residuals
+    """
+    index, x = item
+    optimizer, costs = context['optimizer'], context['costs']
+    method, options = context['optimization_method'], context['optimization_options']
+    lag_factor, min_iterations = context['lag_factor'], context['min_iterations']
+
+    run = OptimizationRun(method, options)
+    run.rebase_manifolds = False  # the starts are increments of the same references, rebased after the best is chosen
+
+    def checkLagging(iteration, cost):
+        costs[index] = cost
+        best_cost = np.min(costs)
+        if lag_factor is not None and iteration >= min_iterations and cost > lag_factor * best_cost:
+            run.requestStop('Lagging: cost ' + str(cost) + ' is above ' + str(lag_factor) +
+                            ' times the best cost ' + str(best_cost) + '.')
+
+    run.iteration_listener = checkLagging
+
+    t = time.perf_counter()
+    optimizer.x = [float(value) for value in x]
+    with contextlib.ExitStack() as stack:
+        if not context['verbose']:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        optimizer.internalStartOptimization(method, options, run=run)
+    result = optimizer.result
+    cost = float(result.cost) if method == 'least_squares' else float(result.fun)
+    costs[index] = cost
+
+    return {'start': index, 'initial_cost': computeCost(method, optimizer.errors0), 'cost': cost,
+            'success': bool(result.success), 'status': int(result.status), 'message': str(result.message),
+            'nfev': int(result.nfev), 'nit': int(run.progress[0]), 'elapsed': time.perf_counter() - t,
+            'x': np.array(result.x, dtype=float), 'fun': np.array(result.fun, dtype=float),
+            'fun0': np.array(optimizer.errors0, dtype=float)}
+
+
+def startMultiStart(optimizer, starts, optimization_method, optimization_options, num_workers=None, lag_factor=10.0,
+                    min_iterations=3, verbose=False):
+    """ Runs a local optimization from each start and keeps the best. Called by
+    Optimizer.startMultiStartOptimization, with the optimizer lock held.
+
+    The workers are headless and do not record traces, evaluations or metrics.
+
+    :param optimizer: the Optimizer
+    :param starts: (num_starts, n) array of starting points
+    """
+    x0 = list(optimizer.x)
+    run = OptimizationRun(optimization_method, optimization_options)
+    run.start_time = time.perf_counter()
+
+    # Settings of the optimizer which the workers must not use, restored at the end
+    settings = {'headless': True, 'trace_recorder': None, 'metrics_sink': None, 'record_evaluations': False}
+    backup = {name: getattr(optimizer, name) for name in settings}
+    for name, value in settings.items():
+        setattr(optimizer, name, value)
+
+    costs = parallel.sharedArray(len(starts), np.inf)
+    print('Starting multi-start ' + optimization_method + ' optimization with ' + str(len(starts)) + ' starts in ' +
+          str(parallel.getNumberOfWorkers(num_workers, len(starts))) + ' workers ...')
+    try:
+        summaries = []
+        for summary in parallel.runInWorkers(runStart, enumerate(starts), num_workers=num_workers,
+                                             optimizer=optimizer, costs=costs,
+                                             optimization_method=optimization_method,
+                                             optimization_options=optimization_options,
+                                             lag_factor=lag_factor, min_iterations=min_iterations, verbose=verbose):
+            print('Start ' + str(summary['start']) + ' finished with cost ' + str(summary['cost']) + ': ' +
+                  summary['message'])
+            summaries.append(summary)
+    finally:
+        for name, value in backup.items():
+            setattr(optimizer, name, value)
+    summaries.sort(key=lambda summary: summary['start'])
+
+    best = min(summaries, key=lambda summary: summary['cost'])
+    run.status['num_function_calls'] = sum(summary['nfev'] for summary in summaries)
+    run.status['num_iterations'] = sum(summary['nit'] for summary in summaries)
+    run.progress = (best['nit'], best['cost'])
+    optimizer.run = run
+    optimizer.data_models['status'] = run.status
+
+    optimizer.result = OptimizeResult(
+        x=best['x'], fun=best['fun'], success=best['success'], status=best['status'], nfev=best['nfev'],
+        nit=best['nit'], message='Best of ' + str(len(summaries)) + ' starts is start ' + str(best['start']) + ': ' +
+                                 best['message'], start=best['start'],
+        starts=[{key: value for key, value in summary.items() if key not in ['x', 'fun', 'fun0']}
+                for summary in summaries])
+    if optimization_method == 'least_squares':
+        optimizer.result.cost = best['cost']
+
+    optimizer.optimization_method = optimization_method
+    optimizer.optimization_options = optimization_options
+    optimizer.x0 = x0
+    optimizer.xf = list(best['x'])
+    optimizer.x = list(best['x'])
+    optimizer.fromXToData(optimizer.xf)
+
+    # The workers do not record traces: the trace of the multi-start has the initial parameters (those of the first
+    # start) and the best solution
+    if optimizer.trace_recorder is not None:
+        optimizer.trace_recorder.start(optimizer.getParameters(), optimizer.residuals.keys())
+        optimizer.trace_recorder.record(0, x0, summaries[0]['fun0'])
+        optimizer.trace_recorder.record(1, best['x'], best['fun'])
+        optimizer.trace_recorder.close()
+    optimizer.finalOptimizationReport()
+    optimizer.rebaseManifoldGroups()
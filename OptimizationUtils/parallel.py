@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Runs work of an optimizer in worker processes, e.g. the starts of a multi-start optimization.
+
+The workers are forked from the process which holds the optimizer, so they inherit the optimizer and its data models
+(copy on write) instead of receiving pickled copies. The getters, setters and objective function can be lambdas or
+closures, and large data models are not copied. Where fork is not available (windows, macos) the workers are spawned
+if the work function and the context can be pickled (e.g. an optimizer with bindings, see OptimizationUtils.bindings,
+and an importable objective function), and the work runs sequentially in this process otherwise. Spawned workers
+receive the work function and the context pickled once per worker, so the large arrays of the data models should be
+in shared memory (see OptimizationUtils.sharedmemory):
+
+    def work(context, item):
+        optimizer = context['optimizer']
+        ...
+        return result
+
+    for result in runInWorkers(work, items, optimizer=opt):
+        ...
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import multiprocessing
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from OptimizationUtils.sharedmemory import createSharedArray
+
+_fork_lock = threading.Lock()  # held while forking, so that concurrent calls do not mix their inherited state
+_inherited = {}  # the function and context of the workers, inherited through fork
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def isForkAvailable():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def isPicklable(value):
+    try:
+        pickle.dumps(value)
+    except Exception:  # pickling errors vary: PicklingError, AttributeError, TypeError
+        return False
+    return True
+
+
+def getNumberOfWorkers(num_workers, num_items):
+    """ :return: num_workers, or the number of cpus if None, limited to the number of items (if not None) """
+    if num_workers is None:
+        if hasattr(os, 'sched_getaffinity'):  # the cpus this process may use
+            num_workers = len(os.sched_getaffinity(0))
+        else:
+            num_workers = os.cpu_count() or 1
+    if num_items is not None:
+        num_workers = min(num_workers, num_items)
+    return max(1, num_workers)
+
+
+def sharedArray(size, fill_value=0.0):
+    """ Creates a float array which the workers can write and everyone can read, e.g. the current cost of each
+    worker. Must be given to the workers in the context.
+
+    :return: a numpy array backed by shared memory
+    """
+    return createSharedArray(np.full(size, fill_value, dtype=float), writeable_in_workers=True)
+
+
+def runInWorkers(function, items, num_workers=None, start_method=None, **context):
+    """ Calls function(context, item) for each item in worker processes forked from this one.
+
+    :param function: the work. Can be any callable, it is inherited by the workers and not pickled.
+    :param items: the arguments of each call, must be picklable
+    :param num_workers: number of worker processes, or None for one per cpu. With a single worker, or if fork is not
+    available, the calls run sequentially in this process.
+    :param start_method: None to fork the workers if available (or spawn them if the function and context are
+    picklable), or a multiprocessing start method, e.g. 'spawn'
+    :param context: values given to every call, inherited by the workers and not pickled (unless the start method is
+    not fork), e.g. the optimizer. Changes done by the workers to the context are not seen by this process, unless
+    they are written to a sharedArray.
+    :return: generator of the results, in the order in which they finish. The results must be picklable.
+    """
+    items = list(items)
+    with WorkerPool(function, getNumberOfWorkers(num_workers, len(items)), start_method, **context) as pool:
+        for result in pool.imapUnordered(items):
+            yield result
+
+
+def _callInherited(item):
+    return _inherited['function'](_inherited['context'], item)
+
+
+def _setInherited(function, context):
+    """ Initializer of the workers which are not forked. """
+    _inherited['function'], _inherited['context'] = function, context
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class WorkerPool:
+    """ Worker processes forked from this one, which call function(context, item). The workers are kept until the
+    pool is closed, so the pool can be used for many maps, e.g. one per generation of a population based optimizer.
+
+    The workers inherit the context as it is when the pool is created. Without fork, or with a single worker, the calls
+    run in this process.
+    """
+
+    def __init__(self, function, num_workers=None, start_method=None, **context):
+        """
+        :param function: the work, see runInWorkers
+        :param num_workers: number of worker processes, or None for one per cpu
+        :param start_method: None to fork the workers, or a multiprocessing start method, see runInWorkers
+        :param context: values given to every call, see runInWorkers
+        """
+        self.function = function
+        self.context = context
+        self.num_workers = getNumberOfWorkers(num_workers, None)
+        self.pool = None
+        if self.num_workers > 1 and start_method is None and not isForkAvailable() and \
+                isPicklable((function, context)):
+            start_method = 'spawn'
+        if self.num_workers > 1 and start_method not in [None, 'fork']:
+            # the function and the context are pickled once per worker
+            self.pool = multiprocessing.get_context(start_method).Pool(self.num_workers, initializer=_setInherited,
+                                                                       initargs=(function, context))
+        elif self.num_workers > 1 and isForkAvailable():
+            with _fork_lock:  # the pool forks all its workers when it is created
+                _inherited['function'], _inherited['context'] = function, context
+                try:
+                    self.pool = multiprocessing.get_context('fork').Pool(self.num_workers)
+                finally:
+                    _inherited.clear()
+
+    def map(self, items):
+        """ :return: list with the results of each item, in the order of the items """
+        items = list(items)
+        if self.pool is None:
+            return [self.function(self.context, item) for item in items]
+        chunk_size = max(1, -(-len(items) // self.num_workers))  # one chunk per worker
+        return self.pool.map(_callInherited, items, chunksize=chunk_size)
+
+    def imapUnordered(self, items):
+        """ :return: generator of the results, in the order in which they finish """
+        if self.pool is None:
+            for item in items:
+                yield self.function(self.context, item)
+        else:
+            for result in self.pool.imap_unordered(_callInherited, items, chunksize=1):
+                yield result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Population based, derivative free optimization methods, for objectives through which finite differences give zero
+or meaningless gradients, e.g. parameters which are thresholds:
+
+    opt.startOptimization(optimization_method='differential_evolution', optimization_options={'maxiter': 200})
+    opt.startOptimization(optimization_method='cma_es', optimization_options={'sigma0': 0.2, 'seed': 1})
+
+Both minimize the least squares cost 0.5 * sum(residuals ** 2) within the bounds of the parameter groups.
+Differential evolution (scipy) needs finite bounds for all parameters, and does not polish its solution with L-BFGS-B
+unless optimization_options has 'polish': True. CMA-ES samples around the current parameters,
+with a step size relative to the range of each parameter, i.e. its bounds when they are finite or its magnitude
+otherwise.
+
+The population of each generation is evaluated in parallel worker processes (see OptimizationUtils.parallel), one
+per cpu unless optimization_options has 'workers'. Each worker evaluates its share of the population with a single
+call of the objective function if it is batched (see Optimizer.setObjectiveFunction). The optimization does not
+visualize.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import inspect
+
+import numpy as np
+from scipy.optimize import OptimizeResult, differential_evolution
+
+from OptimizationUtils import parallel
+from OptimizationUtils.OptimizationUtils import DEFAULT_OPTIMIZATION_OPTIONS
+
+# Options of least_squares, e.g. the default options of Optimizer.startOptimization, which are dropped from the options
+# of the population methods unless the method has an option with the same name and a value other than the default
+LEAST_SQUARES_OPTIONS = ['x_scale', 'ftol', 'xtol', 'gtol', 'diff_step', 'jac', 'loss', 'f_scale', 'max_nfev',
+                         'tr_solver', 'tr_options', 'verbose']
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def evaluateResiduals(context, xs):
+    """ Computes the (k, m) residuals of a chunk of the population, in a single call if the objective function is
+    batched. Called in the worker processes. """
+    return context['optimizer'].evaluateBatch(xs)
+
+
+def getPopulationOptions(optimization_method, optimization_options):
+    """ :return: a copy of the options without the options of least_squares, see LEAST_SQUARES_OPTIONS """
+    parameters = inspect.signature(differential_evolution if optimization_method == 'differential_evolution' else
+                                   cmaes).parameters
+    return {key: value for key, value in optimization_options.items()
+            if key not in LEAST_SQUARES_OPTIONS or
+            (key in parameters and not value == DEFAULT_OPTIMIZATION_OPTIONS.get(key))}
+
+
+def minimize(optimizer, optimization_options):
+    """ Runs the population based method set in the optimizer run, starting at the current parameters. Called by
+    Optimizer.internalStartOptimization.
+
+    :param optimizer: the Optimizer
+    :param optimization_options: options of scipy's differential_evolution or of cmaes, plus 'workers', the number of
+    worker processes
+    :return: a scipy OptimizeResult
+    """
+    run = optimizer.run
+    options = getPopulationOptions(run.optimization_method, optimization_options)
+    num_workers = options.pop('workers', None)
+    x0 = np.array(optimizer.getSolverX(), dtype=float)
+    bounds_min, bounds_max = run.bounds  # of the variables of the solver, i.e. without the frozen groups
+
+    with PopulationEvaluator(optimizer, num_workers) as evaluator:
+        generation = [0]
+
+        def callback(x, cost):
+            generation[0] += 1
+            run.status['num_iterations'] = generation[0]
+            if optimizer.trace_recorder is not None:
+                optimizer.trace_recorder.record(generation[0], run.best_x, run.best_errors)
+            optimizer.internalIterationCallback(OptimizeResult(x=x, fun=cost, nit=generation[0]))
+
+        if run.optimization_method == 'differential_evolution':
+            if not np.all(np.isfinite(bounds_min)) or not np.all(np.isfinite(bounds_max)):
+                names = optimizer.getParameters()
+                if run.solver_view is not None:
+                    names = [names[idx] for idx in run.solver_view.first_indices]
+                infinite = [name for name, bound_min, bound_max in zip(names, bounds_min, bounds_max)
+                            if not np.isfinite(bound_min) or not np.isfinite(bound_max)]
+                raise ValueError('Differential evolution needs finite bounds for all parameters. Parameters ' +
+                                 str(infinite) + ' are unbounded.')
+
+            def costsFunction(xs):  # vectorized: xs is (n, S), or (n,) when polishing
+                costs = evaluator.costs(np.atleast_2d(np.asarray(xs).T))
+                return costs if np.ndim(xs) == 2 else costs[0]
+
+            options.setdefault('polish', False)  # polishing evaluates one x at a time, with finite differences
+
+            result = differential_evolution(costsFunction, list(zip(bounds_min, bounds_max)), x0=x0,
+                                            vectorized=True, updating='deferred',
+                                            callback=lambda intermediate_result: callback(
+                                                intermediate_result.x, intermediate_result.fun), **options)
+        elif run.optimization_method == 'cma_es':
+            result = cmaes(evaluator.costs, x0, bounds=(bounds_min, bounds_max), callback=callback, **options)
+        else:
+            raise ValueError('Unknown population method ' + str(run.optimization_method))
+
+    result.nfev = run.status['num_function_calls']
+    return result
+
+
+def cmaes(costs_function, x0, bounds=None, sigma0=0.3, popsize=None, maxiter=1000, ftol=1e-11, xtol=1e-11,
+          seed=None, callback=None):
+    """ Minimizes with the covariance matrix adaptation evolution strategy, (mu/mu_w, lambda)-CMA-ES.
+
+    The search runs in coordinates normalized by the range of each parameter: the bound range when both bounds are
+    finite, the magnitude of x0 otherwise (or 1 if it is zero). Samples outside the bounds are clipped to them.
+
+    :param costs_function: function which receives a (popsize, n) array and returns the popsize costs
+    :param x0: the initial mean
+    :param bounds: (bounds_min, bounds_max) arrays, or None
+    :param sigma0: initial step size, as a fraction of the range of the parameters
+    :param popsize: number of samples per generation, default 4 + 3 * log(n)
+    :param maxiter: maximum number of generations
+    :param ftol: stop when the costs of the last generations differ less than this
+    :param xtol: stop when the step size is below this, in normalized coordinates
+    :param seed: seed of the random generator
+    :param callback: called as callback(best_x, best_cost) after each generation
+    :return: a scipy OptimizeResult
+    """
+    x0 = np.array(x0, dtype=float)
+    n = len(x0)
+    if bounds is None:
+        bounds = (np.full(n, -np.inf), np.full(n, np.inf))
+    bounds_min, bounds_max = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    finite = np.isfinite(bounds_min) & np.isfinite(bounds_max)
+    scale = np.where(finite, bounds_max - bounds_min, np.where(x0 != 0, np.abs(x0), 1.0))
+    scale[scale == 0] = 1.0
+    u_min, u_max = (bounds_min - x0) / scale, (bounds_max - x0) / scale
+
+    # Strategy parameters, as recommended by Hansen, The CMA Evolution Strategy: A Tutorial
+    lam = popsize if popsize is not None else 4 + int(3 * np.log(n))
+    mu = lam // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= np.sum(weights)
+    mueff = 1.0 / np.sum(weights ** 2)
+    cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+    cs = (mueff + 2) / (n + mueff + 5)
+    c1 = 2 / ((n + 1.3) ** 2 + mueff)
+    cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((n + 2) ** 2 + mueff))
+    damps = 1 + 2 * max(0, np.sqrt((mueff - 1) / (n + 1)) - 1) + cs
+    chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+    rng = np.random.default_rng(seed)
+    mean = np.zeros(n)
+    sigma = sigma0
+    pc, ps = np.zeros(n), np.zeros(n)
+    B, D, C = np.eye(n), np.ones(n), np.eye(n)
+    best_u, best_cost = mean.copy(), np.inf
+    history_length = 10 + int(30 * n / lam)
+    history = []  # best cost of the last generations
+    message, success, generation = 'Maximum number of generations reached.', False, 0
+
+    for generation in range(1, maxiter + 1):
+        samples = np.clip(mean + sigma * (rng.standard_normal((lam, n)) * D).dot(B.T), u_min, u_max)
+        costs = np.asarray(costs_function(x0 + samples * scale), dtype=float)
+        order = np.argsort(costs)
+        if costs[order[0]] < best_cost:
+            best_u, best_cost = samples[order[0]].copy(), float(costs[order[0]])
+
+        # Update of the mean, the evolution paths, the covariance matrix and the step size
+        selected = (samples[order[:mu]] - mean) / sigma
+        step = weights.dot(selected)
+        mean = mean + sigma * step
+        ps = (1 - cs) * ps + np.sqrt(cs * (2 - cs) * mueff) * B.dot(B.T.dot(step) / D)
+        hsig = np.linalg.norm(ps) / np.sqrt(1 - (1 - cs) ** (2 * generation)) / chi_n < 1.4 + 2 / (n + 1)
+        pc = (1 - cc) * pc + hsig * np.sqrt(cc * (2 - cc) * mueff) * step
+        C = (1 - c1 - cmu) * C + c1 * (np.outer(pc, pc) + (1 - hsig) * cc * (2 - cc) * C) + \
+            cmu * (selected.T * weights).dot(selected)
+        sigma *= np.exp((cs / damps) * (np.linalg.norm(ps) / chi_n - 1))
+        C = np.triu(C) + np.triu(C, 1).T  # keep it symmetric
+        eigenvalues, B = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+        if callback is not None:
+            callback(x0 + best_u * scale, best_cost)
+
+        history = (history + [float(costs[order[0]])])[-history_length:]
+        if len(history) == history_length and max(history) - min(history) < ftol and np.ptp(costs) < ftol:
+            message, success = '`ftol` termination condition is satisfied.', True
+            break
+        if sigma * np.max(D) < xtol:
+            message, success = '`xtol` termination condition is satisfied.', True
+            break
+
+    return OptimizeResult(x=x0 + best_u * scale, fun=best_cost, nit=generation, success=success,
+                          status=1 if success else 0, message=message)
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class PopulationEvaluator:
+    """ Evaluates populations of parameter vectors in worker processes, counting the function calls and keeping the
+    best evaluation in the run of the optimizer. """
+
+    def __init__(self, optimizer, num_workers=None):
+        self.optimizer = optimizer
+        self.pool = parallel.WorkerPool(evaluateResiduals, num_workers, optimizer=optimizer)
+
+    def residuals(self, xs):
+        """
+        :param xs: (k, n) array of variables of the solver
+        :return: (k, m) array of residuals
+        """
+        optimizer, run = self.optimizer, self.optimizer.run
+        if run.stoppable:
+            run.checkStop()
+
+        xs = np.asarray(xs, dtype=float)
+        if run.solver_view is not None:
+            xs = run.solver_view.toXBatch(xs)
+        num_chunks = self.pool.num_workers if self.pool.pool is not None else 1  # one chunk per worker
+        chunks = [chunk for chunk in np.array_split(xs, num_chunks) if len(chunk) > 0]
+        residuals = np.vstack(self.pool.map(chunks))
+        run.status['num_function_calls'] += len(xs)
+        if optimizer.record_evaluations:
+            for x, errors in zip(xs, residuals):
+                optimizer.recorded_evaluations.append((np.array(x, dtype=float), errors))
+        if run.residual_indices is not None:  # the residuals optimized in this run
+            residuals = residuals[:, run.residual_indices]
+        for x, errors in zip(xs, residuals):
+            run.updateBest(x, errors)
+        return residuals
+
+    def costs(self, xs):
+        """ :return: the least squares costs of the (k, n) parameter vectors """
+        residuals = self.residuals(xs)
+        return 0.5 * np.sum(residuals ** 2, axis=1)
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
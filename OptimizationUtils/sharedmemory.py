@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Numpy arrays in named shared memory segments, so that worker processes use large data (images, depth maps, point
+clouds) without receiving copies of it:
+
+    opt.shareDataModels()  # moves the arrays of 1 MB or more of the data models to shared memory
+
+Pickling a SharedArray, e.g. to send the data models to a spawned worker (see OptimizationUtils.parallel), only sends
+the name of its segment, and the worker attaches a view of the segment, which is read-only unless the array was
+created with writeable_in_workers. Forked workers inherit the arrays as they are.
+
+A segment is released when its array is garbage collected in the process which created it, or at exit.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import os
+import sys
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_segments = {}  # name: SharedMemory, the segments created or attached by this process
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def createSharedArray(array, writeable_in_workers=False):
+    """ Copies an array to a new shared memory segment.
+
+    :param array: the array to copy. Object arrays cannot be shared.
+    :param writeable_in_workers: if False the workers attach read-only views
+    :return: a SharedArray, writeable in this process
+    """
+    array = np.asarray(array)
+    if array.dtype.hasobject:
+        raise ValueError('Arrays of python objects cannot be placed in shared memory.')
+
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    _segments[segment.name] = segment
+    shared = _view(segment, array.shape, array.dtype.str, True)
+    shared[...] = array
+    shared.segment = (segment.name, array.shape, array.dtype.str, writeable_in_workers)
+    weakref.finalize(shared, _release, segment.name, os.getpid())
+    return shared
+
+
+def attachSharedArray(name, shape, dtype, writeable):
+    """ Returns a view of an existing segment. Used to unpickle SharedArrays. """
+    segment = _segments.get(name)
+    if segment is None:
+        if sys.version_info >= (3, 13):
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        else:  # registers the segment again in the resource tracker, which is the one of the creator
+            segment = shared_memory.SharedMemory(name=name)
+        _segments[name] = segment
+    shared = _view(segment, shape, dtype, writeable)
+    shared.segment = (name, shape, dtype, writeable)
+    return shared
+
+
+def shareArrays(data, min_size=1024 * 1024, max_depth=4, memo=None):
+    """ Replaces the large arrays in data (itself, the values of dicts, the items of lists and the attributes of
+    objects, recursively) by SharedArrays, which the workers attach read-only.
+
+    :param data: the data, e.g. a data model
+    :param min_size: minimum size in bytes of the arrays to share
+    :param max_depth: maximum depth of the recursion into the members of data
+    :return: (data, number of bytes moved to shared memory). data is a new SharedArray if it was a large array itself.
+    """
+    memo = set() if memo is None else memo
+    if id(data) in memo or max_depth < 0:
+        return data, 0
+    memo.add(id(data))
+
+    if isinstance(data, np.ndarray):
+        if isinstance(data, SharedArray) or data.dtype.hasobject or data.nbytes < min_size:
+            return data, 0
+        return createSharedArray(data), data.nbytes
+
+    if isinstance(data, dict):
+        items = list(data.items())
+    elif isinstance(data, list):
+        items = list(enumerate(data))
+    elif hasattr(data, '__dict__') and not isinstance(data, type) and not callable(data):
+        items = list(vars(data).items())
+    else:
+        return data, 0
+
+    num_bytes = 0
+    for key, value in items:
+        shared, shared_bytes = shareArrays(value, min_size, max_depth - 1, memo)
+        if shared is not value:
+            if isinstance(data, (dict, list)):
+                data[key] = shared
+            else:
+                setattr(data, key, shared)
+        num_bytes += shared_bytes
+    return data, num_bytes
+
+
+def _view(segment, shape, dtype, writeable):
+    shared = np.ndarray(shape, dtype=dtype, buffer=segment.buf).view(SharedArray)
+    shared.flags.writeable = writeable
+    return shared
+
+
+def _release(name, pid):
+    if not os.getpid() == pid:  # forked children inherit the finalizers, only the creator releases
+        return
+    segment = _segments.pop(name, None)
+    if segment is None:
+        return
+    try:
+        segment.close()
+    except BufferError:  # views still exist, the memory is unmapped when they are gone
+        pass
+    segment.unlink()
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class SharedArray(np.ndarray):
+    """ A numpy array in a shared memory segment, which is pickled as a reference to the segment. Arrays derived from
+    it (slices, results of operations) are pickled as normal arrays. """
+
+    def __array_finalize__(self, obj):
+        self.segment = None  # (name, shape, dtype, writeable in workers), set only for the array of the segment
+
+    def __array_wrap__(self, array, context=None, return_scalar=False):
+        if return_scalar:
+            return array[()]
+        return array.view(np.ndarray)  # results of operations are normal arrays
+
+    def __reduce__(self):
+        if self.segment is None:
+            return np.asarray(self).__reduce__()
+        return attachSharedArray, self.segment
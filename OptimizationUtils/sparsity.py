@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Detection of the sparsity of the Jacobian by probing the objective function, used by Optimizer.detectSparsity and
+Optimizer.verifySparsity:
+
+    opt.pushResidual('r0')  # no need to list the parameters which affect each residual
+    ...
+    opt.detectSparsity(cache_dir='/tmp/sparsity')
+
+Each parameter group is perturbed a few times, by a small random step, and a residual depends on all the parameters
+of the group if it changes in any of the probes. The probes are evaluated in batches (see Optimizer.evaluateBatch), in
+a single call of the objective function per batch if it is batched. A residual which does not change by chance, e.g.
+because it is a minimum over discrete points, is missed, so more probes or larger steps make the detection more
+reliable.
+
+The detected sparsity can be cached in a directory, in a file named after a hash of the structure of the problem
+(names of the parameters and residuals), so that later runs of the same problem skip the probing.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def probeSparsity(optimizer, step=1e-3, num_probes=2, batch_size=32, seed=0):
+    """ Detects which residuals depend on each parameter group, by perturbing the groups one at a time.
+
+    :param optimizer: the Optimizer, with its residuals configured
+    :param step: size of the perturbations, relative to the magnitude of each parameter (or absolute if it is below 1)
+    :param num_probes: number of perturbations of each group
+    :param batch_size: number of probes evaluated in each batch
+    :param seed: seed of the random perturbations
+    :return: (m, n) csr matrix with ones where a residual depends on a parameter
+    """
+    rng = np.random.default_rng(seed)
+    x0 = np.array(optimizer.x, dtype=float)
+    bounds_min, bounds_max = optimizer.getBounds()
+    groups = list(optimizer.groups.values())
+
+    probes = []  # (index of the group, x)
+    for group_index, group in enumerate(groups):
+        idx = list(group.idx)
+        for _ in range(num_probes):
+            delta = rng.choice([-1.0, 1.0], len(idx)) * rng.uniform(0.5, 1.0, len(idx)) * step * \
+                    np.maximum(np.abs(x0[idx]), 1.0)
+            x = x0.copy()
+            x[idx] += delta
+            outside = (x[idx] > bounds_max[idx]) | (x[idx] < bounds_min[idx])
+            x[np.array(idx)[outside]] -= 2 * delta[outside]  # perturb towards the inside of the bounds
+            probes.append((group_index, x))
+
+    residuals0 = optimizer.evaluateBatch(x0[np.newaxis, :])[0]
+    rows, cols = [], []
+    for start in range(0, len(probes), batch_size):
+        batch = probes[start:start + batch_size]
+        residuals = optimizer.evaluateBatch(np.array([x for _, x in batch]))
+        for (group_index, _), probe_residuals in zip(batch, residuals):
+            changed = np.flatnonzero(~(probe_residuals == residuals0))
+            rows.append(changed)
+            cols.append(np.full(len(changed), group_index))
+    optimizer.fromXToData()  # leave the data models with the current parameters
+
+    group_matrix = coo_matrix((np.ones(sum(len(r) for r in rows), dtype=int),
+                               (np.concatenate(rows + [[]]).astype(int), np.concatenate(cols + [[]]).astype(int))),
+                              shape=(len(residuals0), len(groups))).tocsr()
+    group_matrix.data[:] = 1
+
+    # a group column gives the columns of all the parameters of the group
+    group_of_param = np.zeros(len(x0), dtype=int)
+    for group_index, group in enumerate(groups):
+        group_of_param[list(group.idx)] = group_index
+    expansion = csr_matrix((np.ones(len(x0), dtype=int), (group_of_param, np.arange(len(x0)))),
+                           shape=(len(groups), len(x0)))
+    return group_matrix.dot(expansion).tocsr()
+
+
+def structureKey(optimizer):
+    """ :return: a hash of the names of the parameters and of the residuals of the problem """
+    digest = hashlib.sha1()
+    for name in optimizer.getParameters():
+        digest.update(('p:' + name + '\n').encode())
+    for name in optimizer.residuals:
+        digest.update(('r:' + name + '\n').encode())
+    return digest.hexdigest()
+
+
+def loadCachedSparsity(cache_dir, key):
+    """ :return: the cached csr matrix of the problem with this structure key, or None """
+    path = os.path.join(cache_dir, 'sparsity_' + key + '.npz')
+    if not os.path.exists(path):
+        return None
+    data = np.load(path)
+    return csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+
+
+def saveCachedSparsity(cache_dir, key, sparse_matrix):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    sparse_matrix = csr_matrix(sparse_matrix)
+    np.savez(os.path.join(cache_dir, 'sparsity_' + key + '.npz'), data=sparse_matrix.data,
+             indices=sparse_matrix.indices, indptr=sparse_matrix.indptr, shape=np.array(sparse_matrix.shape))
+
+
+def compareSparsity(declared, detected, residual_names, param_names):
+    """ Compares a declared sparse matrix with a detected one.
+
+    :return: (missing, extra), lists of (residual name, parameter name). Missing dependencies are detected but not
+    declared, so the Jacobian misses them. Extra ones are declared but not detected, which only costs function calls.
+    """
+    declared = (csr_matrix(declared) != 0).astype(int)
+    detected = (csr_matrix(detected) != 0).astype(int)
+    missing = (detected - declared).tocoo()
+    extra = (declared - detected).tocoo()
+    return ([(residual_names[row], param_names[col]) for row, col, value in zip(missing.row, missing.col, missing.data)
+             if value > 0],
+            [(residual_names[row], param_names[col]) for row, col, value in zip(extra.row, extra.col, extra.data)
+             if value > 0])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Block coordinate (staged) optimization: a sequence of optimizations, each of a subset of the parameter groups, with its
+own solver options and stopping rules. Used by Optimizer.addStage and Optimizer.startStagedOptimization:
+
+    opt.addStage('intrinsics', groups=['c0_intrinsics', 'c1_intrinsics'])  # the poses stay fixed
+    opt.addStage('poses', groups=['c0_pose', 'c1_pose'], max_function_calls=200)
+    opt.addStage('joint', optimization_options={'max_nfev': 20})  # all the groups, for a few iterations
+    result = opt.startStagedOptimization()
+
+Each stage starts where the previous one finished (warm start). The solver of a stage only has the variables of its
+groups, and only the residuals which depend on them (if the optimizer has a sparse matrix), so its Jacobian is smaller
+and each iteration needs fewer objective function calls. Frozen groups stay fixed in every stage.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import time
+
+import numpy as np
+
+from OptimizationUtils.OptimizationUtils import OptimizationRun
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def getStageProblem(optimizer, groups):
+    """ Finds the subproblem of a stage.
+
+    :param optimizer: the Optimizer
+    :param groups: names of the parameter groups of the stage, or None for all of them
+    :return: (variables, residuals). The variables are indices of the solver variables (see
+    Optimizer.getSolverView), or None for all. The residuals are the indices of the residuals which depend on them, or
+    None for all.
+    """
+    if groups is None:
+        return None, None
+
+    idx = [idx for group_name in groups if group_name not in optimizer.frozen_groups
+           for idx in optimizer.groups[group_name].idx]
+    solver_view = optimizer.getSolverView()
+    if solver_view is None:
+        variables = np.unique(np.array(idx, dtype=int))
+    else:
+        variables = np.unique(solver_view.z_indices[np.isin(solver_view.x_indices, idx)])
+    if len(variables) == 0:
+        raise ValueError('The groups ' + str(groups) + ' are all frozen, there is nothing to optimize.')
+
+    if optimizer.sparse_matrix is None:
+        return variables, None
+    sparse_matrix = optimizer.sparse_matrix if solver_view is None else \
+        solver_view.getSparseMatrix(optimizer.sparse_matrix)
+    residuals = np.flatnonzero(sparse_matrix.tocsc()[:, variables].getnnz(axis=1))
+    if len(residuals) == sparse_matrix.shape[0]:
+        residuals = None
+    return variables, residuals
+
+
+def runStages(optimizer, stages):
+    """ Runs the stages one after the other, each starting from the solution of the previous one. Called by
+    Optimizer.startStagedOptimization, with the optimizer lock held.
+
+    :param optimizer: the Optimizer
+    :param stages: list of StageT
+    :return: a list with the summary of each stage
+    """
+    x0 = list(optimizer.x)
+    backup = optimizer.stopping_rules
+    summaries = []
+    try:
+        for stage in stages:
+            print('\nStage ' + stage.name + ' ...')
+            run = OptimizationRun(stage.optimization_method, stage.optimization_options)
+            run.variables, run.residual_indices = getStageProblem(optimizer, stage.groups)
+            run.rebase_manifolds = False  # the increments of all the stages are rebased at the end
+            run.start_trace = len(summaries) == 0  # the stages are recorded in a single trace
+            run.track_progress = True  # for the number of iterations of the summary
+            if stage.stopping_rules is not None:
+                optimizer.stopping_rules = stage.stopping_rules
+
+            t = time.perf_counter()
+            optimizer.internalStartOptimization(stage.optimization_method, stage.optimization_options, run=run)
+            optimizer.stopping_rules = backup
+            optimizer.x = list(optimizer.xf)  # warm start of the next stage
+
+            result = optimizer.result
+            num_variables = run.solver_view.num_variables if run.solver_view is not None else len(optimizer.x)
+            num_residuals = len(run.residual_indices) if run.residual_indices is not None else \
+                len(optimizer.residuals)
+            summaries.append({'stage': stage.name, 'num_variables': num_variables, 'num_residuals': num_residuals,
+                              'cost': float(result.cost) if 'cost' in result else float(result.fun),
+                              'success': bool(result.success), 'message': str(result.message),
+                              'nfev': int(result.nfev), 'nit': int(run.progress[0]),
+                              'elapsed': time.perf_counter() - t})
+    finally:
+        optimizer.stopping_rules = backup
+
+    optimizer.x0 = x0
+    optimizer.rebaseManifoldGroups()
+    return summaries
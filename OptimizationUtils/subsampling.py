@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Coarse to fine optimization: a sequence of optimizations of growing subsets of the residuals, used by
+Optimizer.startCoarseToFineOptimization:
+
+    result = opt.startCoarseToFineOptimization(fractions=(0.01, 0.1, 1.0))
+
+The residuals are split in blocks, by default the residuals which depend on the same parameters (e.g. the points of
+one pair of point clouds), and each level has a fraction of each block. The first levels are solved to a loose
+tolerance, and each level starts where the previous one finished (warm start), so that the full problem, at the last
+level, starts close to its solution and needs few iterations.
+
+The subsets are nested: each level has the residuals of the previous one plus new ones. Stratified sampling spreads
+the residuals of each subset evenly over the order of the block (e.g. along a scan), random sampling picks them at
+random.
+
+The indices of the residuals of the current level are given to the objective function in
+data_models['status']['active_residuals'], None for all. The objective function must still return all the residuals,
+but it may skip the computation of the inactive ones and return any value (e.g. zero) for them:
+
+    def objectiveFunction(data_models):
+        active = data_models['status']['active_residuals']
+        points = model_points if active is None else model_points[active]
+        errors = np.zeros(len(model_points))
+        errors[slice(None) if active is None else active] = computeDistances(points)
+        return errors
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from OptimizationUtils.OptimizationUtils import OptimizationRun
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def getResidualBlocks(optimizer):
+    """ :return: list of arrays with the indices of the residuals of each block, the residuals which depend on the same
+    parameters. A single block if the optimizer has no sparse matrix. """
+    if optimizer.sparse_matrix is None:
+        return [np.arange(len(optimizer.residuals))]
+
+    sparse_matrix = optimizer.sparse_matrix.tocsr()
+    blocks = OrderedDict()  # key={columns of the row} value = list of rows
+    for row in range(sparse_matrix.shape[0]):
+        columns = sparse_matrix.indices[sparse_matrix.indptr[row]:sparse_matrix.indptr[row + 1]]
+        blocks.setdefault(tuple(sorted(columns)), []).append(row)
+    return [np.array(rows, dtype=int) for rows in blocks.values()]
+
+
+def stratifiedOrder(n):
+    """ :return: a permutation of range(n) whose prefixes are spread evenly over the range, in the order of the radical
+    inverse in base 2 (van der Corput sequence): 0, n/2, n/4, 3n/4, ... """
+    indices = np.arange(n)
+    radical_inverse = np.zeros(n)
+    scale = 0.5
+    while np.any(indices):
+        radical_inverse += (indices & 1) * scale
+        indices = indices >> 1
+        scale /= 2
+    return np.argsort(radical_inverse, kind='stable')
+
+
+def sampleLevels(blocks, fractions, sampling='stratified', seed=0):
+    """ Computes the nested subsets of residuals of each level.
+
+    :param blocks: list of arrays of indices of residuals
+    :param fractions: increasing fraction of each block used at each level
+    :param sampling: 'stratified' or 'random'
+    :return: list of sorted arrays of indices of residuals, one per level
+    """
+    rng = np.random.default_rng(seed)
+    orders = []
+    for block in blocks:
+        if sampling == 'stratified':
+            orders.append(block[stratifiedOrder(len(block))])
+        elif sampling == 'random':
+            orders.append(rng.permutation(block))
+        else:
+            raise ValueError('Unknown sampling ' + str(sampling) + '. Use stratified or random.')
+
+    # at least one residual of each block, so that every parameter is observed in every level
+    return [np.sort(np.concatenate([order[:max(1, int(np.ceil(fraction * len(order))))] for order in orders]))
+            for fraction in fractions]
+
+
+def runLevels(optimizer, levels, optimization_method, optimization_options, coarse_options):
+    """ Runs the levels one after the other, each starting from the solution of the previous one. Called by
+    Optimizer.startCoarseToFineOptimization, with the optimizer lock held.
+
+    :param optimizer: the Optimizer
+    :param levels: list of arrays of indices of the residuals of each level. The last level has all the residuals.
+    :param coarse_options: solver options of all the levels but the last, which override optimization_options
+    :return: a list with the summary of each level
+    """
+    x0 = list(optimizer.x)
+    summaries = []
+    for level, residuals in enumerate(levels):
+        last = level == len(levels) - 1
+        options = optimization_options if last else dict(optimization_options, **coarse_options)
+        print('\nLevel ' + str(level) + ' with ' + str(len(residuals)) + ' of ' + str(len(optimizer.residuals)) +
+              ' residuals ...')
+        run = OptimizationRun(optimization_method, options)
+        run.residual_indices = None if last else residuals
+        run.rebase_manifolds = False  # the increments of all the levels are rebased at the end
+        run.start_trace = level == 0  # the levels are recorded in a single trace
+        run.track_progress = True  # for the number of iterations of the summary
+
+        t = time.perf_counter()
+        optimizer.internalStartOptimization(optimization_method, options, run=run)
+        optimizer.x = list(optimizer.xf)  # warm start of the next level
+
+        result = optimizer.result
+        summaries.append({'level': level, 'num_residuals': len(residuals),
+                          'cost': float(result.cost) if 'cost' in result else float(result.fun),
+                          'success': bool(result.success), 'message': str(result.message),
+                          'nfev': int(result.nfev), 'nit': int(run.progress[0]), 'elapsed': time.perf_counter() - t})
+
+    optimizer.x0 = x0
+    optimizer.rebaseManifoldGroups()
+    return summaries
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic multi-sensor calibration problems with known ground truth.
+
+A problem has N cameras and M LIDARs mounted on a rig, observing a chessboard in K collections. The first sensor
+defines the world reference frame, the others are to be calibrated, together with the camera intrinsics and the
+pose of the chessboard in each collection. Cameras observe the chessboard corners (pixel residuals), LIDARs observe
+points on the chessboard plane (point to plane residuals).
+
+Everything is derived from a seed, and collections are generated on demand, so that problems with thousands of
+collections can be streamed without storing any recorded data:
+
+    problem = SyntheticProblem(num_cameras=2, num_lidars=1, num_collections=1000, seed=0)
+    opt = problem.buildOptimizer()
+    opt.startOptimization()
+    print(problem.calibrationErrors(opt.data_models))
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import math
+from collections import namedtuple, OrderedDict
+from functools import partial
+
+import numpy as np
+
+# ------------------------
+# DATA STRUCTURES   ##
+# ------------------------
+ObservationT = namedtuple('ObservationT', 'idxs measurements')
+ResidualBlockT = namedtuple('ResidualBlockT', 'collection_key sensor_name params residual_names')
+
+
+class SyntheticSensor:
+    def __init__(self, name, kind, t, r, intrinsics=None, width=None, height=None):
+        self.name = name
+        self.kind = kind  # 'camera' or 'lidar'
+        self.t = np.array(t, dtype=float)  # translation of the sensor in the world
+        self.r = np.array(r, dtype=float)  # rotation of the sensor in the world (rodrigues)
+        self.intrinsics = None if intrinsics is None else np.array(intrinsics, dtype=float)  # fx, fy, cx, cy
+        self.width = width
+        self.height = height
+
+
+class SyntheticCollection:
+    def __init__(self, key, board_t, board_r, gt_board_t, gt_board_r):
+        self.key = key
+        self.board_t = np.array(board_t, dtype=float)  # translation of the chessboard in the world
+        self.board_r = np.array(board_r, dtype=float)  # rotation of the chessboard in the world (rodrigues)
+        self.gt_board_t = np.array(gt_board_t, dtype=float)
+        self.gt_board_r = np.array(gt_board_r, dtype=float)
+        self.observations = OrderedDict()  # key=sensor name, value=ObservationT
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def rodriguesToMatrix(r):
+    """ Rotation matrix from a rodrigues vector (numpy only version of utilities.rodriguesToMatrix). """
+    r = np.asarray(r, dtype=float)
+    theta = np.linalg.norm(r)
+    if theta < 1e-12:
+        return np.identity(3)
+    k = r / theta
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.identity(3) + math.sin(theta) * K + (1 - math.cos(theta)) * np.dot(K, K)
+
+
+def matrixToRodrigues(R):
+    """ Rodrigues vector from a rotation matrix (numpy only version of utilities.matrixToRodrigues). """
+    cos_theta = np.clip((np.trace(R) - 1) / 2.0, -1.0, 1.0)
+    theta = math.acos(cos_theta)
+    if theta < 1e-12:
+        return np.zeros(3)
+    if math.pi - theta < 1e-6:  # near pi the antisymmetric part vanishes, use the symmetric part instead
+        B = (R + np.identity(3)) / 2.0
+        k = B[:, np.argmax(np.diag(B))]
+        return k / np.linalg.norm(k) * theta
+    w = np.array([R[2, 1] - R[1, 2], R[0, 2] - R[2, 0], R[1, 0] - R[0, 1]]) / (2 * math.sin(theta))
+    return w * theta
+
+
+def poseToTransform(t, r):
+    T = np.identity(4)
+    T[0:3, 0:3] = rodriguesToMatrix(r)
+    T[0:3, 3] = t
+    return T
+
+
+def chessboardCorners(num_x, num_y, square_size):
+    """ Homogeneous coordinates (4xN) of the chessboard corners, in the chessboard reference frame. """
+    xs, ys = np.meshgrid(np.arange(num_x) * square_size, np.arange(num_y) * square_size)
+    n = num_x * num_y
+    return np.vstack((xs.reshape(n), ys.reshape(n), np.zeros(n), np.ones(n)))
+
+
+def projectToImage(intrinsics, pts_in_camera):
+    """ Pinhole projection of 3D points (3xN or 4xN) in the camera frame. Returns 2xN pixels. """
+    fx, fy, cx, cy = intrinsics[0], intrinsics[1], intrinsics[2], intrinsics[3]
+    z = pts_in_camera[2, :]
+    return np.vstack((fx * pts_in_camera[0, :] / z + cx, fy * pts_in_camera[1, :] / z + cy))
+
+
+# Getters and setters are module level functions so that the optimizer does not hold local closures
+def getterSensorTranslation(sensors, name):
+    return list(sensors[name].t)
+
+
+def setterSensorTranslation(sensors, values, name):
+    sensors[name].t[:] = values
+
+
+def getterSensorRotation(sensors, name):
+    return list(sensors[name].r)
+
+
+def setterSensorRotation(sensors, values, name):
+    sensors[name].r[:] = values
+
+
+def getterIntrinsics(sensors, name):
+    return list(sensors[name].intrinsics)
+
+
+def setterIntrinsics(sensors, values, name):
+    sensors[name].intrinsics[:] = values
+
+
+def getterBoardTranslation(collections, key):
+    return list(collections[key].board_t)
+
+
+def setterBoardTranslation(collections, values, key):
+    collections[key].board_t[:] = values
+
+
+def getterBoardRotation(collections, key):
+    return list(collections[key].board_r)
+
+
+def setterBoardRotation(collections, values, key):
+    collections[key].board_r[:] = values
+
+
+def objectiveFunction(data_models):
+    """ Camera reprojection errors (x and y per corner) and LIDAR point to plane distances, in the order in which
+    SyntheticProblem.iterResidualBlocks pushes them. """
+    sensors = data_models['sensors']
+    corners = data_models['chessboard']
+    T_sensors = OrderedDict((name, np.linalg.inv(poseToTransform(sensor.t, sensor.r)))
+                            for name, sensor in sensors.items())
+
+    errors = []
+    for collection in data_models['collections'].values():
+        T_board = poseToTransform(collection.board_t, collection.board_r)
+        for sensor_name, observation in collection.observations.items():
+            sensor = sensors[sensor_name]
+            if sensor.kind == 'camera':
+                pts = np.dot(np.dot(T_sensors[sensor_name], T_board), corners[:, observation.idxs])
+                error = projectToImage(sensor.intrinsics, pts) - observation.measurements
+                errors.extend(error.transpose().reshape(-1))
+            else:
+                T_lidar = poseToTransform(sensor.t, sensor.r)
+                pts = np.dot(np.dot(np.linalg.inv(T_board), T_lidar), observation.measurements)
+                errors.extend(pts[2, :])
+    return errors
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class SyntheticProblem:
+
+    def __init__(self, num_cameras=2, num_lidars=1, num_collections=10, seed=0, chessboard_size=(9, 6),
+                 square_size=0.1, image_size=(1280, 720), lidar_points=50, pixel_noise=0.5, range_noise=0.01,
+                 outlier_fraction=0.0, outlier_magnitude=(50.0, 0.5), pose_noise=(0.05, 0.05),
+                 intrinsics_noise=0.02, optimize_intrinsics=True):
+        """
+        :param num_cameras: number of cameras N
+        :param num_lidars: number of LIDARs M
+        :param num_collections: number of collections K
+        :param seed: seed from which every random quantity of the problem is derived
+        :param chessboard_size: number of inner corners (num_x, num_y)
+        :param square_size: side of the chessboard squares, in meters
+        :param image_size: (width, height) of the camera images
+        :param lidar_points: number of chessboard points measured by each LIDAR in each collection
+        :param pixel_noise: standard deviation of the corner detections, in pixels
+        :param range_noise: standard deviation of the LIDAR measurements, in meters
+        :param outlier_fraction: fraction of the measurements which are replaced by outliers
+        :param outlier_magnitude: (pixels, meters) scale of the outlier errors for cameras and LIDARs
+        :param pose_noise: (translation in meters, rotation in radians) perturbation of the initial guess
+        :param intrinsics_noise: relative perturbation of the initial guess of the intrinsics
+        :param optimize_intrinsics: push the camera intrinsics as parameters to optimize
+        """
+        if num_cameras + num_lidars < 2:
+            raise ValueError('A calibration problem needs at least two sensors.')
+
+        self.num_cameras = num_cameras
+        self.num_lidars = num_lidars
+        self.num_collections = num_collections
+        self.seed = seed
+        self.chessboard_size = chessboard_size
+        self.square_size = square_size
+        self.image_size = image_size
+        self.lidar_points = lidar_points
+        self.pixel_noise = pixel_noise
+        self.range_noise = range_noise
+        self.outlier_fraction = outlier_fraction
+        self.outlier_magnitude = outlier_magnitude
+        self.pose_noise = pose_noise
+        self.intrinsics_noise = intrinsics_noise
+        self.optimize_intrinsics = optimize_intrinsics
+
+        self.corners = chessboardCorners(chessboard_size[0], chessboard_size[1], square_size)
+        self.gt_sensors, self.sensors = self._generateSensors()
+
+    def _rng(self, *keys):
+        # Independent stream per (seed, keys), so that any collection can be regenerated alone
+        return np.random.default_rng([self.seed] + list(keys))
+
+    def _generateSensors(self):
+        rng = self._rng(0)
+        width, height = self.image_size
+        gt_sensors, sensors = OrderedDict(), OrderedDict()
+        names = ['camera' + str(i) for i in range(self.num_cameras)] + \
+                ['lidar' + str(i) for i in range(self.num_lidars)]
+
+        for idx, name in enumerate(names):
+            kind = 'camera' if name.startswith('camera') else 'lidar'
+            if idx == 0:  # the first sensor is the world reference frame
+                t, r = np.zeros(3), np.zeros(3)
+            else:  # sensors are mounted side by side, all looking along z
+                t = np.array([0.3 * idx, 0.0, 0.0]) + rng.uniform(-0.05, 0.05, 3)
+                r = rng.uniform(-0.1, 0.1, 3)
+
+            intrinsics = None
+            if kind == 'camera':
+                f = rng.uniform(0.8, 1.2) * width
+                intrinsics = [f, f, width / 2.0 + rng.uniform(-10, 10), height / 2.0 + rng.uniform(-10, 10)]
+
+            gt_sensors[name] = SyntheticSensor(name, kind, t, r, intrinsics, width, height)
+
+            if idx > 0:  # perturb the initial guess, except for the reference sensor
+                t = t + rng.normal(0, self.pose_noise[0], 3)
+                r = r + rng.normal(0, self.pose_noise[1], 3)
+            if intrinsics is not None:
+                intrinsics = np.array(intrinsics) * (1 + rng.normal(0, self.intrinsics_noise, 4))
+            sensors[name] = SyntheticSensor(name, kind, t, r, intrinsics, width, height)
+
+        return gt_sensors, sensors
+
+    def generateCollection(self, k):
+        """ Generates collection k, with the ground truth and perturbed chessboard poses and the observations. """
+        rng = self._rng(1, k)
+        num_x, num_y = self.chessboard_size
+
+        # chessboard in front of the rig, centered on the board, facing the sensors with some tilt
+        gt_r = rng.uniform(-0.4, 0.4, 3)
+        R = rodriguesToMatrix(gt_r)
+        center = np.array([0.3 * (len(self.gt_sensors) - 1) / 2.0, 0.0, 0.0]) + \
+            np.array([rng.uniform(-0.5, 0.5), rng.uniform(-0.4, 0.4), rng.uniform(2.0, 4.0)])
+        board_center = np.array([(num_x - 1) * self.square_size / 2.0, (num_y - 1) * self.square_size / 2.0, 0])
+        gt_t = center - np.dot(R, board_center)
+
+        board_t = gt_t + rng.normal(0, self.pose_noise[0], 3)
+        board_r = gt_r + rng.normal(0, self.pose_noise[1], 3)
+        collection = SyntheticCollection(str(k), board_t, board_r, gt_t, gt_r)
+
+        T_board = poseToTransform(gt_t, gt_r)
+        for name, sensor in self.gt_sensors.items():
+            T_sensor_board = np.dot(np.linalg.inv(poseToTransform(sensor.t, sensor.r)), T_board)
+
+            if sensor.kind == 'camera':
+                pts = np.dot(T_sensor_board, self.corners)
+                pixels = projectToImage(sensor.intrinsics, pts)
+                visible = (pts[2, :] > 0) & (pixels[0, :] >= 0) & (pixels[0, :] < sensor.width) & \
+                          (pixels[1, :] >= 0) & (pixels[1, :] < sensor.height)
+                idxs = np.flatnonzero(visible)
+                if len(idxs) == 0:
+                    continue
+                measurements = pixels[:, idxs] + rng.normal(0, self.pixel_noise, (2, len(idxs)))
+                outliers = rng.random(len(idxs)) < self.outlier_fraction
+                measurements[:, outliers] += rng.normal(0, self.outlier_magnitude[0], (2, np.count_nonzero(outliers)))
+            else:
+                # random points on the chessboard surface, measured along the LIDAR rays
+                pts = np.vstack((rng.uniform(0, (num_x - 1) * self.square_size, self.lidar_points),
+                                 rng.uniform(0, (num_y - 1) * self.square_size, self.lidar_points),
+                                 np.zeros(self.lidar_points), np.ones(self.lidar_points)))
+                pts = np.dot(T_sensor_board, pts)
+                ranges = np.linalg.norm(pts[0:3, :], axis=0)
+                noise = rng.normal(0, self.range_noise, self.lidar_points)
+                outliers = rng.random(self.lidar_points) < self.outlier_fraction
+                noise[outliers] += rng.normal(0, self.outlier_magnitude[1], np.count_nonzero(outliers))
+                pts[0:3, :] *= (ranges + noise) / ranges
+                idxs = np.arange(self.lidar_points)
+                measurements = pts
+
+            collection.observations[name] = ObservationT(idxs, measurements)
+
+        return collection
+
+    def iterCollections(self):
+        """ Generator of all collections, created one at a time. """
+        for k in range(self.num_collections):
+            yield self.generateCollection(k)
+
+    def iterResidualBlocks(self, collections):
+        """ Generator of the residual blocks (one per collection and sensor) of the given collections.
+
+        :param collections: iterable of SyntheticCollection
+        """
+        for collection in collections:
+            board_params = self._groupParams('c' + collection.key + '_board_t') + \
+                           self._groupParams('c' + collection.key + '_board_r')
+            for sensor_name, observation in collection.observations.items():
+                params = board_params + self._sensorParams(sensor_name)
+                prefix = 'c' + collection.key + '_' + sensor_name + '_'
+                if self.sensors[sensor_name].kind == 'camera':
+                    residual_names = [prefix + str(idx) + axis for idx in observation.idxs for axis in ('_x', '_y')]
+                else:
+                    residual_names = [prefix + str(idx) for idx in observation.idxs]
+                yield ResidualBlockT(collection.key, sensor_name, params, residual_names)
+
+    def _groupParams(self, group_name, suffix=('x', 'y', 'z')):
+        return [group_name + s for s in suffix]
+
+    def _sensorParams(self, sensor_name):
+        if sensor_name == next(iter(self.sensors)):  # the reference sensor is not optimized
+            params = []
+        else:
+            params = self._groupParams(sensor_name + '_t') + self._groupParams(sensor_name + '_r')
+        if self.sensors[sensor_name].kind == 'camera' and self.optimize_intrinsics:
+            params += self._groupParams(sensor_name + '_intrinsics', suffix=('_fx', '_fy', '_cx', '_cy'))
+        return params
+
+    def buildOptimizer(self, opt=None):
+        """ Adds the data models, parameters, residuals and objective function of the problem to an optimizer.
+
+        :param opt: an OptimizationUtils.Optimizer. If None a new one is created.
+        :return: the configured optimizer
+        """
+        if opt is None:
+            import OptimizationUtils.OptimizationUtils as OptimizationUtils
+            opt = OptimizationUtils.Optimizer()
+
+        collections = OrderedDict()
+        opt.addDataModel('sensors', self.sensors)
+        opt.addDataModel('collections', collections)
+        opt.addDataModel('chessboard', self.corners)
+
+        for idx, (name, sensor) in enumerate(self.sensors.items()):
+            if idx > 0:
+                opt.pushParamVector(group_name=name + '_t', data_key='sensors',
+                                    getter=partial(getterSensorTranslation, name=name),
+                                    setter=partial(setterSensorTranslation, name=name), suffix=['x', 'y', 'z'])
+                opt.pushParamVector(group_name=name + '_r', data_key='sensors',
+                                    getter=partial(getterSensorRotation, name=name),
+                                    setter=partial(setterSensorRotation, name=name), suffix=['x', 'y', 'z'])
+            if sensor.kind == 'camera' and self.optimize_intrinsics:
+                opt.pushParamVector(group_name=name + '_intrinsics', data_key='sensors',
+                                    getter=partial(getterIntrinsics, name=name),
+                                    setter=partial(setterIntrinsics, name=name), suffix=['_fx', '_fy', '_cx', '_cy'],
+                                    bound_min=[1, 1, 0, 0])
+
+        for collection in self.iterCollections():
+            collections[collection.key] = collection
+            opt.pushParamVector(group_name='c' + collection.key + '_board_t', data_key='collections',
+                                getter=partial(getterBoardTranslation, key=collection.key),
+                                setter=partial(setterBoardTranslation, key=collection.key), suffix=['x', 'y', 'z'])
+            opt.pushParamVector(group_name='c' + collection.key + '_board_r', data_key='collections',
+                                getter=partial(getterBoardRotation, key=collection.key),
+                                setter=partial(setterBoardRotation, key=collection.key), suffix=['x', 'y', 'z'])
+            for block in self.iterResidualBlocks([collection]):
+                for residual_name in block.residual_names:
+                    opt.pushResidual(name=residual_name, params=block.params)
+
+        opt.setObjectiveFunction(objectiveFunction)
+        opt.computeSparseMatrix()
+        return opt
+
+    def calibrationErrors(self, data_models=None):
+        """ Compares the estimated sensors with the ground truth.
+
+        :param data_models: the optimizer data models. If None, the sensors held by the problem are used.
+        :return: dict with key=sensor name and value=dict with the translation (m), rotation (rad) and relative
+        intrinsics errors.
+        """
+        sensors = self.sensors if data_models is None else data_models['sensors']
+        errors = OrderedDict()
+        for name, gt in self.gt_sensors.items():
+            sensor = sensors[name]
+            R = np.dot(rodriguesToMatrix(gt.r).transpose(), rodriguesToMatrix(sensor.r))
+            errors[name] = {'translation': float(np.linalg.norm(sensor.t - gt.t)),
+                            'rotation': float(np.linalg.norm(matrixToRodrigues(R)))}
+            if gt.intrinsics is not None:
+                errors[name]['intrinsics'] = float(np.max(np.abs(sensor.intrinsics - gt.intrinsics) / gt.intrinsics))
+        return errors
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Compact recording of the optimization path, to be inspected or visualized after the optimization.
+
+The recorder stores the parameters x and the residuals at each core iteration, in float32. Consecutive iterations
+are delta encoded (on the float32 bit patterns, so the encoding is lossless) and written to disk in compressed
+chunks, which keeps long traces small and bounds the memory used while recording:
+
+    opt.setTraceRecorder(TraceRecorder('/tmp/calibration_trace'))
+    opt.setVisualizationFunction(visualizationFunction, always_visualize=False)
+    opt.startOptimization()
+
+And later, with the same optimizer configuration (data models, parameters and visualization function):
+
+    opt.replayTrace('/tmp/calibration_trace')
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import json
+import os
+
+import numpy as np
+
+TRACE_VERSION = 1
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def deltaEncode(rows):
+    """ Delta encodes the rows of a float32 matrix. The first row is kept, the others are replaced by the difference
+    to the previous row, computed on the bit patterns so that deltaDecode recovers the exact values. """
+    bits = np.ascontiguousarray(rows, dtype=np.float32).view(np.uint32)
+    encoded = bits.copy()
+    encoded[1:] = bits[1:] - bits[:-1]  # uint32 arithmetic wraps around, which makes the encoding reversible
+    return encoded
+
+
+def deltaDecode(encoded):
+    return np.cumsum(encoded, axis=0, dtype=np.uint32).view(np.float32)
+
+
+# -------------------------------------------------------------------------------
+# CLASS
+# -------------------------------------------------------------------------------
+class TraceRecorder:
+    """ Records (iteration, x, residuals) to a directory with chunks of delta encoded float32 values. """
+
+    def __init__(self, path, chunk_size=100):
+        """
+        :param path: directory where the trace is written. Created if it does not exist.
+        :param chunk_size: number of iterations per chunk file
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.num_chunks = 0
+        self.num_records = 0
+        self.param_names = None
+        self.residual_names = None
+        self.iteration_offset = 0  # added to the iterations of the current run, see resume
+        self.last_iteration = None
+        self._iterations, self._xs, self._residuals = [], [], []
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def start(self, param_names, residual_names):
+        """ Starts a new trace, discarding the chunks of a previous one. Called by the optimizer. """
+        for file_name in os.listdir(self.path):
+            if file_name.startswith('chunk_') and file_name.endswith('.npz'):
+                os.remove(os.path.join(self.path, file_name))
+        self.param_names = list(param_names)
+        self.residual_names = list(residual_names)
+        self.num_chunks = 0
+        self.num_records = 0
+        self.iteration_offset = 0
+        self.last_iteration = None
+        self._iterations, self._xs, self._residuals = [], [], []
+        self._writeMetadata()
+
+    def isStarted(self):
+        return self.param_names is not None
+
+    def resume(self):
+        """ Continues the current trace with the iterations of another run, numbered after the recorded ones. Called
+        by the optimizer for the stages of a staged optimization and the levels of a coarse to fine one. """
+        self.iteration_offset = 0 if self.last_iteration is None else self.last_iteration + 1
+
+    def record(self, iteration, x, residuals):
+        iteration = self.iteration_offset + iteration
+        self.last_iteration = iteration
+        self._iterations.append(iteration)
+        self._xs.append(np.asarray(x, dtype=np.float32))
+        self._residuals.append(np.asarray(residuals, dtype=np.float32))
+        self.num_records += 1
+        if len(self._iterations) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered iterations to a new chunk. """
+        if len(self._iterations) == 0:
+            return
+
+        np.savez_compressed(os.path.join(self.path, 'chunk_' + str(self.num_chunks).zfill(6) + '.npz'),
+                            iterations=np.array(self._iterations, dtype=np.int64),
+                            x=deltaEncode(np.array(self._xs)),
+                            residuals=deltaEncode(np.array(self._residuals)))
+        self.num_chunks += 1
+        self._iterations, self._xs, self._residuals = [], [], []
+        self._writeMetadata()
+
+    def close(self):
+        self.flush()
+
+    def _writeMetadata(self):
+        with open(os.path.join(self.path, 'trace.json'), 'w') as f:
+            json.dump({'version': TRACE_VERSION, 'num_chunks': self.num_chunks, 'num_records': self.num_records,
+                       'param_names': self.param_names, 'residual_names': self.residual_names}, f)
+
+
+class TraceReader:
+    """ Reads a trace written by TraceRecorder. Iterating yields (iteration, x, residuals) tuples. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'trace.json'), 'r') as f:
+            metadata = json.load(f)
+        if metadata['version'] > TRACE_VERSION:
+            raise ValueError('Trace ' + str(path) + ' has version ' + str(metadata['version']) +
+                             ', this version of OptimizationUtils reads up to version ' + str(TRACE_VERSION))
+        self.num_chunks = metadata['num_chunks']
+        self.param_names = metadata['param_names']
+        self.residual_names = metadata['residual_names']
+
+    def __len__(self):
+        return sum(len(iterations) for iterations, _, _ in self.iterChunks())
+
+    def iterChunks(self):
+        """ Generator of (iterations, xs, residuals) arrays, one chunk at a time. """
+        for idx in range(self.num_chunks):
+            with np.load(os.path.join(self.path, 'chunk_' + str(idx).zfill(6) + '.npz')) as chunk:
+                yield chunk['iterations'], deltaDecode(chunk['x']), deltaDecode(chunk['residuals'])
+
+    def __iter__(self):
+        for iterations, xs, residuals in self.iterChunks():
+            for iteration, x, errors in zip(iterations, xs, residuals):
+                yield int(iteration), x, errors
+
+    def toArrays(self):
+        """ Loads the whole trace.
+
+        :return: (iterations, xs, residuals) arrays with one row per recorded iteration
+        """
+        chunks = list(self.iterChunks())
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.param_names)), dtype=np.float32), \
+                   np.zeros((0, len(self.residual_names)), dtype=np.float32)
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
@@ -10,11 +10,15 @@ from copy import deepcopy
 
 from . import transformations
 
-# import KeyPressManager
-from OptimizationUtils import KeyPressManager
 import numpy as np
-import cv2
-from matplotlib import cm
+
+from OptimizationUtils.lazy import lazyImport
+
+# Imported on first use, most utilities do not need them
+cv2 = lazyImport('cv2')
+cm = lazyImport('matplotlib.cm')
+plt = lazyImport('matplotlib.pyplot')
+KeyPressManager = lazyImport('OptimizationUtils.KeyPressManager')
 
 # -------------------------------------------------------------------------------
 # --- FUNCTIONS
@@ -9,7 +9,7 @@ def read(fname):
 setup(
     name = "OptimizationUtils",
     version = "1.0.0",
-    install_requires=[],
+    install_requires=['scipy>=1.16.0'],  # least_squares callback and approx_derivative workers
     author = "Miguel Oliveira",
     author_email = "mike@todo.todo",
     description = ("A set of utilities for using the python scipy optimizer functions"),
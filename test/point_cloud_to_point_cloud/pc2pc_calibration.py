@@ -264,29 +264,19 @@ if __name__ == "__main__":
 
 
     for i, model in enumerate(models):
-        if i == 0:
-            # to fix model_0 as reference model, no POS change
-            bound_max_t = model.t + np.finfo(np.float32).eps
-            bound_min_t = model.t - np.finfo(np.float32).eps
-            bound_max_r = model.r + np.finfo(np.float32).eps
-            bound_min_r = model.r - np.finfo(np.float32).eps
-        else:
-            bound_max_t = None
-            bound_min_t = None
-            bound_max_r = None
-            bound_min_r = None
-
         opt.pushParamVector(group_name='model' + str(i) + '_t', data_key='models',
                             getter=partial(getterTranslation, i=i),
                             setter=partial(setterTranslation, i=i),
-                            suffix=['x', 'y', 'z'],
-                            bound_max=bound_max_t, bound_min=bound_min_t)
+                            suffix=['x', 'y', 'z'])
 
         opt.pushParamVector(group_name='model' + str(i) + '_r', data_key='models',
                             getter=partial(getterRotation, i=i),
                             setter=partial(setterRotation, i=i),
-                            suffix=['x', 'y', 'z'],
-                            bound_max=bound_max_r, bound_min=bound_min_r)
+                            suffix=['x', 'y', 'z'])
+
+    # to fix model_0 as reference model, no POS change
+    opt.freezeGroup('model0_t')
+    opt.freezeGroup('model0_r')
 
     opt.printParameters()
 
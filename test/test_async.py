@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Background optimizations: the future gives the result and the progress, and cancellation stops the solver.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def test_async_result():
+    reference = WORKLOADS['pc2pc']()
+    workload = WORKLOADS['pc2pc']()
+    with quiet():
+        reference.optimizer.startOptimization(optimization_options=reference.optimization_options)
+        future = workload.optimizer.startOptimizationAsync(optimization_options=workload.optimization_options)
+        result = future.result(timeout=60)
+
+    np.testing.assert_array_equal(result.x, reference.optimizer.result.x)
+    assert future.progress()[0] > 0
+    assert not workload.optimizer.lock.locked()
+
+
+def test_async_cancel():
+    workload = WORKLOADS['synthetic_calibration']()
+    opt = workload.optimizer
+    with quiet():
+        future = opt.startOptimizationAsync(optimization_options=workload.optimization_options)
+        while future.getNumberOfFunctionCalls() < 40 and not future.done():
+            time.sleep(0.01)
+        assert future.cancel()
+        future.join(timeout=60)
+
+    assert future.cancelled()
+    with pytest.raises(CancelledError):
+        future.result()
+    assert opt.result.message == 'Cancelled.'
+    assert opt.run.status['num_function_calls'] < 477  # the calls of the full optimization
+    assert not opt.lock.locked()
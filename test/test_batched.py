@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Batched objective functions give the same solution, objective function calls and iterations as unbatched ones.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+from OptimizationUtils.metrics import MetricsSink
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def solve(name, metrics=False):
+    workload = WORKLOADS[name]()
+    opt = workload.optimizer
+    opt.setHeadless(True)
+    sink = MetricsSink(lambda line: None) if metrics else None
+    opt.setMetricsSink(sink)
+    with quiet():
+        opt.startOptimization(optimization_options=workload.optimization_options)
+    if sink is not None:
+        sink.close()
+    return opt
+
+
+@pytest.mark.parametrize('name', ['cosine_fitting', 'gmm'])
+@pytest.mark.parametrize('metrics', [False, True])
+def test_batched_counts(name, metrics):
+    reference = solve(name, metrics=metrics)
+    opt = solve(name + '_batched', metrics=metrics)
+
+    assert opt.run.status['num_function_calls'] == reference.run.status['num_function_calls']
+    assert opt.run.status['num_iterations'] == reference.run.status['num_iterations']
+    assert opt.result.nfev == reference.result.nfev
+    np.testing.assert_allclose(opt.xf, reference.xf, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Problem capture: the captured evaluations are the ones of the optimization, and replay the solver path.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+from OptimizationUtils.capture import loadProblem
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+@pytest.mark.parametrize('name', ['cosine_fitting', 'cosine_fitting_batched', 'pc2pc_se3'])
+def test_capture_replay(name, tmp_path):
+    workload = WORKLOADS[name]()
+    opt = workload.optimizer
+    opt.setHeadless(True)
+    opt.setRecordEvaluations(True)
+    with quiet():
+        opt.startOptimization(optimization_options=workload.optimization_options)
+    opt.saveProblem(str(tmp_path / 'capture.npz'))
+
+    # the calls which count the function calls per iteration are not recorded
+    assert len(opt.recorded_evaluations) == opt.run.status['num_function_calls']
+
+    capture = loadProblem(str(tmp_path / 'capture.npz'))
+    result = capture.replay()
+    assert result.nfev == opt.result.nfev
+    np.testing.assert_allclose(result.cost, opt.result.cost)
+
+
+def test_capture_options_not_json(tmp_path):
+    workload = WORKLOADS['cosine_fitting']()
+    opt = workload.optimizer
+    opt.setHeadless(True)
+    opt.setRecordEvaluations(True)
+    options = dict(workload.optimization_options, loss=lambda z: np.array([z, np.ones_like(z), np.zeros_like(z)]))
+    with quiet():
+        opt.startOptimization(optimization_options=options)
+
+    with pytest.warns(UserWarning, match='loss'):
+        opt.saveProblem(str(tmp_path / 'capture.npz'))
+    capture = loadProblem(str(tmp_path / 'capture.npz'))
+    assert 'loss' not in capture.optimization_options
+    assert capture.replay().nfev == opt.result.nfev
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Optimization by components: the independent subproblems, solved separately, give the solution of the joint problem.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_components(num_workers):
+    reference = WORKLOADS['ball_detection']()
+    workload = WORKLOADS['ball_detection']()
+    opt = workload.optimizer
+    components = opt.getConnectedComponents()
+    assert len(components) == 4  # one per ball
+
+    with quiet():
+        reference.optimizer.startOptimization(optimization_options=reference.optimization_options)
+        result = opt.startOptimizationByComponents(optimization_options=workload.optimization_options,
+                                                   num_workers=num_workers)
+
+    assert result.success
+    assert [component['component'] for component in result.components] == list(range(len(components)))
+    assert result.nfev == sum(component['nfev'] for component in result.components)
+    assert all(component['nit'] > 0 for component in result.components)
+    # each component stops on its own convergence criteria, so the costs are close but not the same
+    np.testing.assert_allclose(result.cost, reference.optimizer.result.cost, rtol=1e-2)
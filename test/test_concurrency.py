@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Concurrent optimizations in one process: each optimizer, in its own thread, gives the same result as a sequential
+run, and an optimizer refuses to start while it is running.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def solve(workload):
+    workload.optimizer.setHeadless(True)
+    workload.optimizer.startOptimization(optimization_options=workload.optimization_options)
+    return workload.optimizer
+
+
+@pytest.mark.parametrize('name', ['cosine_fitting', 'pc2pc'])
+def test_threads_match_sequential(name):
+    with quiet():
+        reference = solve(WORKLOADS[name]())
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            optimizers = list(executor.map(solve, [WORKLOADS[name]() for _ in range(4)]))
+
+    for opt in optimizers:
+        np.testing.assert_array_equal(opt.xf, reference.xf)
+        assert opt.run.status == reference.run.status
+
+
+@pytest.mark.parametrize('start', [
+    lambda opt, options: opt.startOptimization(optimization_options=options),
+    lambda opt, options: opt.startOptimizationAsync(optimization_options=options),
+    lambda opt, options: opt.startMultiStartOptimization(num_starts=2, optimization_options=options, num_workers=1),
+    lambda opt, options: opt.startOptimizationByComponents(optimization_options=options),
+    lambda opt, options: opt.startStagedOptimization(),
+    lambda opt, options: opt.startCoarseToFineOptimization(optimization_options=options)],
+    ids=['startOptimization', 'startOptimizationAsync', 'startMultiStartOptimization',
+         'startOptimizationByComponents', 'startStagedOptimization', 'startCoarseToFineOptimization'])
+def test_refuses_to_start_while_running(start):
+    workload = WORKLOADS['pc2pc']()
+    opt = workload.optimizer
+    opt.setHeadless(True)
+    opt.addStage('all')
+
+    with opt.exclusiveRun():  # pretend that an optimization is running
+        with pytest.raises(ValueError, match='already running'):
+            start(opt, workload.optimization_options)
+    assert not opt.lock.locked()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Staged optimization: the stages warm start each other, reach the solution of a direct solve, and are recorded in a
+single trace.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+from OptimizationUtils.trace import TraceReader, TraceRecorder
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+@pytest.mark.parametrize('name', ['pc2pc', 'pc2pc_se3'])
+def test_stages(name, tmp_path):
+    reference = WORKLOADS[name]()
+    workload = WORKLOADS[name]()
+    opt = workload.optimizer
+    opt.setTraceRecorder(TraceRecorder(str(tmp_path / 'trace')))
+    groups = {model: [group_name for group_name in opt.groups if group_name.startswith(model)]
+              for model in ['model0', 'model1', 'model2', 'model3']}
+    opt.addStage('first', groups=groups['model1'] + groups['model2'],
+                 optimization_options=workload.optimization_options)
+    opt.addStage('second', groups=groups['model3'], optimization_options=workload.optimization_options)
+    opt.addStage('joint', optimization_options=workload.optimization_options)
+
+    with quiet():
+        reference.optimizer.startOptimization(optimization_options=reference.optimization_options)
+        result = opt.startStagedOptimization()
+
+    assert [stage['stage'] for stage in result.stages] == ['first', 'second', 'joint']
+    assert [stage['num_variables'] for stage in result.stages] == [12, 6, 18]  # model0 is frozen
+    assert all(stage['nit'] > 0 for stage in result.stages)
+    np.testing.assert_allclose(result.cost, reference.optimizer.result.cost, rtol=1e-3)
+    assert opt.x0 == reference.optimizer.x0
+
+    iterations, _, _ = TraceReader(str(tmp_path / 'trace')).toArrays()
+    np.testing.assert_array_equal(iterations, np.arange(len(iterations)))
+    assert len(iterations) >= sum(stage['nit'] for stage in result.stages)
+
+
+def test_stages_frozen():
+    opt = WORKLOADS['pc2pc']().optimizer
+    opt.addStage('frozen', groups=sorted(opt.frozen_groups))
+    with pytest.raises(ValueError, match='frozen'):
+        opt.startStagedOptimization()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Stopping rules: the optimization stops early with the best parameters, and its progress advances until then.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import time
+
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def solve(name, **stopping_rules):
+    workload = WORKLOADS[name]()
+    opt = workload.optimizer
+    opt.setHeadless(True)
+    opt.setStoppingRules(**stopping_rules)
+    t = time.perf_counter()
+    with quiet():
+        opt.startOptimization(optimization_options=workload.optimization_options)
+    return opt, time.perf_counter() - t
+
+
+def test_max_function_calls():
+    opt, _ = solve('synthetic_calibration', max_function_calls=100)
+
+    assert opt.result.message == 'Maximum number of objective function calls reached.'
+    assert opt.run.status['num_function_calls'] == 100
+    assert opt.run.progress[0] > 0  # the progress advances without a future or a stall rule
+    assert opt.result.cost <= opt.run.progress[1]  # the best parameters, not the last ones
+
+
+def test_time_budget():
+    opt, elapsed = solve('synthetic_calibration', time_budget=0.3)
+
+    assert opt.result.message == 'Deadline reached.'
+    assert elapsed < 1.0
+    assert opt.run.progress[0] > 0
+
+
+def test_stall():
+    reference, _ = solve('pc2pc')
+    opt, _ = solve('pc2pc', min_relative_improvement=0.5, window=2)
+
+    assert opt.run.status['num_function_calls'] < reference.run.status['num_function_calls']
+    assert opt.run.progress[0] >= 2
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Coarse to fine optimization: nested subsets of residuals, and a last level which reaches the solution of a direct
+solve.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+from OptimizationUtils import subsampling
+from OptimizationUtils.bench.runner import quiet
+from OptimizationUtils.bench.workloads import WORKLOADS
+from OptimizationUtils.trace import TraceReader, TraceRecorder
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def test_stratified_order():
+    np.testing.assert_array_equal(subsampling.stratifiedOrder(8), [0, 4, 2, 6, 1, 5, 3, 7])
+    assert sorted(subsampling.stratifiedOrder(13)) == list(range(13))
+
+
+@pytest.mark.parametrize('sampling', ['stratified', 'random'])
+def test_levels_are_nested(sampling):
+    blocks = [np.arange(10), np.arange(10, 14)]
+    levels = subsampling.sampleLevels(blocks, [0.2, 0.5, 1.0], sampling=sampling)
+
+    assert [len(level) for level in levels] == [2 + 1, 5 + 2, 14]
+    for coarse, fine in zip(levels[:-1], levels[1:]):
+        assert set(coarse) <= set(fine)
+
+
+@pytest.mark.parametrize('name', ['pc2pc', 'pc2pc_se3'])
+def test_coarse_to_fine(name, tmp_path):
+    reference = WORKLOADS[name](scale=4)
+    workload = WORKLOADS[name](scale=4)
+    opt = workload.optimizer
+    opt.setTraceRecorder(TraceRecorder(str(tmp_path / 'trace')))
+
+    with quiet():
+        reference.optimizer.startOptimization(optimization_options=reference.optimization_options)
+        result = opt.startCoarseToFineOptimization(fractions=(0.05, 0.25, 1.0),
+                                                   optimization_options=workload.optimization_options)
+
+    assert [level['num_residuals'] for level in result.levels][-1] == len(opt.residuals)
+    assert all(level['nit'] > 0 for level in result.levels)
+    assert opt.data_models['status']['active_residuals'] is None
+    assert result.levels[-1]['nfev'] < reference.optimizer.result.nfev
+    np.testing.assert_allclose(result.cost, reference.optimizer.result.cost, rtol=1e-3)
+
+    iterations, _, _ = TraceReader(str(tmp_path / 'trace')).toArrays()
+    np.testing.assert_array_equal(iterations, np.arange(len(iterations)))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Synthetic calibration problems: their sparse matrix, and the parameter names the residuals refer to.
+"""
+
+# -------------------------------------------------------------------------------
+# --- IMPORTS (standard, then third party, then my own modules)
+# -------------------------------------------------------------------------------
+import pytest
+
+from OptimizationUtils.synthetic import SyntheticProblem
+
+
+# -------------------------------------------------------------------------------
+# --- FUNCTIONS
+# -------------------------------------------------------------------------------
+def test_sparse_matrix_shape():
+    opt = SyntheticProblem(num_cameras=2, num_lidars=1, num_collections=3, seed=0).buildOptimizer()
+    opt.computeSparseMatrix()
+
+    assert opt.sparse_matrix.shape == (len(opt.residuals), len(opt.x))
+    assert opt.sparse_matrix.getnnz(axis=0).all()  # every parameter affects some residual
+
+
+def test_duplicate_param_names():
+    opt = SyntheticProblem(num_cameras=1, num_lidars=1, num_collections=1, seed=0).buildOptimizer()
+    group_name = next(iter(opt.groups))
+    group = opt.groups[group_name]
+    num_params = len(opt.x)
+
+    with pytest.raises(ValueError, match='already exists'):  # a name of an existing parameter
+        opt.pushParamVector(group_name[:-1], group.data_key, group.getter, group.setter,
+                            suffix=[param_name[len(group_name) - 1:] for param_name in group.param_names])
+    with pytest.raises(ValueError, match='already exists'):  # the same name twice in a group
+        opt.pushParamVector('new', group.data_key, group.getter, group.setter,
+                            suffix=['_a'] * len(group.param_names))
+    assert len(opt.x) == num_params